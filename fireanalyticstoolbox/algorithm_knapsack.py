@@ -515,6 +515,7 @@ class RasterKnapsackAlgorithm(QgsProcessingAlgorithm):
             extent,
             crs,
             nodata=self.NODATA,
+            feedback=feedback,
         )
         feedback.setProgress(100)
         feedback.setProgressText("Writing new raster to file ended, progress 100%")
@@ -39,24 +39,23 @@ __copyright__ = "(C) 2023 by Fernando Badilla Veliz - Fire2a.com"
 
 __revision__ = "$Format:%H$"
 
-from functools import partial
 from multiprocessing import Pool, cpu_count
 from os import sep
 from pathlib import Path
 from pickle import dump as pickle_dump
-from pickle import load as pickle_load
 from platform import system as platform_system
-from re import search
 from typing import Any, Tuple
 
 import processing
 from fire2a.cell2fire import glob_numbered_files
 from fire2a.raster import id2xy, read_raster, transform_coords_to_georef
 from fire2a.utils import loadtxt_nodata
-from networkx import DiGraph, MultiDiGraph, betweenness_centrality, single_source_dijkstra_path
+from networkx import MultiDiGraph
+from networkx import betweenness_centrality as nx_betweenness_centrality
 from numpy import any as np_any
-from numpy import array, float32, int16, int32, loadtxt, ndarray, sqrt, vectorize, vstack, zeros
-from osgeo import gdal, osr
+from numpy import (array, column_stack, flatnonzero, float32, float64, int16, int32, isnan, loadtxt, savetxt, sqrt,
+                   vectorize, vstack, zeros)
+from osgeo import gdal, ogr, osr
 from osgeo.gdal import GDT_Float32, GDT_Int16
 from qgis.core import (Qgis, QgsColorRampShader, QgsFeature, QgsFeatureSink, QgsField, QgsFields, QgsGeometry,
                        QgsGraduatedSymbolRenderer, QgsLineString, QgsMessageLog, QgsPalettedRasterRenderer, QgsPoint,
@@ -64,16 +63,31 @@ from qgis.core import (Qgis, QgsColorRampShader, QgsFeature, QgsFeatureSink, Qgs
                        QgsProcessingLayerPostProcessorInterface, QgsProcessingParameterBoolean,
                        QgsProcessingParameterDefinition, QgsProcessingParameterEnum, QgsProcessingParameterFeatureSink,
                        QgsProcessingParameterFile, QgsProcessingParameterFileDestination,
-                       QgsProcessingParameterFolderDestination, QgsProcessingParameterNumber,
-                       QgsProcessingParameterRasterDestination, QgsProcessingParameterRasterLayer, QgsProcessingUtils,
-                       QgsProject, QgsRasterBandStats, QgsRasterFileWriter, QgsRasterShader,
-                       QgsSingleBandPseudoColorRenderer, QgsWkbTypes)
+                       QgsProcessingParameterFolderDestination, QgsProcessingParameterMultipleLayers,
+                       QgsProcessingParameterNumber, QgsProcessingParameterRasterDestination,
+                       QgsProcessingParameterRasterLayer, QgsProcessingParameterString, QgsProcessingUtils, QgsProject,
+                       QgsRasterBandStats, QgsRasterFileWriter, QgsRasterShader, QgsSingleBandPseudoColorRenderer,
+                       QgsVectorFileWriter, QgsWkbTypes)
 from qgis.PyQt.QtCore import QCoreApplication, QVariant
 from qgis.PyQt.QtGui import QColor, QIcon
 from scipy import stats as scipy_stats
 
-from .algorithm_utils import get_output_raster_format, write_log
+from .algorithm_utils import RasterWriter, get_peak_memory, write_log
 from .config import NAME, SIM_OUTPUTS, STATS, TAG, jolo
+from .post_processing.centrality import PropagationGraph, adaptive_betweenness_centrality, betweenness_centrality
+from .post_processing.dpv import downstream_protection_value
+from .post_processing.messages import EdgeFrequencyAccumulator, MessagesIngestion, cells_georef
+from .post_processing.polygons import polygonize_scars
+from .post_processing.results import (SCAR_SOURCE, BandWriter, Exceedance, FusedResultsPass, MeanStd, QuantileSketch,
+                                      SimulationSummary, final_scar_files, join_simulations, numbered, numbered_files,
+                                      read_asc_file, read_scar_file, scar_files)
+from .post_processing.scars import (CUBE_AGGREGATES, CUBE_KIND, ScarCubeAccumulator, ScarStoreAccumulator,
+                                    bp_convergence, build_scar_cube, burn_probability, burned_areas, cube_aggregate,
+                                    cube_burned_cells, open_scar_store, parse_simulation_ids, scar_cube_file,
+                                    scar_store_file, scars_signature, simulations_needed, wilson_width)
+from .post_processing.store import MESSAGES_EXT, load_messages
+from .post_processing.trees import (build_tree_cache, messages_signature, open_tree_cache, tree_cache_file,
+                                    tree_centrality)
 
 # from matplotlib import colormaps
 # from matplotlib.colors import to_rgba_array
@@ -219,6 +233,7 @@ class PostSimulationAlgorithm(QgsProcessingAlgorithm):
     RESULTS_DIR = "ResultsDirectory"
     MSGS = "EnablePropagationDiGraph"
     POLYSCARS = "EnablePropagationScars"
+    THREADS = "Threads"
 
     def initAlgorithm(self, config):
         """inputs and output of the algorithm"""
@@ -246,6 +261,17 @@ class PostSimulationAlgorithm(QgsProcessingAlgorithm):
                 optional=True,
             )
         )
+        qppn = QgsProcessingParameterNumber(
+            name=self.THREADS,
+            description=self.tr("Maximum number of processes reading result files simultaneously"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=cpu_count() - 1,
+            optional=True,
+            minValue=1,
+            maxValue=cpu_count(),
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
         project_path = QgsProject().instance().absolutePath()
         project_path = project_path if project_path != "" else None
         self.addParameter(
@@ -331,81 +357,130 @@ class PostSimulationAlgorithm(QgsProcessingAlgorithm):
             feedback.reportError(f"{log_file} not found or empty!")
             raise QgsProcessingException(f"{log_file} not found or empty!")
 
-        # stats
+        # fused pass: final scars, burn probability and statistics, reading each result file once
+        _, raster_props = read_raster(base_raster.publicSource(), data=False)
+        W, H, GT = raster_props["RasterXSize"], raster_props["RasterYSize"], raster_props["Transform"]
+        if not (authid := raster_props["Projection"]):
+            authid = base_raster.crs().authid()
+        fused = FusedResultsPass(H, W)
+        rasters = []
+        stat_products = []
+        summaries = {}
         for stat in STATS:
             if sample_file := next(Path(results_dir).glob(stat["dir"] + sep + stat["file"] + "*" + stat["ext"]), None):
-                stat_out = processing.run(
-                    "fire2a:statistic",
-                    {
-                        "BaseLayer": base_raster,
-                        "SampleStatisticFile": str(sample_file),
-                        "DataType": stat["dtype"],
-                        "OutputRaster": QgsProcessing.TEMPORARY_OUTPUT,
-                        "OutputRasterStats": QgsProcessing.TEMPORARY_OUTPUT,
-                    },
-                    context=context,
-                    feedback=feedback,
-                    is_child_algorithm=True,
-                )
-                # ui load
-                # each sim in a band
-                layer_details = context.LayerDetails(
-                    stat["name"],
-                    context.project(),
-                    stat["name"],
-                    QgsProcessingUtils.LayerHint.Raster,
-                )
-                layer_details.groupName = NAME["layer_group"]
-                layer_details.layerSortKey = 5
-                context.addLayerToLoadOnCompletion(stat_out["OutputRaster"], layer_details)
-                if stat["dtype"] == "float32":
-                    context.layerToLoadOnCompletionDetails(stat_out["OutputRaster"]).setPostProcessor(
-                        run_alg_styler(
-                            stat["name"],
-                        )
-                    )
-                else:
-                    context.layerToLoadOnCompletionDetails(stat_out["OutputRaster"]).setPostProcessor(
-                        run_alg_styler_bin(
-                            stat["name"],
-                        )
+                if not (files := numbered_files(sample_file)):
+                    continue
+                fused.add_source(stat["name"], files, read_asc_file)
+                stat_raster = QgsProcessingUtils.generateTempFilename(f"{stat['file']}.tif")
+                rasters += [create_raster(stat_raster, W, H, len(files), GDT_Float32, GT, authid, feedback)]
+                fused.attach(stat["name"], band_writer(rasters[-1]))
+                stat_products += [(stat, stat_raster, fused.attach(stat["name"], MeanStd(H, W)))]
+                summaries[stat["short"]] = (list(files), fused.attach(stat["name"], SimulationSummary(len(files))))
+        grids = [item for item in SIM_OUTPUTS if item["name"] == "Propagation Fire Scars"][0]
+        scar_raster, bplayer = None, None
+        sample_file = next(Path(results_dir).glob(grids["dir"] + "*" + sep + grids["file"] + "*" + grids["ext"]), None)
+        if sample_file and (final_scars := final_scar_files(sample_file)):
+            fused.add_source(SCAR_SOURCE, final_scars, read_scar_file)
+            scar_raster = QgsProcessingUtils.generateTempFilename("FinalScars.tif")
+            rasters += [create_raster(scar_raster, W, H, len(final_scars), gdal.GDT_Byte, GT, authid, feedback)]
+            fused.attach(SCAR_SOURCE, band_writer(rasters[-1]))
+            scar_store = attach_scar_store(fused, sample_file, final_scars, H, W, feedback)
+            summaries[SCAR_SOURCE] = (list(final_scars), fused.attach(SCAR_SOURCE, SimulationSummary(len(final_scars))))
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        feedback.setProgressText(f"Reading simulation results in a {threads}-lane parallel execution pool")
+        fused.run(threads, feedback)
+        for raster in rasters:
+            raster.close()
+        if feedback.isCanceled():
+            raise QgsProcessingException("Algorithm cancelled by user")
+        if scar_raster:
+            bplayer = QgsProcessingUtils.generateTempFilename("BurnProbability.tif")
+            write_bands(bplayer, [burn_probability(close_scar_store(scar_store, sample_file))], GT, authid, feedback)
+
+        for stat, stat_raster, mean_std in stat_products:
+            stat_summary = QgsProcessingUtils.generateTempFilename(f"{stat['file']}_mean_std.tif")
+            write_bands(stat_summary, mean_std.result(), GT, authid, feedback, mean_std.names())
+            # ui load
+            # each sim in a band
+            layer_details = context.LayerDetails(
+                stat["name"],
+                context.project(),
+                stat["name"],
+                QgsProcessingUtils.LayerHint.Raster,
+            )
+            layer_details.groupName = NAME["layer_group"]
+            layer_details.layerSortKey = 5
+            context.addLayerToLoadOnCompletion(stat_raster, layer_details)
+            if stat["dtype"] == "float32":
+                context.layerToLoadOnCompletionDetails(stat_raster).setPostProcessor(
+                    run_alg_styler(
+                        stat["name"],
                     )
-                output_dict[stat["name"]] = stat_out["OutputRaster"]
-                # mean & stddev
-                layer_details = context.LayerDetails(
-                    "Mean&StdDev " + stat["name"],
-                    context.project(),
-                    "Mean&StdDev " + stat["name"],
-                    QgsProcessingUtils.LayerHint.Raster,
                 )
-                layer_details.groupName = NAME["layer_group"]
-                layer_details.layerSortKey = 4
-                context.addLayerToLoadOnCompletion(stat_out["OutputRasterStats"], layer_details)
-                context.layerToLoadOnCompletionDetails(stat_out["OutputRasterStats"]).setPostProcessor(
-                    run_alg_styler(
-                        "Mean&StdDev " + stat["name"],
+            else:
+                context.layerToLoadOnCompletionDetails(stat_raster).setPostProcessor(
+                    run_alg_styler_bin(
+                        stat["name"],
                     )
                 )
-                output_dict[stat["name"] + "Stats"] = stat_out["OutputRasterStats"]
+            output_dict[stat["name"]] = stat_raster
+            # mean & stddev
+            layer_details = context.LayerDetails(
+                "Mean&StdDev " + stat["name"],
+                context.project(),
+                "Mean&StdDev " + stat["name"],
+                QgsProcessingUtils.LayerHint.Raster,
+            )
+            layer_details.groupName = NAME["layer_group"]
+            layer_details.layerSortKey = 4
+            context.addLayerToLoadOnCompletion(stat_summary, layer_details)
+            context.layerToLoadOnCompletionDetails(stat_summary).setPostProcessor(
+                run_alg_styler(
+                    "Mean&StdDev " + stat["name"],
+                )
+            )
+            output_dict[stat["name"] + "Stats"] = stat_summary
+
+        # per simulation summary: from the grids already read and the ignitions log, no extra grid reading
+        ignitions = loadtxt(log_file, delimiter=",", skiprows=1, dtype=[("sim", int32), ("cellid", int32)], ndmin=1)
+        summary_columns = {"ignition_cell": (ignitions["sim"], ignitions["cellid"])}
+        if SCAR_SOURCE in summaries:
+            sim_ids, scar_summary = summaries.pop(SCAR_SOURCE)
+            summary_columns["duration"] = (sim_ids, [numbered(afile) for afile in final_scars.values()])
+            summary_columns["burned_cells"] = (sim_ids, scar_summary.cells)
+            summary_columns["burned_area"] = (sim_ids, scar_summary.cells * abs(GT[1] * GT[5]))
+            feedback.pushInfo(f"Burned area stats: {scipy_stats.describe(summary_columns['burned_area'][1])}")
+        for short, (sim_ids, stat_summary) in summaries.items():
+            summary_columns[f"{short}_max"] = (sim_ids, stat_summary.maximum)
+            summary_columns[f"{short}_mean"] = (sim_ids, stat_summary.mean)
+        summary_table = QgsProcessingUtils.generateTempFilename("SimulationSummary.gpkg")
+        write_table(
+            summary_table,
+            "simulation_summary",
+            join_simulations(summary_columns),
+            integers=["simulation", "ignition_cell", "duration", "burned_cells"],
+        )
+        layer_details = context.LayerDetails(
+            "Simulation Summary", context.project(), "Simulation Summary", QgsProcessingUtils.LayerHint.Vector
+        )
+        layer_details.forceName = True
+        layer_details.groupName = NAME["layer_group"]
+        layer_details.layerSortKey = 0
+        context.addLayerToLoadOnCompletion(summary_table, layer_details)
+        output_dict["SimulationSummary"] = summary_table
 
         # grids
-        grids = [item for item in SIM_OUTPUTS if item["name"] == "Propagation Fire Scars"][0]
-        if sample_file:= next(Path(results_dir).glob(grids["dir"] + "*" + sep + grids["file"] + "*" + grids["ext"]), None):  # fmt: skip
-            scar_in_dict = {
-                "BaseLayer": base_raster,
-                "SampleScarFile": str(sample_file),
-                "ScarRaster": QgsProcessing.TEMPORARY_OUTPUT,
-                "BurnProbability": QgsProcessing.TEMPORARY_OUTPUT,
-            }
+        if scar_raster:
+            scar_out = {"ScarRaster": scar_raster, "BurnProbability": bplayer}
             if self.parameterAsBool(parameters, self.POLYSCARS, context):
-                scar_in_dict["ScarPolygon"] = QgsProcessing.TEMPORARY_OUTPUT
-            scar_out = processing.run(
-                "fire2a:scar",
-                scar_in_dict,
-                context=context,
-                feedback=feedback,
-                is_child_algorithm=True,
-            )
+                # propagation polygons need every period grid, final scars and burn probability are already done
+                scar_out["ScarPolygon"] = QgsProcessingUtils.generateTempFilename("PropagationScars.gpkg")
+                feedback.setProgressText("Polygonizing propagation scars")
+                polygonize_scars(
+                    scar_files(sample_file), scar_out["ScarPolygon"], GT, authid, threads=threads, feedback=feedback
+                )
+                if feedback.isCanceled():
+                    raise QgsProcessingException("Algorithm cancelled by user")
             # final scars raster
             if scar_raster := scar_out.get("ScarRaster"):
                 # layer_details = context.layerToLoadOnCompletionDetails(scar_raster)
@@ -450,28 +525,6 @@ class PostSimulationAlgorithm(QgsProcessingAlgorithm):
                 layer_details.layerSortKey = 3
                 context.addLayerToLoadOnCompletion(scar_poly, layer_details)
                 output_dict["ScarPolygon"] = scar_poly
-                """
-                if scar_fixed_geom := processing.run(
-                    "native:fixgeometries",
-                    {"INPUT": scar_poly, "METHOD": 1, "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT},
-                    context=context,
-                    feedback=feedback,
-                    is_child_algorithm=True,
-                ):
-                    # feedback.pushDebugInfo(f"{scar_fixed_geom=}")
-                    if scar_fixed_geom := scar_fixed_geom.get("OUTPUT"):
-                        layer_details = context.LayerDetails(
-                            "Propagation Scars",
-                            context.project(),
-                            "Propagation Scars",
-                            QgsProcessingUtils.LayerHint.Vector,
-                        )
-                        layer_details.forceName = True
-                        layer_details.groupName = NAME["layer_group"]
-                        layer_details.layerSortKey = 3
-                        context.addLayerToLoadOnCompletion(scar_fixed_geom, layer_details)
-                        output_dict["ScarPolygon"] = scar_fixed_geom
-                """
 
         # messages
         if self.parameterAsBool(parameters, self.MSGS, context):
@@ -483,6 +536,7 @@ class PostSimulationAlgorithm(QgsProcessingAlgorithm):
                         "BaseLayer": base_raster,
                         "SampleMessagesFile": str(sample_file),
                         "PropagationDirectedGraph": QgsProcessing.TEMPORARY_OUTPUT,
+                        "PropagationEdgeFrequency": QgsProcessing.TEMPORARY_OUTPUT,
                     },
                     context=context,
                     feedback=feedback,
@@ -504,6 +558,23 @@ class PostSimulationAlgorithm(QgsProcessingAlgorithm):
                     run_alg_styler_propagation()
                 )
                 output_dict["PropagationDirectedGraph"] = msg_out["PropagationDirectedGraph"]
+                layer_details = QgsProcessingContext.LayerDetails(
+                    "Propagation Edge Frequency",
+                    context.project(),
+                    "Propagation Edge Frequency",
+                    QgsProcessingUtils.LayerHint.Vector,
+                )
+                layer_details.groupName = NAME["layer_group"]
+                layer_details.layerSortKey = 2
+                context.addLayerToLoadOnCompletion(
+                    msg_out["PropagationEdgeFrequency"],
+                    layer_details,
+                )
+                context.layerToLoadOnCompletionDetails(msg_out["PropagationEdgeFrequency"]).setPostProcessor(
+                    run_alg_styler_propagation(class_attribute="frequency", subset=None)
+                )
+                output_dict["PropagationEdgeFrequency"] = msg_out["PropagationEdgeFrequency"]
+                output_dict["MessageStore"] = msg_out["MessageStore"]
 
         write_log(feedback, name=self.name())
         return output_dict
@@ -535,8 +606,10 @@ class PostSimulationAlgorithm(QgsProcessingAlgorithm):
             Be safe by counting them first: Go to results/Messages folder:<br>
              - using bash $ wc -l Messages*csv<br>
              - using PowerShell > Get-Content Messages*.csv | Measure-Object -Line<br>
-            To process but not display them, use Propagation DiGraph algorithm directly, unchecking 'Open output file after running algorithm'<br><br>
-            <i>The visualization alternative is <b>Propagation Fire Scars</b>. Or even <b>Final Fire Scar</b>, recommended for very large simulations</i>
+            To process but not display them, use Propagation DiGraph algorithm directly, unchecking 'Open output file after running algorithm'<br>
+            Enabling it also stores the messages (see the DPV and BC metrics) and adds a <b>Propagation Edge Frequency</b> layer: one arrow per unique directed cell pair, with its traversal count, frequency and min/mean/max arrival time; its size is bounded by the landscape, not by the number of simulations<br><br>
+            <i>The visualization alternative is <b>Propagation Fire Scars</b>. Or even <b>Final Fire Scar</b>, recommended for very large simulations</i><br><br>
+            A <b>Simulation Summary</b> table (one row per simulation: ignition cell, duration in periods, burned cells and area, max and mean of each available fire behavior statistic over its burned cells) is computed while the grids are read, without extra reading
             """
         )
 
@@ -549,7 +622,11 @@ class MessagesSIMPP(QgsProcessingAlgorithm):
     BASE_LAYER = "BaseLayer"
     IN_MSG = "SampleMessagesFile"
     OUTPUT_LAYER = "PropagationDirectedGraph"
+    OUTPUT_FREQ = "PropagationEdgeFrequency"
+    OUT_STORE = "MessageStore"
     OUT_PICKLED = "PickledMessages"
+    THREADS = "Threads"
+    IN_INCREMENTAL = "Incremental"
 
     def checkParameterValues(self, parameters: dict[str, Any], context: QgsProcessingContext) -> tuple[bool, str]:
         files, msg_dir, msg_name, ext = glob_numbered_files(
@@ -589,19 +666,62 @@ class MessagesSIMPP(QgsProcessingAlgorithm):
                 optional=True,
             )
         )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                name=self.OUTPUT_FREQ,
+                description=self.tr(
+                    "Output propagation edge frequency layer (all simulations aggregated into unique directed cell pairs)"
+                ),
+                type=QgsProcessing.TypeVectorLine,
+                optional=True,
+                createByDefault=False,
+            )
+        )
         qparamfd = QgsProcessingParameterFileDestination(
-            name=self.OUT_PICKLED,
+            name=self.OUT_STORE,
             description=self.tr(
-                "Output pickled messages file (needed by BC or DPV metrics, defaults to"
-                " results/Messages/messages.pickle)"
+                "Output messages store (needed by BC or DPV metrics, defaults to"
+                f" results/Messages/messages.{MESSAGES_EXT})"
             ),
+            fileFilter=f"message store files (*.{MESSAGES_EXT})",
+            optional=True,
+            createByDefault=False,
+        )
+        qparamfd.setMetadata({"widget_wrapper": {"dontconfirmoverwrite": True}})
+        self.addParameter(qparamfd)
+        qparamfd = QgsProcessingParameterFileDestination(
+            name=self.OUT_PICKLED,
+            description=self.tr("Output legacy pickled messages file (only written if set)"),
             fileFilter="pickled files (*.pickle)",
             # defaultValue=defaultValue,
             optional=True,
             createByDefault=False,
         )
         qparamfd.setMetadata({"widget_wrapper": {"dontconfirmoverwrite": True}})
+        qparamfd.setFlags(qparamfd.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(qparamfd)
+        qppn = QgsProcessingParameterNumber(
+            name=self.THREADS,
+            description=self.tr("Maximum number of processes parsing messages files simultaneously"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=cpu_count() - 1,
+            optional=True,
+            minValue=1,
+            maxValue=cpu_count(),
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+        qppb = QgsProcessingParameterBoolean(
+            name=self.IN_INCREMENTAL,
+            description=self.tr(
+                "Reuse the existing messages store, only parsing new or changed messages files (tracked by size,"
+                " modification time and content hash in its manifest)"
+            ),
+            defaultValue=True,
+            optional=True,
+        )
+        qppb.setFlags(qppb.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppb)
 
     def processAlgorithm(self, parameters, context, feedback):
         """Here is where the processing itself takes place."""
@@ -611,7 +731,6 @@ class MessagesSIMPP(QgsProcessingAlgorithm):
         feedback.pushDebugInfo(f"base_raster.crs(): {base_raster.crs()}")
         GT = raster_props["Transform"]
         W = raster_props["RasterXSize"]
-        H = raster_props["RasterYSize"]
         # set output layer
         fields = QgsFields()
         fields.append(QgsField(name="simulation", type=QVariant.Int, len=10))
@@ -627,6 +746,22 @@ class MessagesSIMPP(QgsProcessingAlgorithm):
         )
         # feedback.pushDebugInfo(f"dest_id: {dest_id}, type: {type(dest_id)}")
         # feedback.pushDebugInfo(f"sink: {sink}, type: {type(sink)}")
+        # aggregated output layer
+        freq_fields = QgsFields()
+        freq_fields.append(QgsField(name="count", type=QVariant.Int, len=10))
+        freq_fields.append(QgsField(name="frequency", type=QVariant.Double))
+        freq_fields.append(QgsField(name="time_min", type=QVariant.Int, len=10))
+        freq_fields.append(QgsField(name="time_mean", type=QVariant.Double))
+        freq_fields.append(QgsField(name="time_max", type=QVariant.Int, len=10))
+        (freq_sink, freq_dest_id) = self.parameterAsSink(
+            parameters,
+            self.OUTPUT_FREQ,
+            context,
+            freq_fields,
+            QgsWkbTypes.MultiLineString,
+            base_raster.crs(),
+        )
+        edge_frequency = EdgeFrequencyAccumulator() if freq_sink else None
         # get messages
         sample_messages_file = Path(self.parameterAsString(parameters, self.IN_MSG, context))
         files, msg_dir, msg_name, ext = glob_numbered_files(sample_messages_file)
@@ -635,47 +770,43 @@ class MessagesSIMPP(QgsProcessingAlgorithm):
             feedback.reportError(f"{msg_dir} does not contain any non-empty '{msg_name}[0-9]*{ext}' files")
             raise QgsProcessingException(f"{msg_dir} does not contain any non-empty '{msg_name}[0-9]*{ext}' files")
         feedback.pushDebugInfo(f"{len(files)} messages files, first: {files[0]}...")
-        # build digraphs
+        # message store
+        store_filename = self.parameterAsFileOutput(parameters, self.OUT_STORE, context)
+        if store_filename == "":
+            store_filename = Path(sample_messages_file.parent, f"messages.{MESSAGES_EXT}")
+        feedback.pushDebugInfo(f"{store_filename=}")
+        ingestion = MessagesIngestion(
+            files, store_filename, incremental=self.parameterAsBool(parameters, self.IN_INCREMENTAL, context)
+        )
+        feedback.pushInfo(ingestion.summary())
+        # legacy pickle
+        pickle_filename = self.parameterAsFileOutput(parameters, self.OUT_PICKLED, context)
+        # already ingested simulations are only read back if some output needs them
+        yield_cached = bool(sink or edge_frequency or pickle_filename)
+        total = len(files) if yield_cached else len(ingestion.to_parse)
+        # parse in parallel, keeping simulation id order
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        feedback.pushDebugInfo(
+            f"Parsing {len(ingestion.to_parse)} messages files in a {threads}-lane parallel execution pool"
+        )
         data = []
-        for count, afile in enumerate(files):
-            sim_id = search("\\d+", afile.stem).group(0)
-            data += [
-                loadtxt(
-                    afile, delimiter=",", dtype=[("i", int32), ("j", int32), ("t", int32)], usecols=(0, 1, 2), ndmin=1
-                )
-            ]
-            # 1 based to 0 based
-            data[-1]["i"] -= 1
-            data[-1]["j"] -= 1
-            feedback.pushDebugInfo(f"simulation id: {sim_id}, edges: {len(data)}")
+        messages = ingestion.ingest(threads, yield_cached=yield_cached)
+        for count, (sim_id, sim_data) in enumerate(messages):
+            if pickle_filename:
+                data += [sim_data]
+            feedback.pushDebugInfo(f"simulation id: {sim_id}, edges: {len(sim_data)}")
             if sink:
-                # build line add to sink
-                for i, j, time in data[-1]:
-                    i_x_px, i_y_ln = id2xy(i, W, H)
-                    i_x_geo, i_y_geo = transform_coords_to_georef(i_x_px + 0.5, i_y_ln + 0.5, GT)
-                    # feedback.pushDebugInfo(f"i_x_geo, i_y_geo: {i_x_geo}, {i_y_geo}, time: {time}")
-                    j_x_px, j_y_ln = id2xy(j, W, H)
-                    j_x_geo, j_y_geo = transform_coords_to_georef(j_x_px + 0.5, j_y_ln + 0.5, GT)
-                    # feedback.pushDebugInfo(f"j_x_geo, j_y_geo: {j_x_geo}, {j_y_geo}, time: {time}")
-                    # TODO id = int(f"{str(sim_id).zfill(total_sims)}_{i.zfill...}_{j}")
-                    feature = QgsFeature(fields)
-                    # feature.setId(int(sim_id))
-                    feature.setAttributes([int(sim_id), int(time)])
-                    feature.setGeometry(QgsLineString([QgsPoint(i_x_geo, i_y_geo), QgsPoint(j_x_geo, j_y_geo)]))
-                    sink.addFeature(feature, QgsFeatureSink.FastInsert)
-                    # feedback.pushDebugInfo(f"j_x_geo, j_y_geo: {j_x_geo}, {j_y_geo}, time: {time}, sim_idx: {sim_idx}")
-                    if feedback.isCanceled():
-                        break
-            elif feedback.isCanceled():
+                add_messages_to_sink(sink, fields, sim_id, sim_data, W, GT, feedback)
+            if edge_frequency:
+                edge_frequency.add(sim_data["i"], sim_data["j"], sim_data["t"])
+            if feedback.isCanceled():
+                messages.close()
                 break
-            feedback.setProgress(int(count * len(files)))
+            feedback.setProgress(int((count + 1) / total * 100))
 
-        filename = self.parameterAsFileOutput(parameters, self.OUT_PICKLED, context)
-        # feedback.pushCommandInfo(f"filename: {filename}, type: {type(filename)}")
-        if filename == "":
-            filename = Path(sample_messages_file.parent, "messages.pickle")
-        with open(filename, "wb") as f:
-            pickle_dump(data, f)
+        if pickle_filename:
+            with open(pickle_filename, "wb") as f:
+                pickle_dump(data, f)
 
         # handle_post_processing(context, feedback, layer_id=dest_id, style="propagation")
         if context.willLoadLayerOnCompletion(dest_id):
@@ -688,8 +819,26 @@ class MessagesSIMPP(QgsProcessingAlgorithm):
             context.addLayerToLoadOnCompletion(dest_id, layer_details)
             context.layerToLoadOnCompletionDetails(dest_id).setPostProcessor(run_alg_styler_propagation())
 
+        if freq_sink:
+            add_edge_frequency_to_sink(freq_sink, freq_fields, edge_frequency, W, GT, feedback)
+            if context.willLoadLayerOnCompletion(freq_dest_id):
+                layer_details = context.LayerDetails(
+                    "Propagation Edge Frequency", context.project(), freq_dest_id, QgsProcessingUtils.LayerHint.Vector
+                )
+                layer_details.groupName = NAME["layer_group"]
+                layer_details.layerSortKey = 1
+                context.addLayerToLoadOnCompletion(freq_dest_id, layer_details)
+                context.layerToLoadOnCompletionDetails(freq_dest_id).setPostProcessor(
+                    run_alg_styler_propagation(class_attribute="frequency", subset=None)
+                )
+
         write_log(feedback, name=self.name())
-        return {self.OUTPUT_LAYER: dest_id, self.OUT_PICKLED: str(filename)}
+        return {
+            self.OUTPUT_LAYER: dest_id,
+            self.OUTPUT_FREQ: freq_dest_id,
+            self.OUT_STORE: str(store_filename),
+            self.OUT_PICKLED: pickle_filename,
+        }
 
     # def postProcessAlgorithm(self, context, feedback):
     #     """Called after processAlgorithm, use it to load the layer and set the symbology"""
@@ -727,9 +876,138 @@ class MessagesSIMPP(QgsProcessingAlgorithm):
     def shortHelpString(self):
         return self.tr(
             "Warning: Uncheck 'Open output file after running algorithm' if the graph is too big or your computer too slow."
+            "<br>The <b>edge frequency</b> output aggregates all simulations into unique directed cell pairs (traversal"
+            " count, frequency and min/mean/max arrival time), its size is bounded by the landscape instead."
         )
 
 
+def add_messages_to_sink(sink, fields, sim_id, data, W, GT, feedback, chunk_size=10000):
+    """Add one simulation messages as line features (from cell center to cell center), in chunks
+
+    Coordinates are computed for all edges at once with numpy, features are pushed with sink.addFeatures
+    """
+    i_x_geo, i_y_geo = cells_georef(data["i"], W, GT)
+    j_x_geo, j_y_geo = cells_georef(data["j"], W, GT)
+    times = data["t"].tolist()
+    sim_id = int(sim_id)
+    for start in range(0, len(data), chunk_size):
+        stop = start + chunk_size
+        features = []
+        for ix, iy, jx, jy, time in zip(
+            i_x_geo[start:stop].tolist(),
+            i_y_geo[start:stop].tolist(),
+            j_x_geo[start:stop].tolist(),
+            j_y_geo[start:stop].tolist(),
+            times[start:stop],
+        ):
+            feature = QgsFeature(fields)
+            feature.setAttributes([sim_id, time])
+            feature.setGeometry(QgsLineString([ix, jx], [iy, jy]))
+            features += [feature]
+        sink.addFeatures(features, QgsFeatureSink.FastInsert)
+        if feedback.isCanceled():
+            break
+
+
+def add_edge_frequency_to_sink(sink, fields, edge_frequency, W, GT, feedback, chunk_size=10000):
+    """Add the aggregated unique directed cell pairs as line features, in chunks"""
+    i, j, count, tmin, tmean, tmax = edge_frequency.result()
+    feedback.pushInfo(f"{len(i)} unique propagation edges over {edge_frequency.simulations} simulations")
+    i_x_geo, i_y_geo = cells_georef(i, W, GT)
+    j_x_geo, j_y_geo = cells_georef(j, W, GT)
+    frequency = count / max(edge_frequency.simulations, 1)
+    for start in range(0, len(i), chunk_size):
+        stop = start + chunk_size
+        features = []
+        for ix, iy, jx, jy, attributes in zip(
+            i_x_geo[start:stop].tolist(),
+            i_y_geo[start:stop].tolist(),
+            j_x_geo[start:stop].tolist(),
+            j_y_geo[start:stop].tolist(),
+            zip(
+                count[start:stop].tolist(),
+                frequency[start:stop].tolist(),
+                tmin[start:stop].tolist(),
+                tmean[start:stop].tolist(),
+                tmax[start:stop].tolist(),
+            ),
+        ):
+            feature = QgsFeature(fields)
+            feature.setAttributes(list(attributes))
+            feature.setGeometry(QgsLineString([ix, jx], [iy, jy]))
+            features += [feature]
+        sink.addFeatures(features, QgsFeatureSink.FastInsert)
+        if feedback.isCanceled():
+            break
+
+
+def create_raster(filename, W, H, bands, data_type, GT, authid, feedback, nodata=None):
+    """Shared (tiled, compressed, overviews on close) raster writer with the base raster georeference, driver guessed
+    from the filename"""
+    return RasterWriter(filename, W, H, bands, data_type, GT, authid, nodata=nodata, feedback=feedback)
+
+
+def band_writer(writer, nodata=0):
+    """Fused pass accumulator writing the k-th grid into band k + 1 of a RasterWriter"""
+
+    def write(k, data):
+        writer.band(k + 1).SetNoDataValue(nodata)
+        writer.write(k + 1, data)
+
+    return BandWriter(write)
+
+
+def attach_scar_store(fused, sample_file, final_scars, H, W, feedback, cube=False):
+    """None if the sparse scar store (or bit-packed cube) of these final scars is up to date, else its writer attached
+    to the fused pass"""
+    filename, accumulator = (scar_cube_file, ScarCubeAccumulator) if cube else (scar_store_file, ScarStoreAccumulator)
+    filename = filename(sample_file)
+    signature = scars_signature(final_scars, H, W)
+    if (store := open_scar_store(filename, signature, kind=accumulator.kind)) is not None:
+        store.close()
+        feedback.pushDebugInfo(f"scar {accumulator.kind} {filename} is up to date")
+        return None
+    feedback.pushDebugInfo(f"writing scar {accumulator.kind} {filename}")
+    return fused.attach(SCAR_SOURCE, accumulator(filename, list(final_scars), signature))
+
+
+def close_scar_store(scar_store, sample_file, cube=False):
+    """Finish writing the scar store or cube (if attach_scar_store returned a writer) and open it"""
+    if scar_store is not None and not scar_store.close():
+        raise QgsProcessingException("Algorithm cancelled by user")
+    if cube:
+        return open_scar_store(scar_cube_file(sample_file), kind=CUBE_KIND)
+    return open_scar_store(scar_store_file(sample_file))
+
+
+def write_table(filename, table_name, columns, integers=()):
+    """Write {name: values} columns as a GeoPackage attribute table (no geometry) in one transaction; NaN as null"""
+    dst_ds = ogr.GetDriverByName("GPKG").CreateDataSource(str(filename))
+    layer = dst_ds.CreateLayer(table_name, geom_type=ogr.wkbNone)
+    for name in columns:
+        layer.CreateField(ogr.FieldDefn(name, ogr.OFTInteger64 if name in integers else ogr.OFTReal))
+    layer_defn = layer.GetLayerDefn()
+    dst_ds.StartTransaction()
+    for row in zip(*columns.values()):
+        feature = ogr.Feature(layer_defn)
+        for name, value in zip(columns, row):
+            if not isnan(value):
+                feature.SetField(name, int(value) if name in integers else float(value))
+        layer.CreateFeature(feature)
+    dst_ds.CommitTransaction()
+    layer = dst_ds = None
+
+
+def write_bands(filename, arrays, GT, authid, feedback, descriptions=None, nodata=0):
+    """Write a list of (H, W) arrays as the float32 bands of a new raster"""
+    H, W = arrays[0].shape
+    with create_raster(filename, W, H, len(arrays), GDT_Float32, GT, authid, feedback, nodata=nodata) as writer:
+        for b, data in enumerate(arrays):
+            if descriptions:
+                writer.band(b + 1).SetDescription(descriptions[b])
+            writer.write(b + 1, data)
+
+
 class StatisticSIMPP(QgsProcessingAlgorithm):
     """Statistic Simulation Post Processing Algorithm"""
 
@@ -738,6 +1016,14 @@ class StatisticSIMPP(QgsProcessingAlgorithm):
     DATA_TYPE = "DataType"
     OUTPUT_RASTER = "OutputRaster"
     OUTPUT_RASTER_2 = "OutputRasterStats"
+    IN_MINMAX = "MinMax"
+    OUTPUT_QUANTILES = "OutputRasterQuantiles"
+    IN_QUANTILES = "Quantiles"
+    IN_ACCURACY = "QuantileAccuracy"
+    IN_BINS = "QuantileBins"
+    OUTPUT_EXCEEDANCE = "OutputRasterExceedance"
+    IN_THRESHOLDS = "Thresholds"
+    THREADS = "Threads"
     gdal_dt = [GDT_Float32, GDT_Int16]
     numpy_dt = [float32, int16]
     dt_string = ["float32", "int16"]
@@ -749,8 +1035,42 @@ class StatisticSIMPP(QgsProcessingAlgorithm):
         # files, stat_dir, stat_name, ext = get_files(Path(self.parameterAsString(parameters, self.IN_STAT, context)))
         if files == []:
             return False, f"{stat_dir} does not contain any non-empty '{stat_name}[0-9]*{ext}' files"
+        outputs = [self.parameterAsOutputLayer(parameters, name, context) for name in self.outputs()]
+        if not any(outputs):
+            return False, "No output selected!"
+        try:
+            quantiles = self.quantiles(parameters, context)
+        except ValueError as e:
+            return False, f"Quantiles must be comma separated percentages in [0, 100]: {e}"
+        if self.parameterAsOutputLayer(parameters, self.OUTPUT_QUANTILES, context) and not quantiles:
+            return False, "No quantiles given for the quantiles output"
+        try:
+            thresholds = self.thresholds(parameters, context, stat_name)
+        except ValueError as e:
+            return False, f"Thresholds must be comma separated numbers: {e}"
+        if self.parameterAsOutputLayer(parameters, self.OUTPUT_EXCEEDANCE, context) and not thresholds:
+            return False, f"No thresholds given (and none known for {stat_name}) for the exceedance output"
         return True, ""
 
+    def outputs(self) -> list[str]:
+        """Raster outputs, any of them can be skipped"""
+        return [self.OUTPUT_RASTER, self.OUTPUT_RASTER_2, self.OUTPUT_QUANTILES, self.OUTPUT_EXCEEDANCE]
+
+    def quantiles(self, parameters, context) -> list[float]:
+        """Requested percentages as quantiles in [0, 1], e.g. "50,90,99" -> [0.5, 0.9, 0.99]"""
+        text = self.parameterAsString(parameters, self.IN_QUANTILES, context)
+        quantiles = [float(item) / 100 for item in text.replace(" ", "").split(",") if item != ""]
+        if not all(0 <= q <= 1 for q in quantiles):
+            raise ValueError(text)
+        return quantiles
+
+    def thresholds(self, parameters, context, stat_name) -> list[float]:
+        """Requested exceedance thresholds, defaulting to the known ones of the statistic (see config.STATS)"""
+        text = self.parameterAsString(parameters, self.IN_THRESHOLDS, context).replace(" ", "")
+        if text == "":
+            return next((item.get("thresholds", []) for item in STATS if item["file"] == stat_name), [])
+        return [float(item) for item in text.split(",") if item != ""]
+
     def initAlgorithm(self, config):
         self.addParameter(
             QgsProcessingParameterRasterLayer(
@@ -794,10 +1114,10 @@ class StatisticSIMPP(QgsProcessingAlgorithm):
         self.addParameter(
             QgsProcessingParameterRasterDestination(
                 name=self.OUTPUT_RASTER,
-                description=self.tr("Output raster"),
+                description=self.tr("Output raster, each simulation in a band"),
                 # defaultValue=None,
-                # optional=False,
-                # createByDefault=True,
+                optional=True,
+                createByDefault=False,
             )
         )
         self.addParameter(
@@ -809,6 +1129,91 @@ class StatisticSIMPP(QgsProcessingAlgorithm):
                 createByDefault=True,
             )
         )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name=self.IN_MINMAX,
+                description=self.tr("Also add minimum and maximum bands to the mean & std output"),
+                defaultValue=False,
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                name=self.OUTPUT_QUANTILES,
+                description=self.tr("Output raster quantiles, one band per percentage"),
+                optional=True,
+                createByDefault=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                name=self.IN_QUANTILES,
+                description=self.tr("Quantiles to compute, as comma separated percentages"),
+                defaultValue="50,90,99",
+                optional=True,
+            )
+        )
+        qppn = QgsProcessingParameterNumber(
+            name=self.IN_ACCURACY,
+            description=self.tr("Quantiles relative accuracy (streaming histogram bins width)"),
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=0.02,
+            optional=True,
+            minValue=0.001,
+            maxValue=0.5,
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+        qppn = QgsProcessingParameterNumber(
+            name=self.IN_BINS,
+            description=self.tr(
+                "Quantiles histogram bins per cell (memory is cells x bins x 2 bytes, times threads + 1 when run in"
+                " parallel; lower values collapse first)"
+            ),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=256,
+            optional=True,
+            minValue=8,
+            maxValue=4096,
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                name=self.OUTPUT_EXCEEDANCE,
+                description=self.tr(
+                    "Output raster threshold exceedance probability, one band per threshold, then the same given burned"
+                ),
+                optional=True,
+                createByDefault=False,
+            )
+        )
+        known = [
+            f"{item['file']}: {','.join(map(str, item['thresholds']))} {item['unit']}"
+            for item in STATS
+            if "thresholds" in item
+        ]
+        self.addParameter(
+            QgsProcessingParameterString(
+                name=self.IN_THRESHOLDS,
+                description=self.tr("Exceedance thresholds, comma separated (empty for the known ones: ")
+                + "; ".join(known)
+                + ")",
+                defaultValue="",
+                optional=True,
+            )
+        )
+        qppn = QgsProcessingParameterNumber(
+            name=self.THREADS,
+            description=self.tr("Maximum number of processes reading statistic files simultaneously"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=cpu_count() - 1,
+            optional=True,
+            minValue=1,
+            maxValue=cpu_count(),
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
 
     def processAlgorithm(self, parameters, context, feedback):
         """proc algo"""
@@ -825,65 +1230,60 @@ class StatisticSIMPP(QgsProcessingAlgorithm):
         feedback.pushDebugInfo(f"base raster properties: {geotransform=}, {W=}, {H=}, {authid=}")
 
         # get data
-        files, stat_dir, stat_name, ext = glob_numbered_files(
-            Path(self.parameterAsString(parameters, self.IN_STAT, context))
-        )
-        # files, stat_dir, stat_name, ext = get_files(Path(self.parameterAsString(parameters, self.IN_STAT, context)))
-        if files == []:
+        sample_file = Path(self.parameterAsString(parameters, self.IN_STAT, context))
+        _, stat_dir, stat_name, ext = glob_numbered_files(sample_file)
+        files = numbered_files(sample_file)
+        if not files:
             feedback.reportError(f"{stat_dir} does not contain any non-empty '{stat_name}[0-9]*{ext}' files")
             raise QgsProcessingException(f"{stat_dir} does not contain any non-empty '{stat_name}[0-9]*{ext}' files")
-        feedback.pushDebugInfo(f"{len(files)} files, first: {files[0]}...")
+        feedback.pushDebugInfo(f"{len(files)} files, first: {next(iter(files.values()))}...")
         # infer dimensional units
         if unit := [item["unit"] for item in STATS if item["file"] == stat_name]:
             unit = unit[0]
         else:
             unit = None
 
-        # out raster
+        # out rasters
         output_raster_filename = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
-        raster_format = get_output_raster_format(output_raster_filename, feedback)
-        feedback.pushDebugInfo(f"{output_raster_filename=}, {raster_format=}")
-
         output_raster2_filename = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER_2, context)
-        raster_format = get_output_raster_format(output_raster2_filename, feedback)
-        feedback.pushDebugInfo(f"{output_raster2_filename=}, {raster_format=}")
-
-        # dtype
-        # data_type_idx = self.parameterAsEnum(parameters, self.DATA_TYPE, context)
-        # feedback.pushDebugInfo(
-        #     f"data_type_idx: {data_type_idx}, {self.gdal_dt[data_type_idx]}, {self.numpy_dt[data_type_idx]}"
-        # )
-
-        def callback(progress=None, message=None):
-            if progress:
-                feedback.setProgress(progress)
-            if message:
-                feedback.setProgressText(message)
-            if feedback.isCanceled():
-                raise QgsProcessingException("Algorithm cancelled by user")
-
-        # from importlib import reload
-
-        # from fire2a import cell2fire
-
-        # reload(cell2fire)
-        from fire2a.cell2fire import build_stats
-
-        try:
-            build_stats(
-                output_raster_filename,
-                output_raster2_filename if len(files) > 1 else None,
-                Path(self.parameterAsString(parameters, self.IN_STAT, context)),
-                W,
-                H,
-                geotransform,
-                authid,
-                callback,
-                feedback,
+        output_quantiles_filename = self.parameterAsOutputLayer(parameters, self.OUTPUT_QUANTILES, context)
+        output_exceedance_filename = self.parameterAsOutputLayer(parameters, self.OUTPUT_EXCEEDANCE, context)
+        feedback.pushDebugInfo(f"{output_exceedance_filename=}")
+        feedback.pushDebugInfo(f"{output_raster_filename=}, {output_raster2_filename=}, {output_quantiles_filename=}")
+
+        # single streaming pass: optional per simulation bands, running (Welford) mean & std, quantile sketches and
+        # threshold exceedance counters
+        fused = FusedResultsPass(H, W)
+        fused.add_source(stat_name, files, read_asc_file)
+        if output_raster_filename:
+            stack_writer = create_raster(
+                output_raster_filename, W, H, len(files), GDT_Float32, geotransform, authid, feedback
             )
+            fused.attach(stat_name, band_writer(stack_writer))
+        if output_raster2_filename:
+            min_max = self.parameterAsBool(parameters, self.IN_MINMAX, context)
+            mean_std = fused.attach(stat_name, MeanStd(H, W, min_max=min_max))
+        if output_quantiles_filename:
+            quantiles = self.quantiles(parameters, context)
+            accuracy = self.parameterAsDouble(parameters, self.IN_ACCURACY, context)
+            bins = self.parameterAsInt(parameters, self.IN_BINS, context)
+            sketch = fused.attach(stat_name, QuantileSketch(H, W, accuracy, bins, max_simulations=len(files)))
+            feedback.pushDebugInfo(f"{quantiles=}, {accuracy=}, {bins=}")
+        if output_exceedance_filename:
+            thresholds = self.thresholds(parameters, context, stat_name)
+            exceedance = fused.attach(stat_name, Exceedance(H, W, thresholds))
+            feedback.pushDebugInfo(f"{thresholds=}")
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        feedback.setProgressText(f"Reading {len(files)} {stat_name} files in a {threads}-lane parallel execution pool")
+        try:
+            fused.run(threads, feedback)
         except Exception as e:
-            feedback.reportError(f"Build Scars failed! {e}")
-            raise QgsProcessingException(f"Build Scars failed! {e}")
+            feedback.reportError(f"Build Statistic failed! {e}")
+            raise QgsProcessingException(f"Build Statistic failed! {e}")
+        if output_raster_filename:
+            stack_writer.close()
+        if feedback.isCanceled():
+            raise QgsProcessingException("Algorithm cancelled by user")
 
         output_dict = {}
         if output_raster_filename:
@@ -906,10 +1306,8 @@ class StatisticSIMPP(QgsProcessingAlgorithm):
 
         if output_raster2_filename:
             if len(files) == 1:
-                from shutil import copy
-
-                copy(output_raster_filename, output_raster2_filename)
                 feedback.pushWarning(f"Only one file for statistic raster {output_raster2_filename} doesnt make sense!")
+            write_bands(output_raster2_filename, mean_std.result(), geotransform, authid, feedback, mean_std.names())
             output_dict[self.OUTPUT_RASTER_2] = output_raster2_filename
             # rename if showing
             if context.willLoadLayerOnCompletion(output_raster2_filename):
@@ -919,6 +1317,26 @@ class StatisticSIMPP(QgsProcessingAlgorithm):
                 layer_details.groupName = NAME["layer_group"]
                 layer_details.layerSortKey = 3
 
+        if output_quantiles_filename:
+            names = [f"P{100 * q:g}" for q in quantiles]
+            write_bands(output_quantiles_filename, sketch.result(quantiles), geotransform, authid, feedback, names)
+            output_dict[self.OUTPUT_QUANTILES] = output_quantiles_filename
+            if context.willLoadLayerOnCompletion(output_quantiles_filename):
+                layer_details = context.layerToLoadOnCompletionDetails(output_quantiles_filename)
+                layer_details.name = f"{stat_name}_{'_'.join(names)}"
+                layer_details.groupName = NAME["layer_group"]
+                layer_details.layerSortKey = 3
+
+        if output_exceedance_filename:
+            names = exceedance.names(unit)
+            write_bands(output_exceedance_filename, exceedance.result(), geotransform, authid, feedback, names)
+            output_dict[self.OUTPUT_EXCEEDANCE] = output_exceedance_filename
+            if context.willLoadLayerOnCompletion(output_exceedance_filename):
+                layer_details = context.layerToLoadOnCompletionDetails(output_exceedance_filename)
+                layer_details.name = f"{stat_name}_exceedance"
+                layer_details.groupName = NAME["layer_group"]
+                layer_details.layerSortKey = 3
+
         write_log(feedback, name=self.name())
         return output_dict
 
@@ -949,11 +1367,11 @@ class ScarSIMPP(QgsProcessingAlgorithm):
 
     IN_SCAR = "SampleScarFile"
     BASE_LAYER = "BaseLayer"
-    IN_FIXGEOM = "FixGeometries"
-    IN_FIXGEOM_METHOD = "FixGeometriesMethod"
     OUT_RASTER = "ScarRaster"
     OUT_POLY = "ScarPolygon"
     OUT_BP = "BurnProbability"
+    IN_CUBE = "ScarCube"
+    THREADS = "Threads"
 
     def checkParameterValues(self, parameters: dict[str, Any], context: QgsProcessingContext) -> tuple[bool, str]:
         from fire2a.cell2fire import get_scars_files
@@ -1024,19 +1442,24 @@ class ScarSIMPP(QgsProcessingAlgorithm):
                 createByDefault=True,
             )
         )
-        qppb = QgsProcessingParameterBoolean(
-            name=self.IN_FIXGEOM,
-            description=("Fix geometries of the generated propagation polygons (native:fixgeometries)"),
-            defaultValue=True,
-            optional=True,
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name=self.IN_CUBE,
+                description=self.tr(
+                    "Write a bit-packed scar cube for fast subset queries (results/Grids/final_scars_cube.cube)"
+                ),
+                defaultValue=False,
+                optional=True,
+            )
         )
-        qppb.setFlags(qppb.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
-        self.addParameter(qppb)
         qppn = QgsProcessingParameterNumber(
-            name=self.IN_FIXGEOM_METHOD,
-            description=("Repair method passed to fix geometries (0:Linework, 1:Structure didn't work on MacOS)"),
-            defaultValue=0 if platform_system() == "Darwin" else 1,
+            name=self.THREADS,
+            description=self.tr("Maximum number of processes reading scar files simultaneously"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=cpu_count() - 1,
             optional=True,
+            minValue=1,
+            maxValue=cpu_count(),
         )
         qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(qppn)
@@ -1060,44 +1483,59 @@ class ScarSIMPP(QgsProcessingAlgorithm):
         output_vector_file = self.parameterAsFileOutput(parameters, self.OUT_POLY, context)
         burn_prob_fname = self.parameterAsOutputLayer(parameters, self.OUT_BP, context)
         feedback.pushDebugInfo(f"{sample_file=}, {output_raster_filename=}, {output_vector_file=}, {burn_prob_fname=}")
-        # if output_vector_file[-5:] != ".gpkg":
-        #     output_vector_file = output_vector_file + ".gpkg"
-
-        fix_geo = self.parameterAsBool(parameters, self.IN_FIXGEOM, context)
-        fix_geo_method = self.parameterAsInt(parameters, self.IN_FIXGEOM_METHOD, context)
-        feedback.pushDebugInfo(f"{fix_geo=}, {fix_geo_method=}")
-
-        def callback(progress=None, message=None):
-            if progress:
-                feedback.setProgress(progress)
-            if message:
-                feedback.setProgressText(message)
-            if feedback.isCanceled():
-                raise QgsProcessingException("Algorithm cancelled by user")
-
-        # from importlib import reload
-
-        # from fire2a import cell2fire
-
-        # reload(cell2fire)
-        from fire2a.cell2fire import build_scars
-
-        try:
-            build_scars(
-                output_raster_filename,
-                output_vector_file,
-                burn_prob_fname,
-                sample_file,
-                W,
-                H,
-                geotransform,
-                authid,
-                callback,
-                feedback,
+        # temporary outputs are written to a geopackage
+        if output_vector_file.startswith("memory:"):
+            output_vector_file = QgsProcessingUtils.generateTempFilename("PropagationScars.gpkg")
+
+        # final scars: read once, into the optional stack raster and the sparse scar store (burn probability source)
+        final_scars = final_scar_files(sample_file)
+        fused = FusedResultsPass(H, W)
+        fused.add_source(SCAR_SOURCE, final_scars, read_scar_file)
+        if output_raster_filename:
+            scar_writer = create_raster(
+                output_raster_filename, W, H, len(final_scars), gdal.GDT_Byte, geotransform, authid, feedback
             )
+            fused.attach(SCAR_SOURCE, band_writer(scar_writer))
+        scar_store = attach_scar_store(fused, sample_file, final_scars, H, W, feedback)
+        if write_cube := self.parameterAsBool(parameters, self.IN_CUBE, context):
+            scar_cube = attach_scar_store(fused, sample_file, final_scars, H, W, feedback, cube=True)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        feedback.setProgressText(f"Reading {len(final_scars)} final scars in a {threads}-lane parallel execution pool")
+        try:
+            fused.run(threads, feedback)
         except Exception as e:
             feedback.reportError(f"Build Scars failed! {e}")
             raise QgsProcessingException(f"Build Scars failed! {e}")
+        finally:
+            if output_raster_filename:
+                scar_writer.close()
+        store = close_scar_store(scar_store, sample_file)
+        if write_cube:
+            close_scar_store(scar_cube, sample_file, cube=True).close()
+        if feedback.isCanceled():
+            raise QgsProcessingException("Algorithm cancelled by user")
+        if burn_prob_fname:
+            write_bands(burn_prob_fname, [burn_probability(store)], geotransform, authid, feedback)
+
+        # propagation polygons need every period grid
+        if output_vector_file:
+            feedback.setProgressText(f"Polygonizing propagation scars in a {threads}-lane parallel execution pool")
+            try:
+                features = polygonize_scars(
+                    scar_files(sample_file),
+                    output_vector_file,
+                    geotransform,
+                    authid,
+                    threads=threads,
+                    feedback=feedback,
+                    driver_name=QgsVectorFileWriter.driverForExtension(Path(output_vector_file).suffix) or "GPKG",
+                )
+            except Exception as e:
+                feedback.reportError(f"Build Scars failed! {e}")
+                raise QgsProcessingException(f"Build Scars failed! {e}")
+            if feedback.isCanceled():
+                raise QgsProcessingException("Algorithm cancelled by user")
+            feedback.pushDebugInfo(f"{features} propagation scar polygons written to {output_vector_file}")
 
         if output_raster_filename:
             if context.willLoadLayerOnCompletion(output_raster_filename):
@@ -1128,21 +1566,6 @@ class ScarSIMPP(QgsProcessingAlgorithm):
             output_dict["BurnProbability"] = burn_prob_fname
 
         if output_vector_file:
-            if fix_geo:
-                if fix_geo_run := processing.run(
-                    "native:fixgeometries",
-                    {
-                        "INPUT": output_vector_file,  # "memory:ds" otrolyr "memory:tmp"
-                        "METHOD": fix_geo_method,
-                        "OUTPUT": output_vector_file,  # QgsProcessing.TEMPORARY_OUTPUT
-                    },
-                    context=context,
-                    feedback=feedback,
-                    is_child_algorithm=True,
-                ):
-                    if fix_geo_out := fix_geo_run.get("OUTPUT"):
-                        feedback.pushInfo(f"Fixing geometries done! {fix_geo_out}")
-                        output_vector_file = fix_geo_out
             layer_details = context.LayerDetails(
                 "Propagation Scars",
                 context.project(),
@@ -1186,11 +1609,9 @@ class ScarSIMPP(QgsProcessingAlgorithm):
         return self.tr(
             """ - Input <b>Sample</b> Fire Scar is any of the ForestGrid files; with it a pattern search for all Grids(any digit)/ForestGrid(any digit).csv will be performed.
             - Output <b>Final</b> Scar raster needs simulation ran with Final Fire Scar option, each band is a simulation
-            - Output <b>Burn Probability</b> raster is the mean of all simulations, requires >1 simulations
-            - Output <b>Propagation</b> Scars Polygons accumulates fixed-geometry, polygonized, in-memory rasters (4 steps); attributing for each one its: simulation, period, perimeter and area. This is known to fail in some qgis-versions, OSes or low RAM hardware. Mitigations:
-            A. Change the default .gpkg format to .shp or test other
-            B. Use the advanced options to tweak or disable the fix geometries option
-            C. <b>Skip this output altogether by clicking the option button '...' and selecting Skip Output</b>
+            - Output <b>Burn Probability</b> raster is the mean of all simulations, requires >1 simulations. It is counted from the sparse scar store (burned cell ids of each final scar, results/Grids/final_scars.scars) written along, that the Burn Probability metric reuses for subsets of simulations
+            - Optionally a <b>bit-packed scar cube</b> (1 bit per cell and simulation) is written along, for the Scar Cube Query algorithm
+            - Output <b>Propagation</b> Scars Polygons has one MultiPolygon per period grid of each simulation, with all its burned cells, attributing for each one its: simulation, period (time), perimeter and area (of all its parts). Simulations are polygonized in parallel, on in-memory rasters, with 4-connectedness: burned cells touching only at a corner are separate parts (previous versions used 8-connectedness, a Polygon layer and kept only the first polygon of each grid), geometries are valid so no fix geometries pass is needed; then written in a single transaction (.gpkg). On big ensembles this is still the slowest output, to skip it click the option button '...' and select Skip Output
 
             <i>If the Bundle algorithm failed for you, this propagation output is the most likely cause...</i>"""
         )
@@ -1202,6 +1623,16 @@ class BurnProbabilityMetric(QgsProcessingAlgorithm):
     BASE_LAYER = "BaseLayer"
     IN_SCAR = "SampleScarFile"
     OUT_BP = "BurnProbability"
+    IN_SIMULATIONS = "SimulationIds"
+    OUT_AREAS = "BurnedAreas"
+    THREADS = "Threads"
+
+    def checkParameterValues(self, parameters: dict[str, Any], context: QgsProcessingContext) -> tuple[bool, str]:
+        try:
+            parse_simulation_ids(self.parameterAsString(parameters, self.IN_SIMULATIONS, context))
+        except ValueError as e:
+            return False, f"Simulation ids must be comma separated ids or ranges (e.g. 1-100,205): {e}"
+        return True, ""
 
     def initAlgorithm(self, config):
         """inputs and output of the algorithm"""
@@ -1234,6 +1665,34 @@ class BurnProbabilityMetric(QgsProcessingAlgorithm):
                 createByDefault=True,
             )
         )
+        self.addParameter(
+            QgsProcessingParameterString(
+                name=self.IN_SIMULATIONS,
+                description=self.tr("Only these simulations, comma separated ids or ranges (empty: all)"),
+                defaultValue="",
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                name=self.OUT_AREAS,
+                description=self.tr("Output burned cells and area (base raster units) of each simulation"),
+                fileFilter="CSV files (*.csv)",
+                optional=True,
+                createByDefault=False,
+            )
+        )
+        qppn = QgsProcessingParameterNumber(
+            name=self.THREADS,
+            description=self.tr("Maximum number of processes reading scar files simultaneously"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=cpu_count() - 1,
+            optional=True,
+            minValue=1,
+            maxValue=cpu_count(),
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
 
     def processAlgorithm(self, parameters, context, feedback):
         """Here is where the processing itself takes place."""
@@ -1241,20 +1700,45 @@ class BurnProbabilityMetric(QgsProcessingAlgorithm):
         # feedback.pushDebugInfo(f"context args: {context.asQgisProcessArguments()}")
         # feedback.pushDebugInfo(f"parameters {parameters}")
         output_dict = {}
+        base_raster = self.parameterAsRasterLayer(parameters, self.BASE_LAYER, context)
+        _, raster_props = read_raster(base_raster.publicSource(), data=False)
+        W, H, GT = raster_props["RasterXSize"], raster_props["RasterYSize"], raster_props["Transform"]
+        if not (authid := raster_props["Projection"]):
+            authid = base_raster.crs().authid()
+
+        # sparse scar store, only the final scars are read (once each) if it is missing or outdated
+        sample_file = Path(self.parameterAsString(parameters, self.IN_SCAR, context))
+        final_scars = final_scar_files(sample_file)
+        if len(final_scars) == 0:
+            raise QgsProcessingException("No non-empty scar files found!")
+        fused = FusedResultsPass(H, W)
+        fused.add_source(SCAR_SOURCE, final_scars, read_scar_file)
+        scar_store = attach_scar_store(fused, sample_file, final_scars, H, W, feedback)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        feedback.pushDebugInfo(f"Reading {len(fused.tasks())} final scars in a {threads}-lane parallel execution pool")
+        fused.run(threads, feedback)
+        store = close_scar_store(scar_store, sample_file)
+
+        simulation_ids = parse_simulation_ids(self.parameterAsString(parameters, self.IN_SIMULATIONS, context)) or None
+        try:
+            sim_ids, cells, areas = burned_areas(store, abs(GT[1] * GT[5]), simulation_ids)
+        except ValueError as e:
+            raise QgsProcessingException(f"Unknown simulation! {e}")
+        feedback.pushInfo(f"{len(sim_ids)} simulations, burned area stats: {scipy_stats.describe(areas)}")
+        if areas_file := self.parameterAsFileOutput(parameters, self.OUT_AREAS, context):
+            savetxt(
+                areas_file,
+                column_stack((sim_ids, cells, areas)),
+                fmt=["%d", "%d", "%.6g"],
+                delimiter=",",
+                header="simulation,cells,area",
+                comments="",
+            )
+            output_dict[self.OUT_AREAS] = areas_file
 
-        scar_out = processing.run(
-            "fire2a:scar",
-            {
-                "BaseLayer": self.parameterAsRasterLayer(parameters, self.BASE_LAYER, context),
-                "SampleScarFile": self.parameterAsString(parameters, self.IN_SCAR, context),
-                "BurnProbability": self.parameterAsOutputLayer(parameters, self.OUT_BP, context),
-            },
-            context=context,
-            feedback=feedback,
-            is_child_algorithm=True,
-        )
         # burnprob
-        if bplayer := scar_out.get("BurnProbability"):
+        if bplayer := self.parameterAsOutputLayer(parameters, self.OUT_BP, context):
+            write_bands(bplayer, [burn_probability(store, simulation_ids)], GT, authid, feedback)
             # layer_details = context.layerToLoadOnCompletionDetails(bplayer)
             layer_details = context.LayerDetails(
                 "BurnProbability",
@@ -1295,8 +1779,385 @@ class BurnProbabilityMetric(QgsProcessingAlgorithm):
 
     def shortHelpString(self):
         return self.tr(
-            """Burn probabilty raster is the mean of all simulations<br>
-            It's the same as using the 'Fire Scar' algorithm, skipping output for scars and polygons, leaving only the 'Burn Probability' output enabled<br>
+            """Burn probabilty raster is the mean of all simulations (or of the given simulation ids)<br>
+            Same result as the 'Fire Scar' algorithm 'Burn Probability' output, counted from a sparse store of the burned cells of each final scar (results/Grids/final_scars.scars). The store is reused while the scar files do not change, else only the final scar of each simulation is read (once, in parallel) to rebuild it; so subsets of simulations cost no file parsing<br>
+            Optionally outputs the number of burned cells and burned area of each simulation<br>
+            From a simulation results directory, select the 'Grids' directory and choose any of the 'ForestGrid' files
+            """
+        )
+
+    def icon(self):
+        return QIcon(":/plugins/fireanalyticstoolbox/assets/bodyscar.svg")
+
+
+class ScarCubeQueryMetric(QgsProcessingAlgorithm):
+    """Burn probability, or a boolean aggregate, of any subset of simulations from the bit-packed scar cube"""
+
+    BASE_LAYER = "BaseLayer"
+    IN_SCAR = "SampleScarFile"
+    IN_SIMULATIONS = "SimulationIds"
+    IN_AGGREGATE = "Aggregate"
+    OUT_RASTER = "OutputRaster"
+    THREADS = "Threads"
+
+    def checkParameterValues(self, parameters: dict[str, Any], context: QgsProcessingContext) -> tuple[bool, str]:
+        try:
+            parse_simulation_ids(self.parameterAsString(parameters, self.IN_SIMULATIONS, context))
+        except ValueError as e:
+            return False, f"Simulation ids must be comma separated ids or ranges (e.g. 1-100,205): {e}"
+        return True, ""
+
+    def initAlgorithm(self, config):
+        """inputs and output of the algorithm"""
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                name=self.BASE_LAYER,
+                description=self.tr("Base raster (normally fuel or elevation) to get the geotransform"),
+                defaultValue=[QgsProcessing.TypeRaster],
+                optional=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                name=self.IN_SCAR,
+                description=(
+                    "Sample Fire Scar file (normally"
+                    " firesim_yymmdd_HHMMSS/results/Grids/Grids[0-9]*/ForestGrid[0-9]*.csv)"
+                ),
+                behavior=QgsProcessingParameterFile.File,
+                extension="csv",
+                defaultValue=None,
+                optional=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                name=self.IN_SIMULATIONS,
+                description=self.tr("Simulations, comma separated ids or ranges (empty: all)"),
+                defaultValue="",
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                name=self.IN_AGGREGATE,
+                description=self.tr("Aggregate of the selected scars"),
+                options=[
+                    "Burn probability",
+                    "Number of simulations burning the cell",
+                    "Burned in any simulation",
+                    "Burned in every simulation",
+                ],
+                defaultValue=0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                name=self.OUT_RASTER,
+                description=self.tr("Output aggregate raster"),
+            )
+        )
+        qppn = QgsProcessingParameterNumber(
+            name=self.THREADS,
+            description=self.tr("Maximum number of processes reading scar files simultaneously (if building the cube)"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=cpu_count() - 1,
+            optional=True,
+            minValue=1,
+            maxValue=cpu_count(),
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """Here is where the processing itself takes place."""
+        output_dict = {}
+        base_raster = self.parameterAsRasterLayer(parameters, self.BASE_LAYER, context)
+        _, raster_props = read_raster(base_raster.publicSource(), data=False)
+        W, H, GT = raster_props["RasterXSize"], raster_props["RasterYSize"], raster_props["Transform"]
+        if not (authid := raster_props["Projection"]):
+            authid = base_raster.crs().authid()
+
+        # scar cube: reused if up to date, else built from the sparse scar store (read from the scar files if needed)
+        sample_file = Path(self.parameterAsString(parameters, self.IN_SCAR, context))
+        final_scars = final_scar_files(sample_file)
+        if len(final_scars) == 0:
+            raise QgsProcessingException("No non-empty scar files found!")
+        cube_file = scar_cube_file(sample_file)
+        if (cube := open_scar_store(cube_file, scars_signature(final_scars, H, W), kind=CUBE_KIND)) is None:
+            fused = FusedResultsPass(H, W)
+            fused.add_source(SCAR_SOURCE, final_scars, read_scar_file)
+            scar_store = attach_scar_store(fused, sample_file, final_scars, H, W, feedback)
+            threads = self.parameterAsInt(parameters, self.THREADS, context)
+            feedback.pushDebugInfo(f"Reading {len(fused.tasks())} final scars in a {threads}-lane parallel pool")
+            fused.run(threads, feedback)
+            store = close_scar_store(scar_store, sample_file)
+            feedback.setProgressText(f"Packing {len(store)} scars into {cube_file}")
+            cube = build_scar_cube(store, cube_file)
+            store.close()
+
+        simulation_ids = parse_simulation_ids(self.parameterAsString(parameters, self.IN_SIMULATIONS, context)) or None
+        aggregate = CUBE_AGGREGATES[self.parameterAsEnum(parameters, self.IN_AGGREGATE, context)]
+        try:
+            burned_cells = cube_burned_cells(cube, simulation_ids)
+            result = cube_aggregate(cube, simulation_ids, aggregate)
+        except ValueError as e:
+            raise QgsProcessingException(f"Unknown simulation! {e}")
+        cube.close()
+        feedback.pushInfo(f"{len(burned_cells)} simulations, burned cells stats: {scipy_stats.describe(burned_cells)}")
+
+        output_raster = self.parameterAsOutputLayer(parameters, self.OUT_RASTER, context)
+        write_bands(output_raster, [result], GT, authid, feedback, descriptions=[aggregate])
+        layer_details = context.LayerDetails(
+            f"Scar cube {aggregate}", context.project(), f"Scar cube {aggregate}", QgsProcessingUtils.LayerHint.Raster
+        )
+        if aggregate == "probability":
+            layer_details.setPostProcessor(run_alg_styler("Burn Probability"))
+        elif aggregate in ["any", "all"]:
+            layer_details.setPostProcessor(run_alg_styler_bin(f"Scar cube {aggregate}"))
+        layer_details.forceName = True
+        layer_details.groupName = NAME["layer_group"]
+        layer_details.layerSortKey = 3
+        context.addLayerToLoadOnCompletion(output_raster, layer_details)
+        output_dict[self.OUT_RASTER] = output_raster
+
+        write_log(feedback, name=self.name())
+        return output_dict
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def group(self):
+        return self.tr(NAME["simm"])
+
+    def groupId(self):
+        return jolo(NAME["simm"])
+
+    def name(self):
+        return jolo(NAME["scar_cube"])
+
+    def displayName(self):
+        return self.tr(NAME["scar_cube"])
+
+    def createInstance(self):
+        return ScarCubeQueryMetric()
+
+    def helpString(self):
+        return self.shortHelpString()
+
+    def shortHelpString(self):
+        return self.tr(
+            """Burn probability, burn count, burned in any or in every simulation, of any subset of simulations (e.g. by weather file, ignition zone or season: 1-100,205)<br>
+            Queries the bit-packed scar cube (1 bit per cell and simulation, results/Grids/final_scars_cube.cube) written by the 'Fire Scar' algorithm: selected rows are sliced out of the memory mapped cube, cell counts are popcounts of its bit planes and any/all are bitwise or/and reductions; the scar files are never read again<br>
+            If the cube is missing or the scar files changed, it is rebuilt once from the sparse scar store (or, if that is outdated too, the final scars of each simulation)<br>
+            From a simulation results directory, select the 'Grids' directory and choose any of the 'ForestGrid' files
+            """
+        )
+
+    def icon(self):
+        return QIcon(":/plugins/fireanalyticstoolbox/assets/bodyscar.svg")
+
+
+class BurnProbabilityConvergence(QgsProcessingAlgorithm):
+    """Burn probability convergence diagnostics and simulation count advisor"""
+
+    BASE_LAYER = "BaseLayer"
+    IN_SCAR = "SampleScarFile"
+    IN_WIDTH = "TargetWidth"
+    IN_CONFIDENCE = "Confidence"
+    IN_COVERAGE = "Coverage"
+    IN_CHECKPOINTS = "Checkpoints"
+    OUT_WIDTH = "ConfidenceIntervalWidth"
+    OUT_TABLE = "ConvergenceTable"
+    THREADS = "Threads"
+
+    def initAlgorithm(self, config):
+        """inputs and output of the algorithm"""
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                name=self.BASE_LAYER,
+                description=self.tr("Base raster (normally fuel or elevation) to get the geotransform"),
+                defaultValue=[QgsProcessing.TypeRaster],
+                optional=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                name=self.IN_SCAR,
+                description=(
+                    "Sample Fire Scar file (normally"
+                    " firesim_yymmdd_HHMMSS/results/Grids/Grids[0-9]*/ForestGrid[0-9]*.csv)"
+                ),
+                behavior=QgsProcessingParameterFile.File,
+                extension="csv",
+                defaultValue=None,
+                optional=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name=self.IN_WIDTH,
+                description=self.tr("Target burn probability confidence interval width"),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=0.05,
+                minValue=0.0001,
+                maxValue=1,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name=self.IN_CONFIDENCE,
+                description=self.tr("Confidence level"),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=0.95,
+                minValue=0.5,
+                maxValue=0.9999,
+            )
+        )
+        qppn = QgsProcessingParameterNumber(
+            name=self.IN_COVERAGE,
+            description=self.tr("Fraction of the burned cells that must reach the target width"),
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=0.95,
+            minValue=0.01,
+            maxValue=1,
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+        qppn = QgsProcessingParameterNumber(
+            name=self.IN_CHECKPOINTS,
+            description=self.tr("Number of checkpoints (simulation counts) of the convergence table"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=20,
+            minValue=1,
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                name=self.OUT_WIDTH,
+                description=self.tr("Output burn probability confidence interval width raster"),
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                name=self.OUT_TABLE,
+                description=self.tr("Output convergence table"),
+                fileFilter="CSV files (*.csv)",
+                optional=True,
+                createByDefault=False,
+            )
+        )
+        qppn = QgsProcessingParameterNumber(
+            name=self.THREADS,
+            description=self.tr("Maximum number of processes reading scar files simultaneously"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=cpu_count() - 1,
+            optional=True,
+            minValue=1,
+            maxValue=cpu_count(),
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """Here is where the processing itself takes place."""
+        output_dict = {}
+        base_raster = self.parameterAsRasterLayer(parameters, self.BASE_LAYER, context)
+        _, raster_props = read_raster(base_raster.publicSource(), data=False)
+        W, H, GT = raster_props["RasterXSize"], raster_props["RasterYSize"], raster_props["Transform"]
+        if not (authid := raster_props["Projection"]):
+            authid = base_raster.crs().authid()
+
+        # sparse scar store, only the final scars are read (once each) if it is missing or outdated
+        sample_file = Path(self.parameterAsString(parameters, self.IN_SCAR, context))
+        final_scars = final_scar_files(sample_file)
+        if len(final_scars) == 0:
+            raise QgsProcessingException("No non-empty scar files found!")
+        fused = FusedResultsPass(H, W)
+        fused.add_source(SCAR_SOURCE, final_scars, read_scar_file)
+        scar_store = attach_scar_store(fused, sample_file, final_scars, H, W, feedback)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        feedback.pushDebugInfo(f"Reading {len(fused.tasks())} final scars in a {threads}-lane parallel execution pool")
+        fused.run(threads, feedback)
+        store = close_scar_store(scar_store, sample_file)
+
+        # running diagnostics
+        width = self.parameterAsDouble(parameters, self.IN_WIDTH, context)
+        confidence = self.parameterAsDouble(parameters, self.IN_CONFIDENCE, context)
+        coverage = self.parameterAsDouble(parameters, self.IN_COVERAGE, context)
+        z = scipy_stats.norm.ppf((1 + confidence) / 2)
+        count, diagnostics = bp_convergence(
+            store, z, checkpoints=self.parameterAsInt(parameters, self.IN_CHECKPOINTS, context)
+        )
+        store.close()
+        # the burn counts are over the simulations of the last checkpoint
+        nsim = int(diagnostics["simulations"][-1])
+        for row in zip(*diagnostics.values()):
+            feedback.pushInfo(", ".join(f"{name}: {value:.6g}" for name, value in zip(diagnostics, row)))
+        if table_file := self.parameterAsFileOutput(parameters, self.OUT_TABLE, context):
+            savetxt(
+                table_file,
+                column_stack(list(diagnostics.values())),
+                fmt=["%d", "%d", "%.6g", "%.6g", "%.6g"],
+                delimiter=",",
+                header=",".join(diagnostics),
+                comments="",
+            )
+            output_dict[self.OUT_TABLE] = table_file
+
+        # advisor
+        needed = simulations_needed(count, nsim, width, z, coverage)
+        feedback.pushInfo(
+            f"{needed} simulations are needed for {coverage:.0%} of the burned cells to have a {confidence:.0%} burn"
+            f" probability confidence interval narrower than {width}; {max(0, needed - nsim)} more than the {nsim} done"
+        )
+        output_dict["SimulationsNeeded"] = needed
+        output_dict["AdditionalSimulations"] = max(0, needed - nsim)
+
+        # confidence interval width raster
+        width_raster = self.parameterAsOutputLayer(parameters, self.OUT_WIDTH, context)
+        write_bands(width_raster, [wilson_width(count, nsim, z).astype(float32)], GT, authid, feedback)
+        layer_details = context.LayerDetails(
+            "BP CI Width", context.project(), "BP CI Width", QgsProcessingUtils.LayerHint.Raster
+        )
+        layer_details.setPostProcessor(run_alg_styler("BP CI Width"))
+        layer_details.forceName = True
+        layer_details.groupName = NAME["layer_group"]
+        layer_details.layerSortKey = 3
+        context.addLayerToLoadOnCompletion(width_raster, layer_details)
+        output_dict[self.OUT_WIDTH] = width_raster
+
+        write_log(feedback, name=self.name())
+        return output_dict
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def group(self):
+        return self.tr(NAME["simm"])
+
+    def groupId(self):
+        return jolo(NAME["simm"])
+
+    def name(self):
+        return jolo(NAME["bp_convergence"])
+
+    def displayName(self):
+        return self.tr(NAME["bp_convergence"])
+
+    def createInstance(self):
+        return BurnProbabilityConvergence()
+
+    def helpString(self):
+        return self.shortHelpString()
+
+    def shortHelpString(self):
+        return self.tr(
+            """Are there enough simulations for a stable burn probability?<br>
+            Simulations are added in order to the burn count (from the sparse scar store, see the Burn Probability metric); at evenly spaced checkpoints the number of burned cells, mean and maximum confidence interval width of their burn probability and its root mean square change since the previous checkpoint are reported (optionally as a csv table)<br>
+            <b>Advisor</b>: number of simulations needed for the given fraction of burned cells to have a confidence interval narrower than the target width, estimated from the current burn probabilities p as 4 z² p (1-p) / width² (normal approximation)<br>
+            Output raster: per cell width of the Wilson score confidence interval of its burn probability; never burned cells still get the width of 0 burns out of n simulations<br>
             From a simulation results directory, select the 'Grids' directory and choose any of the 'ForestGrid' files
             """
         )
@@ -1305,11 +2166,13 @@ class BurnProbabilityMetric(QgsProcessingAlgorithm):
         return QIcon(":/plugins/fireanalyticstoolbox/assets/bodyscar.svg")
 
 
-def run_alg_styler_propagation():
+def run_alg_styler_propagation(class_attribute="time", subset='"time"<=120  AND "simulation" = 1'):
     """Create a New Post Processor class and returns it"""
 
     class LayerPostProcessor(QgsProcessingLayerPostProcessorInterface):
         instance = None
+        attribute = class_attribute
+        subset_string = subset
 
         def postProcessLayer(self, layer, context, feedback):
             if layer.isValid():
@@ -1322,11 +2185,13 @@ def run_alg_styler_propagation():
                     is_child_algorithm=True,
                 )
                 renderer = layer.renderer()
+                renderer.setClassAttribute(self.attribute)
                 # FIXME DeprecationWarning
                 renderer.updateClasses(layer, QgsGraduatedSymbolRenderer.Mode.Jenks, 10)
                 # enum : EqualInterval , Quantile , Jenks , StdDev , Pretty , Custom
                 # layer.triggerRepaint()
-                layer.setSubsetString('"time"<=120  AND "simulation" = 1')
+                if self.subset_string:
+                    layer.setSubsetString(self.subset_string)
                 QgsMessageLog.logMessage(f"propagation styling done! {layer.name()}", TAG, Qgis.Info)
             else:
                 QgsMessageLog.logMessage(
@@ -1457,7 +2322,16 @@ class BetweennessCentralityMetric(QgsProcessingAlgorithm):
     IN_def_k = "UseDefaultInputSamples"
     IN_k = "InputSamples"
     IN_seed = "InputSamplesRNGSeed"
+    IN_BACKEND = "Backend"
     OUT_R = "BetweennessCentralityRaster"
+    THREADS = "Threads"
+    IN_ADAPTIVE = "AdaptiveSampling"
+    IN_TOLERANCE = "AdaptiveTolerance"
+    IN_TIME_BUDGET = "AdaptiveTimeBudget"
+    IN_BATCH = "AdaptiveBatchSize"
+    IN_MODE = "Mode"
+    backends = ["sparse matrix (scipy)", "networkx (reference, slow)"]
+    modes = ["all simulations merged in one graph", "per simulation propagation trees (averaged, fast)"]
 
     def initAlgorithm(self, config):
         self.addParameter(
@@ -1472,11 +2346,11 @@ class BetweennessCentralityMetric(QgsProcessingAlgorithm):
             QgsProcessingParameterFile(
                 name=self.IN,
                 description=(
-                    "Pickled messages (normally generated by the Propagation Digraph Algorithm"
-                    " results/Messages/messages.pickle)"
+                    "Messages store (normally generated by the Propagation Digraph Algorithm"
+                    f" results/Messages/messages.{MESSAGES_EXT}) or legacy pickled messages (.pickle)"
                 ),
                 behavior=QgsProcessingParameterFile.File,
-                extension="pickle",
+                fileFilter=f"message store files (*.{MESSAGES_EXT});;pickled files (*.pickle)",
                 defaultValue=None,
                 optional=False,
             )
@@ -1515,6 +2389,86 @@ class BetweennessCentralityMetric(QgsProcessingAlgorithm):
         )
         qppn2.setFlags(qppn2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(qppn2)
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                name=self.IN_MODE,
+                description=self.tr(
+                    "Centrality of the merged propagation graph, or of each simulation shortest propagation tree (linear"
+                    " time, then averaged across simulations; sampling and engine options do not apply)"
+                ),
+                options=self.modes,
+                allowMultiple=False,
+                defaultValue=0,
+                optional=False,
+            )
+        )
+        qppe = QgsProcessingParameterEnum(
+            name=self.IN_BACKEND,
+            description=self.tr("Centrality engine (networkx is kept as reference for validation)"),
+            options=self.backends,
+            allowMultiple=False,
+            defaultValue=0,
+            optional=False,
+        )
+        qppe.setFlags(qppe.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppe)
+        qppn = QgsProcessingParameterNumber(
+            name=self.THREADS,
+            description=self.tr("Maximum number of threads to use simultaneously (sparse matrix engine)"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=cpu_count() - 1,
+            optional=True,
+            minValue=1,
+            maxValue=cpu_count(),
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+        # adaptive sampling
+        qppb = QgsProcessingParameterBoolean(
+            name=self.IN_ADAPTIVE,
+            description=self.tr(
+                "Adaptive sampling: add batches of sampled sources until the cells ranking converges (sparse matrix"
+                " engine, K becomes the maximum number of sources if set)"
+            ),
+            defaultValue=False,
+            optional=True,
+        )
+        qppb.setFlags(qppb.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppb)
+        qppn = QgsProcessingParameterNumber(
+            name=self.IN_TOLERANCE,
+            description=self.tr(
+                "Adaptive sampling tolerance: stop when the mean percentile rank shift of the cells between batches is"
+                " below this value"
+            ),
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=0.001,
+            optional=True,
+            minValue=0.0,
+            maxValue=1.0,
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+        qppn = QgsProcessingParameterNumber(
+            name=self.IN_TIME_BUDGET,
+            description=self.tr("Adaptive sampling time budget in seconds (0: no limit)"),
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=0.0,
+            optional=True,
+            minValue=0.0,
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
+        qppn = QgsProcessingParameterNumber(
+            name=self.IN_BATCH,
+            description=self.tr("Adaptive sampling number of sources added per batch"),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=64,
+            optional=True,
+            minValue=1,
+        )
+        qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppn)
         # self.addParameter(
         #     QgsProcessingParameterFeatureSink(
         #         name=self.OUT_L,
@@ -1545,50 +2499,65 @@ class BetweennessCentralityMetric(QgsProcessingAlgorithm):
         H = raster_props["RasterYSize"]
 
         data_file = Path(self.parameterAsString(parameters, self.IN, context))
-        with open(data_file, "rb") as f:
-            data_list = pickle_load(f)
+        data_list = load_messages(data_file)
         feedback.pushDebugInfo(f"data_file: {data_file}, len(data_list): {len(data_list)}")
 
-        mdg = MultiDiGraph()
-        func = vectorize(lambda x: {"weight": x})
-        for k, data in enumerate(data_list):
-            # ebunch_to_add : container of 4-tuples (u, v, k, d) for an edge with data and key k
-            bunch = vstack((data["i"], data["j"], [k] * len(data), func(data["t"]))).T
-            mdg.add_edges_from(bunch)
-            if feedback.isCanceled():
-                break
-
-        if self.parameterAsBool(parameters, self.IN_def_k, context):
-            ksample = int(sqrt(mdg.number_of_nodes() * 5))
-        elif self.parameterAsBool(parameters, self.IN_k, context):
-            ksample = self.parameterAsInt(parameters, self.IN_k, context)
+        if self.parameterAsEnum(parameters, self.IN_MODE, context) == 1:
+            cells, centrality_values = self.trees_centrality(parameters, context, feedback, data_list, W * H)
+        elif self.parameterAsEnum(parameters, self.IN_BACKEND, context) == 1:
+            cells, centrality_values = self.networkx_centrality(parameters, context, feedback, data_list)
         else:
-            ksample = mdg.number_of_nodes()
-        seed = self.parameterAsInt(parameters, self.IN_seed, context)
-        feedback.pushDebugInfo(f"ksample: {ksample}, out of {mdg.number_of_nodes()} nodes, seed: {seed}")
-        centrality = betweenness_centrality(mdg, k=ksample, weight="weight", seed=seed)
+            graph = PropagationGraph.from_messages(data_list, feedback)
+            feedback.pushDebugInfo(f"graph: {len(graph)} nodes, {graph.number_of_edges} edges")
+            seed = self.parameterAsInt(parameters, self.IN_seed, context)
+            threads = self.parameterAsInt(parameters, self.THREADS, context)
+            if platform_system() == "Windows":
+                feedback.pushWarning("MsWindows detected! Using the serial BC calculation, switch to Linux to parallelize")
+            else:
+                feedback.pushDebugInfo(f"Splitting sources in a {threads}-lane parallel execution pool")
+            cells = graph.nodes
+            if self.parameterAsBool(parameters, self.IN_ADAPTIVE, context):
+                max_sources = None
+                if not self.parameterAsBool(parameters, self.IN_def_k, context) and self.parameterAsBool(
+                    parameters, self.IN_k, context
+                ):
+                    max_sources = self.parameterAsInt(parameters, self.IN_k, context)
+                tolerance = self.parameterAsDouble(parameters, self.IN_TOLERANCE, context)
+                time_budget = self.parameterAsDouble(parameters, self.IN_TIME_BUDGET, context)
+                centrality_values, used, change = adaptive_betweenness_centrality(
+                    graph,
+                    seed=seed,
+                    tolerance=tolerance,
+                    time_budget=time_budget,
+                    batch_size=self.parameterAsInt(parameters, self.IN_BATCH, context),
+                    max_sources=max_sources,
+                    threads=threads,
+                    feedback=feedback,
+                )
+                feedback.pushInfo(
+                    f"Adaptive sampling used {used} sources out of {len(graph)} nodes, final ranking change between"
+                    f" batches: {change:.6f} ({'converged' if change < tolerance else 'not converged'},"
+                    f" tolerance {tolerance})"
+                )
+            else:
+                ksample = self.get_ksample(parameters, context, len(graph))
+                feedback.pushDebugInfo(f"ksample: {ksample}, out of {len(graph)} nodes, seed: {seed}")
+                centrality_values = betweenness_centrality(
+                    graph, k=ksample, seed=seed, threads=threads, feedback=feedback
+                )
 
         centrality_array = zeros((H, W), dtype=float32)
-        centrality_values = []
-        for cell, value in centrality.items():
-            i, j = id2xy(cell, W, H)
-            centrality_array[j, i] = value
-            centrality_values += [value]
+        # cell ids are row-major flat indices (id2xy)
+        centrality_array.flat[cells] = centrality_values
 
         # raster
         output_raster_filename = self.parameterAsOutputLayer(parameters, self.OUT_R, context)
-        raster_format = get_output_raster_format(output_raster_filename, feedback)
-        feedback.pushDebugInfo(f"output_raster: {output_raster_filename}, {raster_format}")
-
-        dst_ds = gdal.GetDriverByName(raster_format).Create(output_raster_filename, W, H, 1, GDT_Float32)
-        dst_ds.SetGeoTransform(GT)  # specify coords
-        dst_ds.SetProjection(base_raster.crs().authid())  # export coords to file
-        band = dst_ds.GetRasterBand(1)
-        band.SetUnitType("centrality")
-        if 0 != band.SetNoDataValue(0):
-            feedback.pushWarning(f"Set No Data failed for {self.OUT_R}")
-        if 0 != band.WriteArray(centrality_array):
-            feedback.pushWarning(f"WriteArray failed for {self.OUT_R}")
+        feedback.pushDebugInfo(f"output_raster: {output_raster_filename}")
+        with RasterWriter(
+            output_raster_filename, W, H, 1, GDT_Float32, GT, base_raster.crs().authid(), nodata=0, feedback=feedback
+        ) as writer:
+            writer.band(1).SetUnitType("centrality")
+            writer.write(1, centrality_array)
 
         centrality_stats = scipy_stats.describe(centrality_values, axis=None)
         stats_min, stats_max = centrality_stats.minmax
@@ -1614,6 +2583,61 @@ class BetweennessCentralityMetric(QgsProcessingAlgorithm):
         write_log(feedback, name=self.name())
         return {self.OUT_R: output_raster_filename}
 
+    def get_ksample(self, parameters, context, number_of_nodes):
+        if self.parameterAsBool(parameters, self.IN_def_k, context):
+            return int(sqrt(number_of_nodes * 5))
+        elif self.parameterAsBool(parameters, self.IN_k, context):
+            return self.parameterAsInt(parameters, self.IN_k, context)
+        return number_of_nodes
+
+    def trees_centrality(self, parameters, context, feedback, data_list, number_of_cells):
+        """Per simulation propagation tree betweenness, in parallel, averaged across simulations"""
+        nsim = len(data_list)
+        centrality_sum = zeros(number_of_cells, dtype=float64)
+        reached = zeros(number_of_cells, dtype=bool)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        if platform_system() == "Windows":
+            feedback.pushWarning("MsWindows detected! Using the serial BC calculation, switch to Linux to parallelize")
+            threads = 1
+        feedback.pushDebugInfo(f"Processing {nsim} propagation trees in a {threads}-lane parallel execution pool")
+        if threads > 1:
+            pool = Pool(threads)
+            results = pool.imap(tree_centrality, data_list, chunksize=max(1, min(32, nsim // (4 * threads))))
+        else:
+            pool = None
+            results = map(tree_centrality, data_list)
+        try:
+            for count, (cells, values) in enumerate(results):
+                # cells are unique within a simulation
+                centrality_sum[cells] += values
+                reached[cells] = True
+                if feedback.isCanceled():
+                    raise QgsProcessingException("Algorithm cancelled by user")
+                feedback.setProgress(int((count + 1) / nsim * 100))
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+        cells = flatnonzero(reached)
+        return cells, centrality_sum[cells] / nsim
+
+    def networkx_centrality(self, parameters, context, feedback, data_list):
+        """Reference implementation: networkx MultiDiGraph + betweenness_centrality"""
+        mdg = MultiDiGraph()
+        func = vectorize(lambda x: {"weight": x})
+        for k, data in enumerate(data_list):
+            # ebunch_to_add : container of 4-tuples (u, v, k, d) for an edge with data and key k
+            bunch = vstack((data["i"], data["j"], [k] * len(data), func(data["t"]))).T
+            mdg.add_edges_from(bunch)
+            if feedback.isCanceled():
+                break
+
+        ksample = self.get_ksample(parameters, context, mdg.number_of_nodes())
+        seed = self.parameterAsInt(parameters, self.IN_seed, context)
+        feedback.pushDebugInfo(f"ksample: {ksample}, out of {mdg.number_of_nodes()} nodes, seed: {seed}")
+        centrality = nx_betweenness_centrality(mdg, k=ksample, weight="weight", seed=seed)
+        return list(centrality.keys()), list(centrality.values())
+
     def tr(self, string):
         return QCoreApplication.translate("Processing", string)
 
@@ -1632,67 +2656,63 @@ class BetweennessCentralityMetric(QgsProcessingAlgorithm):
     def displayName(self):
         return self.tr(NAME["bc"])
 
-    def icon(self):
-        return QIcon(":/plugins/fireanalyticstoolbox/assets/bc.svg")
-
-
-def recursion(G: DiGraph, i: int32, mdpv: ndarray, i2n: list[int]) -> ndarray:
-    for j in G.successors(i):
-        mdpv[i2n.index(i)] += recursion(G, j, mdpv, i2n)
-    return mdpv[i2n.index(i)]
-
-
-def worker(data, pv, sid):
-    # digraph_from_messages(msgfile) -> msgG, root
-    msgG = DiGraph()
-    msgG.add_weighted_edges_from(data)
-    root = data[0][0]
-    # shortest_propagation_tree(G, root) -> treeG
-    shortest_paths = single_source_dijkstra_path(msgG, root, weight="time")
-    del shortest_paths[root]
-    treeG = DiGraph()
-    for node, shopat in shortest_paths.items():
-        for i, node in enumerate(shopat[:-1]):
-            treeG.add_edge(node, shopat[i + 1])
-    # dpv_maskG(G, root, pv, i2n) -> mdpv
-    i2n = [n for n in treeG]
-    mdpv = pv[i2n]
-    recursion(treeG, root, mdpv, i2n)
-    # dpv[i2n] += mdpv
-    return mdpv, i2n, sid
+    def helpString(self):
+        return self.shortHelpString()
 
+    def shortHelpString(self):
+        return self.tr(
+            """Betweenness centrality of the burned cells, from the propagation messages store<br>
+            <b>Merged propagation graph</b> mode: every simulation messages together in one directed graph weighted by hit time, Brandes betweenness normalized as networkx does for directed graphs (divided by (n-1)(n-2), n the number of cells), optionally from K sampled sources (rescaled as networkx) or adaptively sampled until the ranking converges<br>
+            <b>Per simulation propagation tree</b> mode: in each simulation shortest propagation tree (the one of the Downstream Protection Value metric) the paths through a cell are those from any of its ancestors to any of its descendants, so its unnormalized betweenness is depth x (descendants); each simulation is divided by its number of ancestor-descendant pairs (the sum of depths), so every fire weighs the same whatever its size, then averaged across simulations. Values are shares of each fire's propagation paths, on a different scale than the merged graph mode: compare rankings, not values
+            """
+        )
 
-def shout_progress(result, feedback):
-    _, i2n, sid = result
-    feedback.pushDebugInfo(f"Processed simulation {sid}, modified cells {len(i2n)}")
+    def icon(self):
+        return QIcon(":/plugins/fireanalyticstoolbox/assets/bc.svg")
 
 
 class DownStreamProtectionValueMetric(QgsProcessingAlgorithm):
     """Messages Simulation Post Processing Algorithm"""
 
     BASE_LAYER = "ProtectionValueRaster"
+    IN_EXTRA = "AdditionalProtectionValueRasters"
     IN = "PickledMessages"
     OUT_R = "RasterOutput"
     THREADS = "Threads"
+    IN_TREES = "PropagationTreeCache"
+    IN_STREAMING = "Streaming"
 
     def initAlgorithm(self, config):
         self.addParameter(
             QgsProcessingParameterRasterLayer(
                 name=self.BASE_LAYER,
-                description=self.tr("Protection Value Raster (get values & geotransform)"),
+                description=self.tr(
+                    "Protection Value Raster (get values & geotransform, each band is a protection value layer)"
+                ),
                 defaultValue=[QgsProcessing.TypeRaster],
                 optional=False,
             )
         )
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                name=self.IN_EXTRA,
+                description=self.tr(
+                    "Additional protection value rasters (same grid), all bands are computed in the same pass and"
+                    " written as bands of the output"
+                ),
+                layerType=QgsProcessing.TypeRaster,
+                optional=True,
+            )
+        )
         self.addParameter(
             QgsProcessingParameterFile(
                 name=self.IN,
                 description=(
-                    "Pickled messages (normally generated by the Propagation Digraph Algorithm"
-                    " results/Messages/messages.pickle)"
+                    "Messages store (normally generated by the Propagation Digraph Algorithm"
+                    f" results/Messages/messages.{MESSAGES_EXT}) or legacy pickled messages (.pickle)"
                 ),
                 behavior=QgsProcessingParameterFile.File,
-                extension="pickle",
+                fileFilter=f"message store files (*.{MESSAGES_EXT});;pickled files (*.pickle)",
                 defaultValue=None,
                 optional=False,
             )
@@ -1718,80 +2738,94 @@ class DownStreamProtectionValueMetric(QgsProcessingAlgorithm):
         )
         qppn.setFlags(qppn.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(qppn)
+        qppb = QgsProcessingParameterBoolean(
+            name=self.IN_TREES,
+            description=self.tr(
+                "Cache the propagation trees next to the messages (<messages>_trees.trees), later runs with other"
+                " protection values only redo the accumulation"
+            ),
+            defaultValue=False,
+            optional=True,
+        )
+        qppb.setFlags(qppb.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppb)
+        qppb = QgsProcessingParameterBoolean(
+            name=self.IN_STREAMING,
+            description=self.tr(
+                "Out-of-core streaming: read each simulation from the messages store on demand instead of memory"
+                " mapping it, for ensembles larger than RAM (needs a messages store, not a pickle)"
+            ),
+            defaultValue=False,
+            optional=True,
+        )
+        qppb.setFlags(qppb.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(qppb)
 
     def processAlgorithm(self, parameters, context, feedback):
         """Here is where the processing itself takes place."""
         # BASE LAYER
         base_raster = self.parameterAsRasterLayer(parameters, self.BASE_LAYER, context)
-        pv, raster_props = read_raster(base_raster.publicSource(), data=True)
+        _, raster_props = read_raster(base_raster.publicSource(), data=False)
         feedback.pushDebugInfo(f"base_raster.crs().authid(): {base_raster.crs().authid()}")
         GT = raster_props["Transform"]
         W = raster_props["RasterXSize"]
         H = raster_props["RasterYSize"]
-        nodata = raster_props["NoDataValue"]
+        # protection value layers: all bands of the base raster, then all bands of the additional rasters
+        pv_layers, band_names = [], []
+        for raster in [base_raster] + self.parameterAsLayerList(parameters, self.IN_EXTRA, context):
+            _, props = read_raster(raster.publicSource(), data=False)
+            if props["RasterXSize"] != W or props["RasterYSize"] != H:
+                raise QgsProcessingException(f"{raster.name()} size differs from {base_raster.name()}: {W}x{H}")
+            for band in range(1, props["RasterCount"] + 1):
+                values, props = read_raster(raster.publicSource(), band=band, data=True)
+                values = values.ravel()
+                nodata = props["NoDataValue"]
+                if nodata:
+                    values[values == nodata] = 0
+                pv_layers += [values]
+                band_names += [f"{raster.name()}_{band}" if props["RasterCount"] > 1 else raster.name()]
+        bands = len(pv_layers)
+        feedback.pushDebugInfo(f"{bands} protection value layers: {band_names}")
 
         data_file = Path(self.parameterAsString(parameters, self.IN, context))
-        with open(data_file, "rb") as f:
-            data_list = pickle_load(f)
+        streaming = self.parameterAsBool(parameters, self.IN_STREAMING, context)
+        if streaming and data_file.suffix == ".pickle":
+            raise QgsProcessingException(
+                "Streaming needs a messages store, run the Propagation DiGraph algorithm to get one from the messages"
+                " files (pickled messages are always loaded whole)"
+            )
+        data_list = load_messages(data_file, memory_map=not streaming)
         feedback.pushDebugInfo(f"data_file: {data_file}, len(data_list): {len(data_list)}")
         nsim = len(data_list)
 
-        pv = pv.ravel()
-        if nodata:
-            pv[pv == nodata] = 0
-        dpv = zeros(pv.shape, dtype=pv.dtype)
+        # (cells,) or (cells, bands)
+        pv = pv_layers[0] if bands == 1 else column_stack(pv_layers)
 
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
         if platform_system() == "Windows":
             feedback.pushWarning("MsWindows detected! Using the serial DPV calculation, switch to Linux to parallelize")
-            for count, data in enumerate(data_list):
-                # digraph_from_messages(msgfile) -> msgG, root
-                msgG = DiGraph()
-                msgG.add_weighted_edges_from(data)
-                root = data[0][0]  # checkar que el primer valor del message sea el punto de ignición
-                # shortest_propagation_tree(G, root) -> treeG
-                shortest_paths = single_source_dijkstra_path(msgG, root, weight="time")
-                del shortest_paths[root]
-                treeG = DiGraph()
-                for node, shopat in shortest_paths.items():
-                    for i, node in enumerate(shopat[:-1]):
-                        treeG.add_edge(node, shopat[i + 1])
-                # dpv_maskG(G, root, pv, i2n) -> mdpv
-                i2n = [n for n in treeG]  # TODO change to generator?
-                mdpv = pv[i2n]
-                recursion(treeG, root, mdpv, i2n)
-                dpv[i2n] += mdpv
-                feedback.setProgress((count + 1) / nsim * 100)
-                if feedback.isCanceled():
-                    break
         else:
-            # multiprocessing
-            threads = self.parameterAsEnum(parameters, self.THREADS, context)
-            feedback.pushDebugInfo(f"Orchestrating {nsim} processes in a {threads}-lane parallel execution pool")
-            pool = Pool(threads)
-            results = [
-                pool.apply_async(worker, args=(data, pv, i), callback=partial(shout_progress, feedback=feedback))
-                for i, data in enumerate(data_list)
-            ]
-            while True:
-                # user canceled?
-                if feedback.isCanceled():
-                    feedback.pushWarning("Canceling...")
-                    pool.terminate()
-                    return {}
-                # all done?
-                statuses = [result.ready() for result in results]
-                if all(statuses):
-                    break
-                feedback.setProgress(int(100 * sum(statuses) / nsim))
-                # wait
-                results[statuses.index(False)].wait(1)
-            # retrieve
-            for result in results:
-                sdpv, si2n, sid = result.get()
-                dpv[si2n] += sdpv
-                # feedback.pushDebugInfo(f"accumulated dpv sum -per simulation {sid}: {dpv.sum()}")
-            pool.close()
-            pool.join()
+            feedback.pushDebugInfo(f"Dispatching {nsim} simulations in chunks to a {threads}-lane parallel execution pool")
+        trees = None
+        if self.parameterAsBool(parameters, self.IN_TREES, context):
+            trees_file = tree_cache_file(data_file)
+            signature = messages_signature(data_file, nsim)
+            trees = open_tree_cache(trees_file, signature, memory_map=not streaming)
+            if trees is None:
+                feedback.pushInfo(f"Building propagation tree cache: {trees_file}")
+                trees = build_tree_cache(data_list, trees_file, signature, threads, feedback)
+            else:
+                feedback.pushInfo(f"Reusing propagation tree cache: {trees_file}")
+            if feedback.isCanceled():
+                feedback.pushWarning("Canceling...")
+                return {}
+        dpv = downstream_protection_value(data_list, pv, threads, feedback, trees=trees)
+        if feedback.isCanceled():
+            feedback.pushWarning("Canceling...")
+            return {}
+        main_peak, worker_peak = get_peak_memory()
+        if main_peak:
+            feedback.pushInfo(f"Peak memory: main process {main_peak:.0f} MB, largest worker {worker_peak:.0f} MB")
         # scale
         dpv = dpv / nsim
         # descriptive statistics
@@ -1806,18 +2840,16 @@ class DownStreamProtectionValueMetric(QgsProcessingAlgorithm):
         feedback.pushInfo(f"stats {msg}: {dpv_stats}")
         # raster
         output_raster_filename = self.parameterAsOutputLayer(parameters, self.OUT_R, context)
-        raster_format = get_output_raster_format(output_raster_filename, feedback)
-        feedback.pushDebugInfo(f"output_raster: {output_raster_filename}, {raster_format}")
-
-        dst_ds = gdal.GetDriverByName(raster_format).Create(output_raster_filename, W, H, 1, GDT_Float32)
-        dst_ds.SetGeoTransform(GT)  # specify coords
-        dst_ds.SetProjection(base_raster.crs().authid())  # export coords to file
-        band = dst_ds.GetRasterBand(1)
-        band.SetUnitType("protection_value")
-        if 0 != band.SetNoDataValue(0):
-            feedback.pushWarning(f"Set No Data failed for {self.OUT_R}")
-        if 0 != band.WriteArray(float32(dpv.reshape(H, W))):
-            feedback.pushWarning(f"WriteArray failed for {self.OUT_R}")
+        feedback.pushDebugInfo(f"output_raster: {output_raster_filename}")
+        dpv = dpv.reshape(H, W, bands)
+        authid = base_raster.crs().authid()
+        with RasterWriter(
+            output_raster_filename, W, H, bands, GDT_Float32, GT, authid, nodata=0, feedback=feedback
+        ) as writer:
+            for b in range(bands):
+                writer.band(b + 1).SetUnitType("protection_value")
+                writer.band(b + 1).SetDescription(band_names[b])
+                writer.write(b + 1, float32(dpv[:, :, b]))
 
         if context.willLoadLayerOnCompletion(output_raster_filename):
             # attach post processor
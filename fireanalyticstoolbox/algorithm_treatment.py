@@ -40,7 +40,7 @@ from time import sleep, time
 import numpy as np
 import processing
 from fire2a.raster import get_geotransform, get_rlayer_data, get_rlayer_info
-from osgeo.gdal import GDT_Int16, GetDriverByName
+from osgeo.gdal import GDT_Int16
 from pandas import DataFrame, read_csv
 # from processing.tools.system import getTempFilename
 from pyomo import environ as pyo
@@ -56,7 +56,7 @@ from qgis.core import (Qgis, QgsFeature, QgsFeatureRequest, QgsFeatureSink, QgsF
 from qgis.PyQt.QtCore import QByteArray, QCoreApplication, QVariant
 from qgis.PyQt.QtGui import QIcon
 
-from .algorithm_utils import (QgsProcessingParameterRasterDestinationGpkg, array2rasterInt16, get_output_raster_format,
+from .algorithm_utils import (QgsProcessingParameterRasterDestinationGpkg, RasterWriter, array2rasterInt16,
                               get_raster_data, get_raster_info, get_raster_nodata, run_alg_style_raster_legend,
                               run_alg_styler_bin, write_log)
 from .config import METRICS, NAME, SIM_OUTPUTS, STATS, TAG, jolo
@@ -342,24 +342,17 @@ class RasterTreatmentTeamAlgorithm(QgsProcessingAlgorithm):
 
         # write output raster
         out_team_raster_filename = self.parameterAsOutputLayer(parameters, self.OUT_TEAM_LAYER, context)
-        out_team_raster_format = get_output_raster_format(out_team_raster_filename, feedback)
-        ds = GetDriverByName(out_team_raster_format).Create(out_team_raster_filename, W, H, 1, GDT_Int16)
-        ds.SetProjection(rasters["current_treatment"]["info"]["crs"].authid())  # export coords to file
         gt = rasters["current_treatment"]["GT"]
         if abs(gt[-1]) > 0:
             gt = (gt[0], gt[1], gt[2], gt[3], gt[4], -abs(gt[5]))
             feedback.pushWarning("Geotransform: Flipping Y axis...")
         feedback.pushDebugInfo(f"{gt=}")
-        ds.SetGeoTransform(gt)  # specify coords
-        band = ds.GetRasterBand(1)
-        band.SetUnitType("team_index")
-        if 0 != band.SetNoDataValue(int(-3)):
-            feedback.pushWarning(f"Set No Data failed for {self.name()}")
-        if 0 != band.WriteArray(teams):
-            feedback.pushWarning(f"WriteArray failed for {self.name()}")
-        band = None
-        ds.FlushCache()  # write to disk
-        ds = None
+        authid = rasters["current_treatment"]["info"]["crs"].authid()
+        with RasterWriter(
+            out_team_raster_filename, W, H, 1, GDT_Int16, gt, authid, nodata=-3, feedback=feedback
+        ) as writer:
+            writer.band(1).SetUnitType("team_index")
+            writer.write(1, teams)
         retdic[self.OUT_TEAM_LAYER] = out_team_raster_filename
         # show
         if context.willLoadLayerOnCompletion(out_team_raster_filename):
@@ -373,24 +366,17 @@ class RasterTreatmentTeamAlgorithm(QgsProcessingAlgorithm):
 
         # write output raster
         out_treat_raster_filename = self.parameterAsOutputLayer(parameters, self.OUT_TREAT_LAYER, context)
-        out_treat_raster_format = get_output_raster_format(out_treat_raster_filename, feedback)
-        ds = GetDriverByName(out_treat_raster_format).Create(out_treat_raster_filename, W, H, 1, GDT_Int16)
-        ds.SetProjection(rasters["current_treatment"]["info"]["crs"].authid())  # export coords to file
         gt = rasters["current_treatment"]["GT"]
         if abs(gt[-1]) > 0:
             gt = (gt[0], gt[1], gt[2], gt[3], gt[4], -abs(gt[5]))
             feedback.pushWarning("Geotransform: Flipping Y axis...")
         feedback.pushDebugInfo(f"{gt=}")
-        ds.SetGeoTransform(gt)  # specify coords
-        band = ds.GetRasterBand(1)
-        band.SetUnitType("treat_index")
-        if 0 != band.SetNoDataValue(int(-3)):
-            feedback.pushWarning(f"Set No Data failed for {self.name()}")
-        if 0 != band.WriteArray(treats):
-            feedback.pushWarning(f"WriteArray failed for {self.name()}")
-        band = None
-        ds.FlushCache()  # write to disk
-        ds = None
+        authid = rasters["current_treatment"]["info"]["crs"].authid()
+        with RasterWriter(
+            out_treat_raster_filename, W, H, 1, GDT_Int16, gt, authid, nodata=-3, feedback=feedback
+        ) as writer:
+            writer.band(1).SetUnitType("treat_index")
+            writer.write(1, treats)
         retdic[self.OUT_TREAT_LAYER] = out_treat_raster_filename
         # show
         if context.willLoadLayerOnCompletion(out_treat_raster_filename):
@@ -648,24 +634,15 @@ class RasterTreatmentAlgorithm(QgsProcessingAlgorithm):
 
         # write output raster
         out_raster_filename = self.parameterAsOutputLayer(parameters, self.OUT_LAYER, context)
-        out_raster_format = get_output_raster_format(out_raster_filename, feedback)
-        ds = GetDriverByName(out_raster_format).Create(out_raster_filename, W, H, 1, GDT_Int16)
-        ds.SetProjection(rasters["current_treatment"]["info"]["crs"].authid())  # export coords to file
         gt = rasters["current_treatment"]["GT"]
         if abs(gt[-1]) > 0:
             gt = (gt[0], gt[1], gt[2], gt[3], gt[4], -abs(gt[5]))
             feedback.pushWarning("Geotransform: Flipping Y axis...")
         feedback.pushDebugInfo(f"{gt=}")
-        ds.SetGeoTransform(gt)  # specify coords
-        band = ds.GetRasterBand(1)
-        band.SetUnitType("treatment_index")
-        if 0 != band.SetNoDataValue(int(-3)):
-            feedback.pushWarning(f"Set No Data failed for {self.name()}")
-        if 0 != band.WriteArray(summary.reshape(H, W)):
-            feedback.pushWarning(f"WriteArray failed for {self.name()}")
-        band = None
-        ds.FlushCache()  # write to disk
-        ds = None
+        authid = rasters["current_treatment"]["info"]["crs"].authid()
+        with RasterWriter(out_raster_filename, W, H, 1, GDT_Int16, gt, authid, nodata=-3, feedback=feedback) as writer:
+            writer.band(1).SetUnitType("treatment_index")
+            writer.write(1, summary.reshape(H, W))
         retdic[self.OUT_LAYER] = out_raster_filename
         # show
         if context.willLoadLayerOnCompletion(out_raster_filename):
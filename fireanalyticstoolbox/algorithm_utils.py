@@ -1,14 +1,15 @@
 #!python3
 import os
 from pathlib import Path
+from platform import system as platform_system
 from tempfile import NamedTemporaryFile
 
 import numpy as np
+from osgeo import gdal
 from processing.algs.gdal.GdalUtils import GdalUtils
 from qgis.core import (Qgis, QgsColorRampShader, QgsMessageLog, QgsPalettedRasterRenderer, QgsProcessingFeedback,
                        QgsProcessingLayerPostProcessorInterface, QgsProcessingParameterRasterDestination,
-                       QgsRasterBlock, QgsRasterFileWriter, QgsRasterShader, QgsSingleBandPseudoColorRenderer)
-from qgis.PyQt.QtCore import QByteArray
+                       QgsRasterShader, QgsSingleBandPseudoColorRenderer)
 from qgis.PyQt.QtGui import QColor
 
 from .config import TAG
@@ -60,22 +61,139 @@ def check_gdal_readable_raster(filename):
     return False
 
 
-def array2rasterInt16(data, name, geopackage, extent, crs, nodata=None):
-    """numpy array to gpkg casts to name"""
+RASTER_BLOCK_SIZE = 512
+RASTER_OVERVIEW_MIN_SIZE = 256
+
+
+def raster_creation_options(driver_name: str, data_type: int, predictor: int = None) -> list[str]:
+    """Tiled and compressed (cloud optimized layout) GTiff creation options; no options for other drivers
+
+    predictor: 1 none, 2 horizontal differencing (default for integers), 3 floating point (default for floats)
+    """
+    if driver_name != "GTiff":
+        return []
+    if predictor is None:
+        predictor = 3 if data_type in [gdal.GDT_Float32, gdal.GDT_Float64] else 2
+    return [
+        "TILED=YES",
+        f"BLOCKXSIZE={RASTER_BLOCK_SIZE}",
+        f"BLOCKYSIZE={RASTER_BLOCK_SIZE}",
+        "COMPRESS=DEFLATE",
+        f"PREDICTOR={predictor}",
+        "BIGTIFF=IF_SAFER",
+        "NUM_THREADS=ALL_CPUS",
+    ]
+
+
+def overview_levels(W: int, H: int) -> list[int]:
+    """Decimation factors (2, 4, 8...) until the smallest overview fits in one RASTER_OVERVIEW_MIN_SIZE tile"""
+    levels = []
+    while max(W, H) // 2 ** (len(levels) + 1) >= RASTER_OVERVIEW_MIN_SIZE:
+        levels += [2 ** (len(levels) + 1)]
+    return levels
+
+
+class RasterWriter:
+    """Raster output shared by all algorithms: tiled, compressed (GTiff), written block by block; on close it gets
+    internal overviews and embedded band statistics, so QGIS opens, pans and styles it without rescanning the data
+
+    Sample usage:
+        with RasterWriter(filename, W, H, bands, GDT_Float32, GT, authid, nodata=0, feedback=feedback) as writer:
+            writer.band(1).SetDescription("mean")
+            writer.write(1, array)
+    """
+
+    def __init__(
+        self,
+        filename,
+        W: int,
+        H: int,
+        bands: int = 1,
+        data_type: int = gdal.GDT_Float32,
+        geotransform=None,
+        projection: str = None,
+        nodata=None,
+        feedback: QgsProcessingFeedback = None,
+        driver_name: str = None,
+        options: list[str] = (),
+        predictor: int = None,
+        overviews: bool = True,
+        statistics: bool = True,
+    ):
+        self.filename = str(filename)
+        self.driver_name = driver_name or get_output_raster_format(self.filename, feedback)
+        self.data_type = data_type
+        self.overviews = overviews
+        self.statistics = statistics
+        self.feedback = feedback
+        options = raster_creation_options(self.driver_name, data_type, predictor) + list(options)
+        if feedback:
+            feedback.pushDebugInfo(f"creating {self.filename}, {self.driver_name=}, {bands=}, {options=}")
+        self.dataset = gdal.GetDriverByName(self.driver_name).Create(
+            self.filename, W, H, bands, data_type, options=options
+        )
+        if geotransform is not None:
+            self.dataset.SetGeoTransform(geotransform)
+        if projection:
+            self.dataset.SetProjection(projection)
+        if nodata is not None:
+            for b in range(1, bands + 1):
+                self.band(b).SetNoDataValue(nodata)
+
+    def band(self, b: int):
+        """1-based band"""
+        return self.dataset.GetRasterBand(b)
+
+    def write(self, b: int, data: np.ndarray, xoff: int = 0, yoff: int = 0):
+        """Write a (rows, columns) array into band b at the offsets, in strips of whole tile rows"""
+        band = self.band(b)
+        for start in range(0, data.shape[0], RASTER_BLOCK_SIZE):
+            if 0 != band.WriteArray(data[start : start + RASTER_BLOCK_SIZE], xoff, yoff + start):
+                if self.feedback:
+                    self.feedback.pushWarning(f"WriteArray failed for {self.filename} band {b}")
+
+    def close(self):
+        """Flush, build overviews and compute band statistics, then close the file"""
+        if self.dataset is None:
+            return
+        self.dataset.FlushCache()
+        if self.overviews and (levels := overview_levels(self.dataset.RasterXSize, self.dataset.RasterYSize)):
+            resampling = "AVERAGE" if self.data_type in [gdal.GDT_Float32, gdal.GDT_Float64] else "NEAREST"
+            self.dataset.BuildOverviews(resampling, levels)
+        if self.statistics:
+            for b in range(1, self.dataset.RasterCount + 1):
+                self.band(b).ComputeStatistics(False)
+        self.dataset.FlushCache()
+        self.dataset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def array2rasterInt16(data, name, geopackage, extent, crs, nodata=None, feedback=None):
+    """numpy array to gpkg (raster table name) casts to int16, other formats by the file extension"""
     data = np.int16(data)
     h, w = data.shape
-    bites = QByteArray(data.tobytes())
-    block = QgsRasterBlock(Qgis.CInt16, w, h)
-    block.setData(bites)
-    fw = QgsRasterFileWriter(str(geopackage))
-    fw.setOutputFormat("gpkg")
-    fw.setCreateOptions(["RASTER_TABLE=" + name, "APPEND_SUBDATASET=YES"])
-    provider = fw.createOneBandRaster(Qgis.Int16, w, h, extent, crs)
-    provider.setEditable(True)
-    if nodata != None:
-        provider.setNoDataValue(1, nodata)
-    provider.writeBlock(block, 1, 0, 0)
-    provider.setEditable(False)
+    geotransform = (extent.xMinimum(), extent.width() / w, 0, extent.yMaximum(), 0, -extent.height() / h)
+    driver_name = get_output_raster_format(str(geopackage), feedback)
+    options = ["RASTER_TABLE=" + name, "APPEND_SUBDATASET=YES"] if driver_name == "GPKG" else []
+    with RasterWriter(
+        geopackage,
+        w,
+        h,
+        1,
+        gdal.GDT_Int16,
+        geotransform,
+        crs.toWkt(),
+        nodata=nodata,
+        feedback=feedback,
+        driver_name=driver_name,
+        options=options,
+    ) as writer:
+        writer.write(1, data)
 
 
 def get_raster_data(layer):
@@ -186,6 +304,20 @@ def run_alg_styler_bin(display_name, color0=(2, 2, 2), color1=(222, 222, 222), l
     return LayerPostProcessor.create()
 
 
+def get_peak_memory():
+    """Peak resident memory in MB of this process and of its largest finished child process (e.g. pool workers)
+
+    Returns (None, None) where the resource module is not available (MsWindows)
+    """
+    try:
+        from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+    except ImportError:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux, bytes on MacOS
+    scale = 1024 * 1024 if platform_system() == "Darwin" else 1024
+    return getrusage(RUSAGE_SELF).ru_maxrss / scale, getrusage(RUSAGE_CHILDREN).ru_maxrss / scale
+
+
 def write_log(feedback, name="", file_name=None):
     if not file_name:
         file_name = Path(NamedTemporaryFile(prefix=f"algorithm_{name}_log_", suffix=".html", delete=False).name)
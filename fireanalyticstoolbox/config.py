@@ -24,6 +24,7 @@ STATS = [
         "file": "ROSFile",
         "ext": "asc",
         "arg": "out-ros",
+        "short": "ros",
         "unit": "m/min",
         "dtype": "float32",
     },
@@ -33,8 +34,10 @@ STATS = [
         "file": "FL",
         "ext": "asc",
         "arg": "out-fl",
+        "short": "fl",
         "unit": "m",
         "dtype": "float32",
+        "thresholds": [1.2, 2.5, 3.5],
     },
     {
         "name": "Byram Intensity",
@@ -42,8 +45,10 @@ STATS = [
         "file": "Intensity",
         "ext": "asc",
         "arg": "out-intensity",
+        "short": "intensity",
         "unit": "kW/m",
         "dtype": "float32",
+        "thresholds": [350, 1700, 4000],
     },
     {
         "name": "Crown Fire Scar",
@@ -51,6 +56,7 @@ STATS = [
         "file": "Crown",
         "ext": "asc",
         "arg": "out-crown",
+        "short": "crown",
         "unit": "bool",
         "dtype": "int16",
     },
@@ -60,6 +66,7 @@ STATS = [
         "file": "Cfb",
         "ext": "asc",
         "arg": "out-cfb",
+        "short": "cfb",
         "unit": "ratio",
         "dtype": "float32",
     },
@@ -69,6 +76,7 @@ STATS = [
         "file": "Sfb",
         "ext": "asc",
         "arg": "out-sfb",
+        "short": "sfb",
         "unit": "ton",
         "dtype": "float32",
     },
@@ -125,6 +133,8 @@ NAME = {
     "bc": "Betweenness Centrality Propagation Metric",
     "dpv": "Downstream Protection Value Propagation Metric",
     "bp": "Burn Probability Propagation Metric",
+    "scar_cube": "Scar Cube Subset Query",
+    "bp_convergence": "Burn Probability Convergence",
     "fuel_models": ["0. Scott & Burgan", "1. Kitral", "2. Canadian Forest Fire Behavior Prediction System"],
     "fuel_tables": ["spain_lookup_table.csv", "kitral_lookup_table.csv", "fbp_lookup_table.csv"],
     "ignition_modes": [
@@ -39,9 +39,9 @@ from .algorithm_instance_downloader import InstanceDownloader
 from .algorithm_knapsack import PolygonKnapsackAlgorithm, RasterKnapsackAlgorithm
 from .algorithm_match_aiigrids import MatchAIIGrid
 from .algorithm_meteo import MeteoAlgo
-from .algorithm_postsimulation import (BetweennessCentralityMetric, BurnProbabilityMetric, DownStreamProtectionValueMetric,
-                                       IgnitionPointsSIMPP, MessagesSIMPP, PostSimulationAlgorithm, ScarSIMPP,
-                                       StatisticSIMPP)
+from .algorithm_postsimulation import (BetweennessCentralityMetric, BurnProbabilityConvergence, BurnProbabilityMetric,
+                                       DownStreamProtectionValueMetric, IgnitionPointsSIMPP, MessagesSIMPP,
+                                       PostSimulationAlgorithm, ScarCubeQueryMetric, ScarSIMPP, StatisticSIMPP)
 from .algorithm_raster_tutorial import RasterTutorial
 from .algorithm_sandbox import SandboxAlgorithm
 from .algorithm_simulator import FireSimulatorAlgorithm
@@ -82,6 +82,8 @@ class FireToolboxProvider(QgsProcessingProvider):
         self.addAlgorithm(BetweennessCentralityMetric())
         self.addAlgorithm(DownStreamProtectionValueMetric())
         self.addAlgorithm(BurnProbabilityMetric())
+        self.addAlgorithm(ScarCubeQueryMetric())
+        self.addAlgorithm(BurnProbabilityConvergence())
         self.addAlgorithm(RasterTutorial())
         self.addAlgorithm(InstanceDownloader())
         self.addAlgorithm(PolyTreatmentAlgorithm())
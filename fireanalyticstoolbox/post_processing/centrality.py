@@ -0,0 +1,292 @@
+#!python3
+"""
+betweenness centrality helpers
+
+Sparse matrix engine for the betweenness centrality of the propagation multigraph (all simulations messages together),
+replacing networkx.MultiDiGraph + betweenness_centrality:
+- the graph is a scipy CSR adjacency over dense node indices; like the MultiDiGraph it replaces (edges keyed by
+  simulation) a message repeated within a simulation keeps its last hit time, and parallel edges of different
+  simulations collapse to their minimum weight (as networkx shortest paths do for multigraphs)
+- each source runs scipy.sparse.csgraph.dijkstra (C heap), the shortest path DAG is the set of edges with
+  dist[u] + w == dist[v]
+- path counting (sigma) and dependency accumulation (delta) are done frontier by frontier over the DAG with numpy
+
+Node order and pivot sampling mimic networkx (random.Random(seed).sample over nodes in insertion order), so both
+backends use the same sources for the same seed.
+
+Sources are independent: they are split in fixed size chunks over a pool of processes that inherit the graph once (pool
+initializer), each returning its partial dependency vector; partials are summed in chunk order, so results are
+reproducible for a seed whatever the number of processes.
+
+The adaptive mode keeps adding batches of sources (consecutive slices of one seeded permutation) until the ranking of
+the nodes stops changing (mean percentile rank shift between batches below a tolerance) or a time budget runs out.
+
+Sample usage:
+    graph = PropagationGraph.from_messages(data_list)
+    centrality = betweenness_centrality(graph, k=100, seed=42, threads=4)
+    raster.flat[graph.nodes] = centrality
+"""
+from multiprocessing import Pool
+from platform import system as platform_system
+from random import Random
+from time import perf_counter
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.stats import rankdata
+
+
+class PropagationGraph:
+    """Directed weighted graph of propagation messages as a CSR adjacency
+
+    nodes: cell id of each dense node index, in order of first appearance (like networkx insertion order)
+    matrix: csr_matrix (n, n), matrix[u, v] is the minimum over simulations of the last hit time of their u -> v
+    messages
+    tails: source node of each stored edge (CSR row index expanded)
+    """
+
+    def __init__(self, nodes: np.ndarray, matrix: csr_matrix):
+        self.nodes = nodes
+        self.matrix = matrix
+        self.tails = np.repeat(np.arange(len(nodes), dtype=matrix.indices.dtype), np.diff(matrix.indptr))
+
+    @classmethod
+    def from_messages(cls, data_list, feedback=None):
+        """Build from a list (or store) of structured arrays with fields i, j, t"""
+        ii, jj, tt, ss = [], [], [], []
+        for k, data in enumerate(data_list):
+            ii += [data["i"]]
+            jj += [data["j"]]
+            tt += [data["t"]]
+            ss += [np.full(len(data), k, dtype=np.int64)]
+            if feedback and feedback.isCanceled():
+                break
+        ii = np.concatenate(ii) if ii else np.empty(0, dtype=np.int64)
+        jj = np.concatenate(jj) if jj else np.empty(0, dtype=np.int64)
+        tt = np.concatenate(tt) if tt else np.empty(0, dtype=np.float64)
+        ss = np.concatenate(ss) if ss else np.empty(0, dtype=np.int64)
+        # dense node index by first appearance in the i0, j0, i1, j1, ... stream
+        stream = np.column_stack((ii, jj)).ravel()
+        cells, first, inverse = np.unique(stream, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind="stable")
+        rank = np.empty(len(cells), dtype=np.int64)
+        rank[order] = np.arange(len(cells))
+        inverse = rank[inverse.ravel()].reshape(-1, 2)
+        u, v = inverse[:, 0], inverse[:, 1]
+        n = len(cells)
+        key = u * n + v
+        # repeated messages of a simulation keep the last one (same edge key, attributes updated)
+        sorter = np.lexsort((np.arange(len(key)), key, ss))
+        last = np.ones(len(sorter), dtype=bool)
+        last[:-1] = (key[sorter][1:] != key[sorter][:-1]) | (ss[sorter][1:] != ss[sorter][:-1])
+        last = sorter[last]
+        # then collapse parallel edges of different simulations keeping the minimum weight
+        sorter = last[np.lexsort((tt[last], key[last]))]
+        keep = np.ones(len(sorter), dtype=bool)
+        keep[1:] = key[sorter][1:] != key[sorter][:-1]
+        sorter = sorter[keep]
+        matrix = csr_matrix((tt[sorter].astype(np.float64), (u[sorter], v[sorter])), shape=(n, n))
+        matrix.sort_indices()
+        return cls(cells[order], matrix)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def number_of_edges(self):
+        return self.matrix.nnz
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, stop) for each pair"""
+    lengths = stops - starts
+    total = lengths.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+
+def single_source_dependency(graph: PropagationGraph, source: int) -> np.ndarray:
+    """Brandes dependency of every node on the shortest paths starting at source (0 for the source itself)"""
+    n = len(graph)
+    dist = dijkstra(graph.matrix, directed=True, indices=source)
+    tail_dist = dist[graph.tails]
+    on_dag = np.isfinite(tail_dist) & (tail_dist + graph.matrix.data == dist[graph.matrix.indices])
+    u = graph.tails[on_dag]
+    v = graph.matrix.indices[on_dag]
+    # u is sorted (CSR order), so the DAG is also a CSR
+    dag_ptr = np.searchsorted(u, np.arange(n + 1))
+    pending = np.bincount(v, minlength=n)
+    sigma = np.zeros(n, dtype=np.float64)
+    sigma[source] = 1.0
+    # forward: count shortest paths, frontier by frontier (a node enters once all its DAG predecessors are done)
+    levels = []
+    frontier = np.array([source])
+    while frontier.size > 0:
+        edges = _ranges(dag_ptr[frontier], dag_ptr[frontier + 1])
+        if edges.size == 0:
+            break
+        levels += [edges]
+        np.add.at(sigma, v[edges], sigma[u[edges]])
+        heads, counts = np.unique(v[edges], return_counts=True)
+        pending[heads] -= counts
+        frontier = heads[pending[heads] == 0]
+    # backward: accumulate dependencies, deepest frontier first
+    delta = np.zeros(n, dtype=np.float64)
+    for edges in reversed(levels):
+        tails, heads = u[edges], v[edges]
+        np.add.at(delta, tails, sigma[tails] / sigma[heads] * (1 + delta[heads]))
+    delta[source] = 0.0
+    return delta
+
+
+def sample_sources(graph: PropagationGraph, k: int = None, seed: int = None) -> list[int]:
+    """Pivot sources, the same as networkx betweenness_centrality(G, k=k, seed=seed) picks; all nodes if k is None"""
+    n = len(graph)
+    if k is None or k == n:
+        return list(range(n))
+    return Random(seed).sample(range(n), k)
+
+
+# graph shared (read-only) by the pool workers, set once per worker by the pool initializer
+_shared_graph = None
+
+
+def _attach_graph(graph: PropagationGraph):
+    global _shared_graph
+    _shared_graph = graph
+
+
+def _chunk_dependencies(sources, graph: PropagationGraph = None) -> np.ndarray:
+    """Partial sum of the single source dependencies of a chunk of sources"""
+    graph = graph if graph is not None else _shared_graph
+    partial = np.zeros(len(graph), dtype=np.float64)
+    for source in sources:
+        partial += single_source_dependency(graph, source)
+    return partial
+
+
+def dependency_pool(graph: PropagationGraph, threads: int):
+    """Pool of processes attached to the graph, None if serial (one thread or MsWindows)"""
+    if threads <= 1 or platform_system() == "Windows":
+        return None
+    return Pool(threads, initializer=_attach_graph, initargs=(graph,))
+
+
+def accumulate_dependencies(
+    graph: PropagationGraph, sources, threads: int = 1, feedback=None, chunk_size: int = 16, pool=None
+) -> np.ndarray:
+    """Sum of the single source dependencies of the given sources, split in chunks over a pool of processes
+
+    Chunks are fixed size and summed in order, so the result does not depend on the number of threads.
+    A given pool (see dependency_pool) is reused and left open, else one is created for this call
+    """
+    chunks = [sources[start : start + chunk_size] for start in range(0, len(sources), chunk_size)]
+    betweenness = np.zeros(len(graph), dtype=np.float64)
+    own_pool = pool is None and len(chunks) > 1
+    if own_pool:
+        pool = dependency_pool(graph, threads)
+    if pool:
+        partials = pool.imap(_chunk_dependencies, chunks)
+    else:
+        partials = (_chunk_dependencies(chunk, graph) for chunk in chunks)
+    try:
+        for count, partial in enumerate(partials):
+            betweenness += partial
+            if feedback:
+                if feedback.isCanceled():
+                    break
+                feedback.setProgress(int((count + 1) / len(chunks) * 100))
+    finally:
+        if own_pool and pool:
+            pool.terminate()
+            pool.join()
+    return betweenness
+
+
+def rescale(betweenness: np.ndarray, sources=None) -> np.ndarray:
+    """Normalize directed betweenness (endpoints excluded) as networkx does, correcting for sampled sources
+
+    sources: None if all nodes were used as sources
+    """
+    n = len(betweenness) - 1
+    if n < 2:
+        return betweenness
+    if sources is None or len(sources) == len(betweenness):
+        return betweenness / (n * (n - 1))
+    k = len(sources)
+    scale = np.full(len(betweenness), 1 / (k * (n - 1)))
+    scale[np.asarray(sources)] = 1 / ((k - 1) * (n - 1)) if k > 1 else np.nan
+    return betweenness * scale
+
+
+def betweenness_centrality(
+    graph: PropagationGraph, k: int = None, seed: int = None, threads: int = 1, feedback=None
+) -> np.ndarray:
+    """Normalized betweenness centrality of each node (graph.nodes order), estimated from k sampled sources"""
+    sources = sample_sources(graph, k, seed)
+    betweenness = accumulate_dependencies(graph, sources, threads, feedback)
+    return rescale(betweenness, None if k is None or k == len(graph) else sources)
+
+
+def ranking_change(previous: np.ndarray, current: np.ndarray) -> float:
+    """Mean absolute shift of each node percentile rank between two estimates (0: same ranking, ~1/3: unrelated)"""
+    n = len(current)
+    if n < 2:
+        return 0.0
+    return float(np.mean(np.abs(rankdata(previous) - rankdata(current))) / n)
+
+
+def adaptive_betweenness_centrality(
+    graph: PropagationGraph,
+    seed: int = None,
+    tolerance: float = 0.001,
+    time_budget: float = 0,
+    batch_size: int = 64,
+    max_sources: int = None,
+    threads: int = 1,
+    feedback=None,
+):
+    """Anytime betweenness estimation: adds batches of sampled sources until the per node ranking stops changing
+
+    Stops when the ranking change between consecutive batches is below tolerance, when time_budget seconds (0: no
+    limit) are spent, or when max_sources (default all nodes) are used.
+    Returns (centrality, number of sources used, last ranking change)
+    """
+    n = len(graph)
+    max_sources = n if max_sources is None else min(max_sources, n)
+    # one random permutation, batches are its consecutive slices
+    sources = Random(seed).sample(range(n), n)
+    betweenness = np.zeros(n, dtype=np.float64)
+    centrality = betweenness
+    used, change = 0, np.inf
+    start = perf_counter()
+    pool = dependency_pool(graph, threads)
+    try:
+        while used < max_sources:
+            batch = sources[used : min(used + batch_size, max_sources)]
+            betweenness += accumulate_dependencies(graph, batch, pool=pool)
+            used += len(batch)
+            previous, centrality = centrality, rescale(betweenness, sources[:used])
+            if used > len(batch):
+                change = ranking_change(previous, centrality)
+            elapsed = perf_counter() - start
+            if feedback:
+                feedback.pushDebugInfo(f"sources: {used}, ranking change: {change:.6f}, elapsed: {elapsed:.1f}s")
+                if feedback.isCanceled():
+                    break
+                progress = used / max_sources
+                if time_budget > 0:
+                    progress = max(progress, elapsed / time_budget)
+                feedback.setProgress(int(min(progress, 1) * 100))
+            if change < tolerance or (0 < time_budget <= elapsed):
+                break
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    if used == n:
+        change = 0.0
+    return centrality, used, change
@@ -0,0 +1,7 @@
+#!python3
+"""pytest configuration: these modules are pure numpy/scipy, import them as post_processing.<module> without loading
+the QGIS plugin package"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,125 @@
+#!python3
+"""
+downstream protection value helpers
+
+The DPV of a cell in one simulation is the sum of the protection values of all the cells downstream of it in the
+shortest propagation tree (see trees.py); the metric is its average over all simulations.
+Protection values can be a (cells,) vector or a (cells, bands) matrix: each tree is built once and the subtree sums of
+all bands are accumulated together. Trees can also be read from a tree cache (see trees.py), skipping their
+construction altogether.
+
+Parallel executor: the protection values and one float64 accumulator per worker live in shared memory (allocated once,
+before the pool starts), simulations are dispatched as chunks of indices with imap_unordered and each worker reads its
+messages from the memory-mapped store (or the inherited legacy list), adding into its own accumulator. Only chunk
+sizes travel back; the accumulators are summed once at the end.
+
+Sample usage:
+    dpv_sum = downstream_protection_value(data_list, pv, threads=4) / len(data_list)
+"""
+from multiprocessing import Pool, RawArray, Value
+from platform import system as platform_system
+
+import numpy as np
+
+from .store import SimulationStore, open_store_args, reopen_store
+from .trees import PropagationTree
+
+
+def simulation_dpv(data, pv: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Downstream protection value of one simulation: sum of pv over each cell subtree of the shortest propagation tree
+
+    pv: (cells,) or (cells, bands) protection values indexed by cell id
+
+    The tree is a predecessor array from a frontier by frontier breadth first search from the ignition (fewest
+    propagation steps, ties by message order, as networkx single_source_dijkstra_path gave without a "time" attribute),
+    subtree sums are accumulated level by level. Returns the values and cell ids of the cells reached
+    """
+    if len(data) == 0:
+        return np.empty((0,) + pv.shape[1:], dtype=pv.dtype), np.empty(0, dtype=np.int64)
+    return tree_dpv(PropagationTree.from_messages(data), pv)
+
+
+def tree_dpv(tree: PropagationTree, pv: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Subtree sums of pv over a propagation tree, values and cell ids of the cells reached"""
+    reached = tree.order
+    mdpv = tree.subtree_sums(pv[tree.cells])[reached]
+    return mdpv, tree.cells[reached]
+
+
+# per worker state, set by the pool initializer
+_pv = None
+_accumulator = None
+_messages = None
+_trees = None
+
+
+def _attach(pv_buffer, pv_dtype, pv_shape, accumulators_buffer, slots, messages, trees):
+    """Map the shared protection values, claim one accumulator, open the messages or trees"""
+    global _pv, _accumulator, _messages, _trees
+    _pv = np.frombuffer(pv_buffer, dtype=pv_dtype).reshape(pv_shape)
+    accumulators = np.frombuffer(accumulators_buffer, dtype=np.float64).reshape((-1,) + pv_shape)
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+    _accumulator = accumulators[slot]
+    _messages = reopen_store(messages) if messages else None
+    _trees = reopen_store(trees) if trees else None
+
+
+def _dpv_chunk(indices) -> int:
+    for k in indices:
+        if _trees is not None:
+            mdpv, cells = tree_dpv(PropagationTree.from_arrays(*_trees.columns_of(k)), _pv)
+        else:
+            mdpv, cells = simulation_dpv(_messages[k], _pv)
+        # cells are unique within a simulation
+        _accumulator[cells] += mdpv
+    return len(indices)
+
+
+def downstream_protection_value(
+    data_list, pv: np.ndarray, threads: int = 1, feedback=None, trees: SimulationStore = None
+) -> np.ndarray:
+    """Sum over all simulations of the downstream protection value of each cell (float64, same shape as pv)
+
+    data_list: SimulationStore (workers reopen it with the same memory_map mode) or legacy list of structured arrays
+    (inherited by the workers); only the running accumulators and one chunk per worker are held in memory
+    pv: (cells,) or (cells, bands) protection values, indexed by cell id
+    trees: optional tree cache of the same simulations, used instead of the messages
+    """
+    nsim = len(data_list)
+    if threads <= 1 or platform_system() == "Windows" or nsim <= 1:
+        dpv = np.zeros(pv.shape, dtype=np.float64)
+        for count in range(nsim):
+            if trees is not None:
+                mdpv, cells = tree_dpv(PropagationTree.from_arrays(*trees.columns_of(count)), pv)
+            else:
+                mdpv, cells = simulation_dpv(data_list[count], pv)
+            dpv[cells] += mdpv
+            if feedback:
+                if feedback.isCanceled():
+                    break
+                feedback.setProgress(int((count + 1) / nsim * 100))
+        return dpv
+    # shared memory, allocated once
+    pv_buffer = RawArray("b", pv.nbytes)
+    np.frombuffer(pv_buffer, dtype=pv.dtype)[:] = pv.ravel()
+    accumulators_buffer = RawArray("d", threads * pv.size)
+    slots = Value("i", 0)
+    if trees is not None:
+        messages, trees = None, open_store_args(trees)
+    else:
+        messages, trees = open_store_args(data_list), None
+    chunksize = max(1, min(32, nsim // (4 * threads)))
+    chunks = [range(start, min(start + chunksize, nsim)) for start in range(0, nsim, chunksize)]
+    done = 0
+    initargs = (pv_buffer, pv.dtype, pv.shape, accumulators_buffer, slots, messages, trees)
+    with Pool(threads, initializer=_attach, initargs=initargs) as pool:
+        for size in pool.imap_unordered(_dpv_chunk, chunks):
+            done += size
+            if feedback:
+                if feedback.isCanceled():
+                    break
+                feedback.setProgress(int(done / nsim * 100))
+    # leaving the with block terminates the pool, every worker is done with its accumulator
+    return np.frombuffer(accumulators_buffer, dtype=np.float64).reshape((threads,) + pv.shape).sum(axis=0)
@@ -0,0 +1,315 @@
+#!python3
+"""
+propagation messages helpers
+
+Cell2Fire writes one `results/Messages/MessagesFile<sim_id>.csv` per simulation, each line is a propagation message
+`from_cell,to_cell,hit_time` with 1-based cell ids.
+"""
+from hashlib import blake2b
+from json import dump as json_dump
+from json import load as json_load
+from multiprocessing import Pool
+from pathlib import Path
+from platform import system as platform_system
+from re import search
+
+import numpy as np
+from pandas import read_csv
+
+from .store import (MESSAGES_COLUMNS, MESSAGES_DTYPE, SimulationStore, SimulationStoreWriter, move_store, remove_store,
+                    store_file)
+
+MESSAGES_RECORD = np.dtype([(col, MESSAGES_DTYPE) for col in MESSAGES_COLUMNS])
+
+
+def messages_sim_id(afile: Path) -> int:
+    """Simulation id of a MessagesFile<sim_id>.csv"""
+    return int(search(r"(\d+)$", Path(afile).stem).group(0))
+
+
+def sort_messages_files(files: list[Path]) -> list[Path]:
+    """Sort by simulation id (numerically, so 10 comes after 9)"""
+    return sorted(files, key=messages_sim_id)
+
+
+def read_messages_file(afile: Path) -> np.ndarray:
+    """Parse one messages file with the pandas C engine into a structured array (i, j, t) with 0-based cell ids"""
+    df = read_csv(afile, header=None, usecols=[0, 1, 2], dtype=MESSAGES_DTYPE, engine="c")
+    data = np.empty(len(df), dtype=MESSAGES_RECORD)
+    data["i"] = df[0].to_numpy() - 1
+    data["j"] = df[1].to_numpy() - 1
+    data["t"] = df[2].to_numpy()
+    return data
+
+
+def file_fingerprint(afile: Path, content_hash: bool = True) -> dict:
+    """Size, modification time and (optionally) blake2b content hash of a file"""
+    stat = Path(afile).stat()
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if content_hash:
+        digest = blake2b(digest_size=16)
+        with open(afile, "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+        fingerprint["hash"] = digest.hexdigest()
+    return fingerprint
+
+
+def read_messages_file_fingerprint(afile: Path) -> tuple[np.ndarray, dict]:
+    """read_messages_file plus the file fingerprint, so hashing happens in the same worker"""
+    return read_messages_file(afile), file_fingerprint(afile)
+
+
+def imap_files(function, files: list[Path], threads: int = 1):
+    """Yields function(afile) for each file, in the given files order, in a pool of processes
+
+    Serial on MsWindows or when threads is 1. Closing the generator early terminates the pool
+    """
+    if threads <= 1 or platform_system() == "Windows" or len(files) <= 1:
+        for afile in files:
+            yield function(afile)
+        return
+    chunksize = max(1, min(32, len(files) // (4 * threads)))
+    with Pool(threads) as pool:
+        yield from pool.imap(function, files, chunksize=chunksize)
+
+
+class MessagesIngestion:
+    """Incremental ingestion of messages files into a message store
+
+    A manifest next to the store (`<store>.manifest.json`) records the size, mtime and content hash of each source file.
+    On re-runs only new or changed files are parsed:
+    - nothing new or changed: the store is reused as is
+    - only new simulations, all with higher ids: they are appended to the existing store
+    - otherwise (changed, removed or interleaved simulations): the store is rebuilt copying the unchanged simulations
+      from the old store (a binary copy, no csv parsing) and parsing the rest
+
+    Files whose size and mtime did not change are trusted without hashing them again.
+
+    Sample usage:
+        ingestion = MessagesIngestion(files, store_filename, incremental=True)
+        for sim_id, data in ingestion.ingest(threads=4):
+            ...
+    """
+
+    def __init__(self, files: list[Path], store_filename: Path, incremental: bool = True):
+        self.files = sort_messages_files(files)
+        self.store_filename = Path(store_filename)
+        self.manifest_filename = store_file(self.store_filename, "manifest")
+        self.old_store = None
+        self.old_index = {}
+        self.cached = {}
+        old_files = {}
+        if incremental:
+            old_files = self._read_manifest()
+        for afile in self.files:
+            entry = old_files.get(afile.name)
+            sim_id = messages_sim_id(afile)
+            if entry is None or entry["sim"] != sim_id or sim_id not in self.old_index:
+                continue
+            fingerprint = file_fingerprint(afile, content_hash=False)
+            if fingerprint["size"] != entry["size"]:
+                continue
+            if fingerprint["mtime_ns"] != entry["mtime_ns"]:
+                # touched, check content
+                fingerprint = file_fingerprint(afile)
+                if fingerprint["hash"] != entry["hash"]:
+                    continue
+            self.cached[sim_id] = dict(entry, name=afile.name, **fingerprint)
+        self.to_parse = [afile for afile in self.files if messages_sim_id(afile) not in self.cached]
+        removed = set(self.old_index) - set(self.cached)
+        if self.old_store is None or not self.cached:
+            self.mode = "new"
+        elif not self.to_parse and not removed:
+            self.mode = "reuse"
+        elif not removed and min(map(messages_sim_id, self.to_parse)) > max(self.old_index):
+            self.mode = "append"
+        else:
+            self.mode = "rebuild"
+
+    def _read_manifest(self) -> dict:
+        """Old manifest files entries, empty if the manifest or store are missing or out of sync"""
+        if not self.manifest_filename.is_file() or not self.store_filename.is_file():
+            return {}
+        try:
+            with open(self.manifest_filename, "r") as f:
+                manifest = json_load(f)
+            store = SimulationStore(self.store_filename)
+        except (OSError, ValueError, KeyError):
+            return {}
+        if store.columns != MESSAGES_COLUMNS or manifest.get("store") != {
+            "simulations": len(store),
+            "records": store.number_of_records,
+        }:
+            store.close()
+            return {}
+        self.old_store = store
+        self.old_index = {int(sim_id): k for k, sim_id in enumerate(store.simulation_ids)}
+        return manifest["files"]
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.files)} messages files, {len(self.cached)} already ingested, {len(self.to_parse)} to parse,"
+            f" store mode: {self.mode}"
+        )
+
+    def ingest(self, threads: int = 1, yield_cached: bool = True):
+        """Yields (sim_id, data) in simulation id order while writing the store and its manifest
+
+        Cached simulations are read back from the old store, only yielded if yield_cached.
+        If the generator is closed early: appended simulations are kept, a rebuild is discarded
+        """
+        if self.mode in ["reuse", "append"]:
+            # cached ids all precede the new ones
+            if yield_cached:
+                for sim_id in self.cached:
+                    yield sim_id, self.old_store[self.old_index[sim_id]]
+            simulation_ids, records = self.old_store.simulation_ids.tolist(), self.old_store.number_of_records
+            self.old_store.close()
+            if self.mode == "reuse":
+                # refresh touched files mtimes
+                self._write_manifest(simulation_ids, records, self.cached)
+                return
+            writer = SimulationStoreWriter(self.store_filename, MESSAGES_COLUMNS, append=True)
+            manifest = dict(self.cached)
+        elif self.mode == "rebuild":
+            writer = SimulationStoreWriter(
+                self.store_filename.with_name(f"{self.store_filename.stem}.rebuild{self.store_filename.suffix}"),
+                MESSAGES_COLUMNS,
+            )
+            manifest = {}
+        else:
+            if self.old_store is not None:
+                self.old_store.close()
+            writer = SimulationStoreWriter(self.store_filename, MESSAGES_COLUMNS)
+            manifest = {}
+        parsed = imap_files(read_messages_file_fingerprint, self.to_parse, threads)
+        completed = False
+        try:
+            for afile in self.files:
+                sim_id = messages_sim_id(afile)
+                if sim_id in self.cached:
+                    if self.mode == "append":
+                        continue
+                    data = self.old_store[self.old_index[sim_id]]
+                    writer.add(sim_id, data)
+                    manifest[sim_id] = self.cached[sim_id]
+                    if yield_cached:
+                        yield sim_id, data
+                else:
+                    data, fingerprint = next(parsed)
+                    writer.add(sim_id, data)
+                    manifest[sim_id] = dict(fingerprint, name=afile.name, sim=sim_id)
+                    yield sim_id, data
+            completed = True
+        finally:
+            parsed.close()
+            writer.close()
+            if self.old_store is not None:
+                self.old_store.close()
+            if self.mode == "rebuild":
+                if completed:
+                    move_store(writer.filename, self.store_filename, MESSAGES_COLUMNS)
+                else:
+                    remove_store(writer.filename, MESSAGES_COLUMNS)
+            if self.mode != "rebuild" or completed:
+                self._write_manifest(writer.simulation_ids, writer.offsets[-1], manifest)
+
+    def _write_manifest(self, simulation_ids, records, manifest):
+        files = {}
+        for sim_id in simulation_ids:
+            entry = dict(manifest[sim_id])
+            files[entry.pop("name")] = entry
+        with open(self.manifest_filename, "w") as f:
+            json_dump({"store": {"simulations": len(simulation_ids), "records": records}, "files": files}, f, indent=1)
+
+
+def cells_georef(cells: np.ndarray, W: int, GT: tuple) -> tuple[np.ndarray, np.ndarray]:
+    """Vectorized cell centers georeferenced coordinates, same as id2xy + transform_coords_to_georef(x + 0.5, y + 0.5)
+
+    Args:
+        cells: 0-based cell ids
+        W: raster width
+        GT: geotransform
+    Returns:
+        x_geo, y_geo float64 arrays
+    """
+    y_line, x_pixel = np.divmod(np.asarray(cells, dtype=np.int64), W)
+    x_pixel = x_pixel + 0.5
+    y_line = y_line + 0.5
+    x_geo = GT[0] + x_pixel * GT[1] + y_line * GT[2]
+    y_geo = GT[3] + x_pixel * GT[4] + y_line * GT[5]
+    return x_geo, y_geo
+
+
+def edge_keys(i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    """Pack directed (i, j) cell pairs into int64 keys"""
+    return (np.asarray(i, dtype=np.int64) << 32) | np.asarray(j, dtype=np.int64)
+
+
+def edge_cells(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Unpack int64 keys into (i, j) cell pairs"""
+    return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32)
+
+
+def _reduce_edges(keys, count, tsum, tmin, tmax):
+    """Group by key summing counts and time sums, keeping time extremes"""
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return (
+        keys[starts],
+        np.add.reduceat(count[order], starts),
+        np.add.reduceat(tsum[order], starts),
+        np.minimum.reduceat(tmin[order], starts),
+        np.maximum.reduceat(tmax[order], starts),
+    )
+
+
+class EdgeFrequencyAccumulator:
+    """Collapses the messages of many simulations into unique directed cell pairs
+
+    Per pair keeps: traversal count, sum, min and max of the hit time. Input is buffered and reduced every
+    `buffer_size` edges, so memory is bounded by the number of unique pairs (the landscape) not by the simulations
+
+    Sample usage:
+        efa = EdgeFrequencyAccumulator()
+        for data in store:
+            efa.add(data["i"], data["j"], data["t"])
+        i, j, count, tmin, tmean, tmax = efa.result()
+    """
+
+    def __init__(self, buffer_size=10_000_000):
+        self.buffer_size = buffer_size
+        self.simulations = 0
+        self._buffer = []
+        self._buffered = 0
+        self._reduced = None
+
+    def add(self, i, j, t):
+        """Add the messages of one simulation"""
+        self.simulations += 1
+        if len(t) == 0:
+            return
+        t = np.asarray(t, dtype=np.int64)
+        self._buffer += [(edge_keys(i, j), np.ones(len(t), dtype=np.int64), t, t, t)]
+        self._buffered += len(t)
+        if self._buffered >= self.buffer_size:
+            self._reduce()
+
+    def _reduce(self):
+        parts = self._buffer if self._reduced is None else [self._reduced] + self._buffer
+        if parts:
+            self._reduced = _reduce_edges(*[np.concatenate(column) for column in zip(*parts)])
+        self._buffer = []
+        self._buffered = 0
+
+    def result(self):
+        """Returns i, j, count, tmin, tmean, tmax arrays, one element per unique directed pair sorted by (i, j)"""
+        self._reduce()
+        if self._reduced is None:
+            empty = np.empty(0, dtype=np.int32)
+            return empty, empty, empty.astype(np.int64), empty, np.empty(0), empty
+        keys, count, tsum, tmin, tmax = self._reduced
+        i, j = edge_cells(keys)
+        return i, j, count, tmin.astype(np.int32), tsum / count, tmax.astype(np.int32)
@@ -0,0 +1,477 @@
+#!python3
+"""
+simulation results helpers
+
+Cell2Fire writes plain text grids for each simulation:
+    results/Grids/Grids<sim_id>/ForestGrid<period>.csv  burned (1) cells at each period, the last one is the final scar
+    results/<dir>/<file><sim_id>.asc                    fire behavior statistic ascii grids (see config.STATS)
+
+The fused pass visits them once: each file is decoded a single time (in a pool of processes) and handed, in simulation
+order, to every accumulator attached to its source; so a whole bundle (final scars stack and sparse store, statistics
+stacks and their streaming mean & std, per simulation summaries) costs one read of each result file. Accumulators only
+keep O(H x W) (or O(simulations)) running state, the products are written by the caller at the end.
+
+Sample usage:
+    fused = FusedResultsPass(H, W)
+    fused.add_source("ros", numbered_files(sample_file), read_asc_file)
+    mean_std = fused.attach("ros", MeanStd(H, W))
+    fused.run(threads=4, feedback=feedback)
+    mean, std = mean_std.result()
+"""
+from multiprocessing import Pool
+from pathlib import Path
+from platform import system as platform_system
+from re import search
+
+import numpy as np
+from pandas import read_csv, to_numeric
+
+SCAR_SOURCE = "scar"
+STAT_NODATA = -9999
+# mergeable fused passes split the files in this many blocks per worker
+PARTIAL_BLOCKS_PER_THREAD = 4
+
+
+def trailing_number(name: str) -> str:
+    """Digits at the end of a file stem or directory name, e.g. "12" for ForestGrid12 or Grids12"""
+    if match := search(r"(\d+)$", name):
+        return match.group(0)
+    raise ValueError(f"{name} does not end with a number")
+
+
+def numbered(afile: Path) -> int:
+    """Trailing number of a file or directory name"""
+    return int(trailing_number(Path(afile).stem))
+
+
+def numbered_files(sample_file: Path) -> dict[int, Path]:
+    """Non-empty files named as the sample (+ any digit), by their number (numerically sorted)"""
+    sample_file = Path(sample_file).absolute()
+    name = sample_file.stem[: -len(trailing_number(sample_file.stem))]
+    files = {
+        numbered(afile): afile
+        for afile in sample_file.parent.glob(name + "[0-9]*" + sample_file.suffix)
+        if afile.is_file() and afile.stat().st_size > 0
+    }
+    return dict(sorted(files.items()))
+
+
+def scar_files(sample_file: Path) -> dict[int, dict[int, Path]]:
+    """Non-empty scar files matching root/parent(+any digit)/child(+any digit).ext as {sim_id: {period: file}}"""
+    sample_file = Path(sample_file).absolute()
+    parent = sample_file.parent
+    parent_name = parent.name[: -len(trailing_number(parent.name))]
+    scars = {}
+    for adir in parent.parent.glob(parent_name + "[0-9]*"):
+        if adir.is_dir() and (periods := numbered_files(adir / sample_file.name)):
+            scars[numbered(adir)] = periods
+    return dict(sorted(scars.items()))
+
+
+def final_scar_files(sample_file: Path) -> dict[int, Path]:
+    """Last period scar file of each simulation, by simulation id"""
+    return {sim_id: periods[max(periods)] for sim_id, periods in scar_files(sample_file).items()}
+
+
+def read_scar_file(afile: Path) -> np.ndarray:
+    """Parse one scar csv grid with the pandas C engine (int8), unparseable values as 0"""
+    try:
+        return read_csv(afile, header=None, dtype=np.int8, engine="c").to_numpy()
+    except ValueError:
+        df = read_csv(afile, header=None, dtype=str, engine="c")
+        return df.apply(to_numeric, errors="coerce").fillna(0).to_numpy(dtype=np.int8)
+
+
+def asc_header_lines(afile: Path) -> int:
+    """Number of header lines of an ascii grid: lines before the first one starting with a number"""
+    count = 0
+    with open(afile, "r") as f:
+        for line in f:
+            tokens = line.split()
+            if tokens:
+                try:
+                    float(tokens[0])
+                    break
+                except ValueError:
+                    pass
+            count += 1
+    return count
+
+
+def read_asc_file(afile: Path) -> np.ndarray:
+    """Parse one ascii grid with the pandas C engine (float32), unparseable values as STAT_NODATA"""
+    skiprows = asc_header_lines(afile)
+    try:
+        return read_csv(afile, sep=r"\s+", header=None, skiprows=skiprows, dtype=np.float32, engine="c").to_numpy()
+    except ValueError:
+        df = read_csv(afile, sep=r"\s+", header=None, skiprows=skiprows, dtype=str, engine="c")
+        return df.apply(to_numeric, errors="coerce").fillna(STAT_NODATA).to_numpy(dtype=np.float32)
+
+
+class MeanStd:
+    """Streaming per cell count, mean and standard deviation (Welford), optionally also minimum and maximum
+
+    Each grid updates the running count, mean and M2 (sum of squared deviations) of its valid (not nodata) cells, so
+    memory is O(H x W) whatever the number of simulations, and float64 updates do not suffer the cancellation of
+    sum of squares formulas. Partial accumulators (e.g. from different workers) combine with merge
+    """
+
+    def __init__(self, H: int, W: int, nodata=STAT_NODATA, min_max: bool = False):
+        self.options = {"H": H, "W": W, "nodata": nodata, "min_max": min_max}
+        self.nodata = nodata
+        self.count = np.zeros((H, W), dtype=np.int32)
+        self.mean = np.zeros((H, W), dtype=np.float64)
+        self.m2 = np.zeros((H, W), dtype=np.float64)
+        if min_max:
+            self.minimum = np.full((H, W), np.inf, dtype=np.float64)
+            self.maximum = np.full((H, W), -np.inf, dtype=np.float64)
+        else:
+            self.minimum = self.maximum = None
+        self.simulations = 0
+
+    def add(self, k: int, data: np.ndarray):
+        valid = data != self.nodata
+        values = data[valid].astype(np.float64)
+        self.count[valid] += 1
+        delta = values - self.mean[valid]
+        mean = self.mean[valid] + delta / self.count[valid]
+        self.mean[valid] = mean
+        self.m2[valid] += delta * (values - mean)
+        if self.minimum is not None:
+            self.minimum[valid] = np.minimum(self.minimum[valid], values)
+            self.maximum[valid] = np.maximum(self.maximum[valid], values)
+        self.simulations += 1
+
+    def merge(self, other: "MeanStd"):
+        """Combine with another partial accumulator over different simulations (Chan et al. parallel update)"""
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weight = np.where(count > 0, other.count / count, 0)
+        self.mean += delta * weight
+        self.m2 += other.m2 + delta**2 * self.count * weight
+        self.count = count
+        if self.minimum is not None:
+            np.minimum(self.minimum, other.minimum, out=self.minimum)
+            np.maximum(self.maximum, other.maximum, out=self.maximum)
+        self.simulations += other.simulations
+
+    def names(self) -> list[str]:
+        return ["mean", "std"] + (["min", "max"] if self.minimum is not None else [])
+
+    def result(self) -> list[np.ndarray]:
+        """Float32 mean, (population) standard deviation [, minimum, maximum]; 0 where no valid value was seen"""
+        seen = self.count > 0
+        std = np.zeros(self.count.shape, dtype=np.float64)
+        std[seen] = np.sqrt(self.m2[seen] / self.count[seen])
+        bands = [self.mean, std]
+        if self.minimum is not None:
+            bands += [np.where(seen, self.minimum, 0), np.where(seen, self.maximum, 0)]
+        return [band.astype(np.float32) for band in bands]
+
+
+class QuantileSketch:
+    """Streaming per cell approximate quantiles, from relative accuracy histograms shared by all cells
+
+    Positive values go to logarithmic bins (bin k holds (gamma^(k-1), gamma^k], gamma = (1 + accuracy) / (1 - accuracy))
+    and are estimated back as 2 gamma^k / (gamma + 1), so any quantile falling in the window of bins is within the
+    relative accuracy; zeros (e.g. unburned, or negative values) are counted apart and nodata is ignored.
+    All cells share one window of `bins` consecutive bins that slides up to keep the largest value seen, collapsing the
+    lowest bins (the upper quantiles, the ones risk reports need, stay accurate; 256 bins at 2% cover values spanning 4
+    orders of magnitude). Memory is H x W x bins counters (uint16 if max_simulations < 65536) whatever the number of
+    simulations (per worker when run in parallel); partial sketches (e.g. from different workers) combine with merge
+    """
+
+    def __init__(self, H: int, W: int, accuracy=0.02, bins=256, nodata=STAT_NODATA, max_simulations=None):
+        self.options = {
+            "H": H,
+            "W": W,
+            "accuracy": accuracy,
+            "bins": bins,
+            "nodata": nodata,
+            "max_simulations": max_simulations,
+        }
+        self.shape = (H, W)
+        self.bins = bins
+        self.nodata = nodata
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = np.log(self.gamma)
+        dtype = np.uint16 if max_simulations is not None and max_simulations < 2**16 else np.uint32
+        self.zeros = np.zeros(H * W, dtype=dtype)
+        self.counts = np.zeros((H * W, bins), dtype=dtype)
+        # key of the first bin of the window, set by the first positive value
+        self.offset = None
+        self.simulations = 0
+
+    def _slide(self, offset: int):
+        """Move the window up to start at offset, adding the bins left below into the first one"""
+        shift = offset - self.offset
+        if shift <= 0:
+            return
+        if shift >= self.bins:
+            self.counts[:, 0] = self.counts.sum(axis=1)
+            self.counts[:, 1:] = 0
+        else:
+            self.counts[:, 0] = self.counts[:, : shift + 1].sum(axis=1)
+            self.counts[:, 1 : self.bins - shift] = self.counts[:, shift + 1 :]
+            self.counts[:, self.bins - shift :] = 0
+        self.offset = offset
+
+    def add(self, k: int, data: np.ndarray):
+        values = data.ravel()
+        valid = values != self.nodata
+        positive = valid & (values > 0)
+        self.zeros[valid & ~positive] += 1
+        cells = np.flatnonzero(positive)
+        if cells.size > 0:
+            keys = np.ceil(np.log(values[cells].astype(np.float64)) / self.log_gamma).astype(np.int64)
+            top = int(keys.max())
+            if self.offset is None:
+                self.offset = top - self.bins + 1
+            elif top >= self.offset + self.bins:
+                self._slide(top - self.bins + 1)
+            # cells are unique within a grid
+            self.counts[cells, np.maximum(keys - self.offset, 0)] += 1
+        self.simulations += 1
+
+    def merge(self, other: "QuantileSketch"):
+        self.zeros += other.zeros
+        if other.offset is not None:
+            if self.offset is None:
+                self.offset = other.offset
+            else:
+                offset = max(self.offset, other.offset)
+                self._slide(offset)
+                other._slide(offset)
+            self.counts += other.counts
+        self.simulations += other.simulations
+
+    def result(self, quantiles, block: int = 1 << 16) -> list[np.ndarray]:
+        """Float32 (H, W) estimate of each quantile (0 to 1) over the valid values of each cell, 0 if none"""
+        bands = np.zeros((len(quantiles), self.counts.shape[0]), dtype=np.float32)
+        if self.offset is None:
+            return [band.reshape(self.shape) for band in bands]
+        for start in range(0, self.counts.shape[0], block):
+            counts = self.counts[start : start + block].astype(np.int64)
+            zeros = self.zeros[start : start + block].astype(np.int64)
+            cumulative = np.cumsum(counts, axis=1) + zeros[:, None]
+            total = cumulative[:, -1]
+            for b, q in enumerate(quantiles):
+                # lower quantile: the value of rank floor(q (n - 1)), 0 based
+                rank = np.floor(q * (total - 1))
+                key = (cumulative <= rank[:, None]).sum(axis=1) + self.offset
+                estimate = 2 * self.gamma ** key.astype(np.float64) / (self.gamma + 1)
+                bands[b, start : start + block] = np.where((total > 0) & (rank >= zeros), estimate, 0)
+        return [band.reshape(self.shape) for band in bands]
+
+
+class Exceedance:
+    """Per cell counters of simulations whose value exceeds (>) each threshold, and of burned ones (value > 0)
+
+    Unconditional probability: exceedances / simulations; conditional (given burned): exceedances / burned
+    """
+
+    def __init__(self, H: int, W: int, thresholds, nodata=STAT_NODATA):
+        self.options = {"H": H, "W": W, "thresholds": list(thresholds), "nodata": nodata}
+        self.thresholds = list(thresholds)
+        self.nodata = nodata
+        self.exceed = np.zeros((len(self.thresholds), H, W), dtype=np.int32)
+        self.burned = np.zeros((H, W), dtype=np.int32)
+        self.simulations = 0
+
+    def add(self, k: int, data: np.ndarray):
+        valid = data != self.nodata
+        self.burned += valid & (data > 0)
+        for t, threshold in enumerate(self.thresholds):
+            self.exceed[t] += valid & (data > threshold)
+        self.simulations += 1
+
+    def merge(self, other: "Exceedance"):
+        self.exceed += other.exceed
+        self.burned += other.burned
+        self.simulations += other.simulations
+
+    def names(self, unit: str = "") -> list[str]:
+        unit = f" {unit}" if unit else ""
+        return [f"P(>{t:g}{unit})" for t in self.thresholds] + [f"P(>{t:g}{unit} | burned)" for t in self.thresholds]
+
+    def result(self) -> list[np.ndarray]:
+        """Float32 unconditional probability bands, one per threshold, then the conditional (given burned) ones"""
+        unconditional = [exceed / max(self.simulations, 1) for exceed in self.exceed]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            conditional = [np.where(self.burned > 0, exceed / self.burned, 0) for exceed in self.exceed]
+        return [band.astype(np.float32) for band in unconditional + conditional]
+
+
+class SimulationSummary:
+    """Per simulation scalars of each grid: number, maximum and mean of its positive (burned) valid cells
+
+    One row per position k in the source, NaN until its grid is added; partial accumulators combine with merge
+    """
+
+    def __init__(self, simulations: int, nodata=STAT_NODATA):
+        self.options = {"simulations": simulations, "nodata": nodata}
+        self.nodata = nodata
+        self.cells = np.full(simulations, np.nan)
+        self.maximum = np.full(simulations, np.nan)
+        self.mean = np.full(simulations, np.nan)
+
+    def add(self, k: int, data: np.ndarray):
+        values = data[(data != self.nodata) & (data > 0)]
+        self.cells[k] = values.size
+        self.maximum[k] = values.max() if values.size else 0
+        self.mean[k] = values.mean(dtype=np.float64) if values.size else 0
+
+    def merge(self, other: "SimulationSummary"):
+        seen = ~np.isnan(other.cells)
+        self.cells[seen] = other.cells[seen]
+        self.maximum[seen] = other.maximum[seen]
+        self.mean[seen] = other.mean[seen]
+
+
+def join_simulations(columns: dict[str, tuple]) -> dict[str, np.ndarray]:
+    """Outer join on the simulation id of per simulation columns {name: (simulation ids, values)}, NaN where missing
+
+    Returns {"simulation": sorted ids, name: float64 values, ...}
+    """
+    sim_ids = np.array(sorted(set().union(*[np.asarray(ids).tolist() for ids, _ in columns.values()])), dtype=np.int64)
+    table = {"simulation": sim_ids}
+    for name, (ids, values) in columns.items():
+        table[name] = np.full(len(sim_ids), np.nan)
+        table[name][np.searchsorted(sim_ids, ids)] = values
+    return table
+
+
+class BandWriter:
+    """Hands each grid to write(k, data), e.g. to write the k-th band of a multiband raster as it is read"""
+
+    def __init__(self, write):
+        self.write = write
+
+    def add(self, k: int, data: np.ndarray):
+        self.write(k, data)
+
+
+def _read_task(task):
+    source, k, afile, reader = task
+    return source, k, afile, reader(afile)
+
+
+def _partial_task(args):
+    """Read a block of files into fresh accumulators (built from their class and options), returned to be merged"""
+    tasks, blueprints, shape = args
+    accumulators = {source: [cls(**options) for cls, options in items] for source, items in blueprints.items()}
+    for source, k, afile, reader in tasks:
+        data = reader(afile)
+        if data.shape != shape:
+            raise ValueError(f"{afile} grid is {data.shape}, expected {shape} (H, W)")
+        for accumulator in accumulators[source]:
+            accumulator.add(k, data)
+    return len(tasks), accumulators
+
+
+class FusedResultsPass:
+    """Single pass over simulation result files, feeding every accumulator attached to each source
+
+    A source is a {sim_id: file} dict with its reader (module level function, so pool workers can use it).
+    Files are read in simulation id order (all sources of a simulation together); each accumulator receives
+    add(k, data), k being the position of the simulation within its source.
+    When every attached accumulator is mergeable (has options and merge), each worker accumulates a contiguous block of
+    files itself and only its partial accumulators travel back, to be merged in order; else workers only parse files
+    and all accumulators are fed in this process
+    """
+
+    def __init__(self, H: int, W: int):
+        self.shape = (H, W)
+        self.sources = {}
+        self.readers = {}
+        self.accumulators = {}
+
+    def add_source(self, source: str, files: dict[int, Path], reader=read_scar_file):
+        self.sources[source] = files
+        self.readers[source] = reader
+        self.accumulators[source] = []
+
+    def attach(self, source: str, accumulator):
+        self.accumulators[source] += [accumulator]
+        return accumulator
+
+    def simulation_ids(self, source: str) -> list[int]:
+        return list(self.sources[source])
+
+    def tasks(self) -> list[tuple]:
+        """(source, k, file, reader) of every file needed by an accumulator, in simulation order"""
+        used = [source for source in self.sources if self.accumulators[source]]
+        positions = {source: {sim_id: k for k, sim_id in enumerate(self.sources[source])} for source in used}
+        sim_ids = sorted(set().union(*[self.sources[source] for source in used]))
+        return [
+            (source, positions[source][sim_id], self.sources[source][sim_id], self.readers[source])
+            for sim_id in sim_ids
+            for source in used
+            if sim_id in self.sources[source]
+        ]
+
+    def run(self, threads: int = 1, feedback=None) -> int:
+        """Read every file once (in a pool of processes, serial on MsWindows) and feed the accumulators
+
+        Returns the number of files read (less than all if canceled)
+        """
+        tasks = self.tasks()
+        if threads > 1 and platform_system() != "Windows" and len(tasks) > 1 and self.mergeable():
+            return self._run_partials(tasks, threads, feedback)
+        if threads > 1 and platform_system() != "Windows" and len(tasks) > 1:
+            pool = Pool(threads)
+            results = pool.imap(_read_task, tasks, chunksize=max(1, min(32, len(tasks) // (4 * threads))))
+        else:
+            pool = None
+            results = map(_read_task, tasks)
+        count = 0
+        try:
+            for source, k, afile, data in results:
+                if data.shape != self.shape:
+                    raise ValueError(f"{afile} grid is {data.shape}, expected {self.shape} (H, W)")
+                for accumulator in self.accumulators[source]:
+                    accumulator.add(k, data)
+                count += 1
+                if feedback:
+                    if feedback.isCanceled():
+                        break
+                    feedback.setProgress(int(count / len(tasks) * 100))
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+        return count
+
+    def mergeable(self) -> bool:
+        return all(
+            hasattr(accumulator, "merge") and hasattr(accumulator, "options")
+            for accumulators in self.accumulators.values()
+            for accumulator in accumulators
+        )
+
+    def _run_partials(self, tasks: list[tuple], threads: int, feedback=None) -> int:
+        """Contiguous blocks of files (about PARTIAL_BLOCKS_PER_THREAD per worker) read into partial accumulators, each
+        merged as soon as it arrives, in block order; so progress and cancel are checked per block
+
+        Each worker holds one set of partial accumulators at a time: peak memory is (threads + 1) x their state
+        """
+        blueprints = {
+            source: [(type(accumulator), accumulator.options) for accumulator in accumulators]
+            for source, accumulators in self.accumulators.items()
+            if accumulators
+        }
+        bounds = np.linspace(0, len(tasks), min(PARTIAL_BLOCKS_PER_THREAD * threads, len(tasks)) + 1).astype(int)
+        blocks = [(tasks[start:stop], blueprints, self.shape) for start, stop in zip(bounds[:-1], bounds[1:])]
+        count = 0
+        with Pool(threads) as pool:
+            for size, partials in pool.imap(_partial_task, blocks, chunksize=1):
+                for source, accumulators in partials.items():
+                    for accumulator, partial in zip(self.accumulators[source], accumulators):
+                        accumulator.merge(partial)
+                count += size
+                if feedback:
+                    if feedback.isCanceled():
+                        break
+                    feedback.setProgress(int(count / len(tasks) * 100))
+        return count
@@ -0,0 +1,292 @@
+#!python3
+"""
+sparse fire scar helpers
+
+Most simulations burn a small part of the landscape, so a final scar is kept as the sorted flat ids (row * W + column)
+of its burned cells; all simulations go in one simulation store (see store.py) of kind "scars", with the landscape size
+and the scar files it was built from in its header. For `results/Grids/Grids*/ForestGrid*.csv` the store is
+`results/Grids/final_scars.scars` (+ its column files). Burn probability of all simulations, or of any subset of them,
+is then one np.bincount over the concatenated ids, and each simulation burned area is its number of records: storage
+and compute scale with the burned cells instead of simulations x H x W.
+
+The same scars can also be kept as a bit-packed cube: one fixed size record per simulation with its H x W burned flags
+packed 8 per byte (np.packbits, row-major), in a store of kind "scarcube" (`results/Grids/final_scars_cube.cube`),
+whose offsets and simulation ids are the row index. Any subset of rows is sliced out of the memory map, cell counts are
+popcounts of each bit plane down the selected rows, and any/all aggregates are bitwise or/and reductions of the packed
+rows; so dense ensembles (large fires) are queried without unpacking them.
+
+Sample usage:
+    store = open_scar_store(scar_store_file(sample_file), signature)
+    bp = burn_probability(store, simulation_ids=[1, 2, 3])
+    cube = build_scar_cube(store, scar_cube_file(sample_file))
+    bp = cube_aggregate(cube, simulation_ids=[1, 2, 3], aggregate="probability")
+    count, diagnostics = bp_convergence(store, z=1.96)
+"""
+from pathlib import Path
+
+import numpy as np
+
+from .store import SimulationStore, SimulationStoreWriter
+
+SCARS_KIND = "scars"
+SCARS_EXT = "scars"
+SCARS_COLUMNS = ("cell",)
+SCARS_DTYPE = np.int32
+CUBE_KIND = "scarcube"
+CUBE_EXT = "cube"
+CUBE_COLUMNS = ("bits",)
+CUBE_DTYPE = np.uint8
+CUBE_AGGREGATES = ("probability", "count", "any", "all")
+# set bits of each byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def burned_cells(data: np.ndarray) -> np.ndarray:
+    """Sorted flat ids of the burned cells of a scar grid"""
+    return np.flatnonzero(data.ravel() > 0)
+
+
+def scar_store_file(sample_file: Path) -> Path:
+    """Scar store next to the simulation directories, e.g. results/Grids/final_scars.scars"""
+    return Path(sample_file).absolute().parent.parent / f"final_scars.{SCARS_EXT}"
+
+
+def scar_cube_file(sample_file: Path) -> Path:
+    """Scar cube next to the scar store (distinct stem, so store parts do not collide)"""
+    return Path(sample_file).absolute().parent.parent / f"final_scars_cube.{CUBE_EXT}"
+
+
+def pack_scar(data: np.ndarray) -> np.ndarray:
+    """Burned flags of a scar grid, row-major, packed 8 per byte"""
+    return np.packbits(data.ravel() > 0)
+
+
+def scars_signature(files: dict[int, Path], H: int, W: int) -> dict:
+    """What a scar store depends on: landscape size, and number, total size and latest modification of the files"""
+    stats = [afile.stat() for afile in files.values()]
+    return {
+        "H": H,
+        "W": W,
+        "files": len(stats),
+        "size": sum(stat.st_size for stat in stats),
+        "mtime_ns": max((stat.st_mtime_ns for stat in stats), default=0),
+    }
+
+
+def open_scar_store(filename: Path, signature: dict = None, kind: str = SCARS_KIND):
+    """Scar store (or cube) if it exists (and was built from the same files, if a signature is given), else None"""
+    if not Path(filename).is_file():
+        return None
+    try:
+        store = SimulationStore(filename)
+    except (OSError, ValueError, KeyError):
+        return None
+    if store.kind != kind or "meta" not in store.header or (
+        signature is not None and store.header["meta"] != signature
+    ):
+        # release the memory maps, the caller may rebuild over these files
+        store.close()
+        return None
+    return store
+
+
+def store_shape(store: SimulationStore) -> tuple[int, int]:
+    """Landscape (H, W) a scar store was built for"""
+    return store.header["meta"]["H"], store.header["meta"]["W"]
+
+
+class ScarStoreAccumulator:
+    """Fused pass accumulator writing the burned cells of each final scar into a scar store
+
+    The signature is saved in the header on close, only if every simulation was added
+    """
+
+    columns, dtype, kind = SCARS_COLUMNS, SCARS_DTYPE, SCARS_KIND
+
+    def __init__(self, filename: Path, simulation_ids: list[int], signature: dict):
+        self.writer = SimulationStoreWriter(filename, self.columns, self.dtype, kind=self.kind)
+        self.simulation_ids = list(simulation_ids)
+        self.signature = signature
+
+    def add(self, k: int, data: np.ndarray):
+        self.writer.add(self.simulation_ids[k], cell=burned_cells(data))
+
+    def close(self) -> bool:
+        completed = len(self.writer) == len(self.simulation_ids)
+        self.writer.meta = self.signature if completed else None
+        self.writer.close()
+        return completed
+
+
+class ScarCubeAccumulator(ScarStoreAccumulator):
+    """Fused pass accumulator writing the packed burned flags of each final scar into a scar cube"""
+
+    columns, dtype, kind = CUBE_COLUMNS, CUBE_DTYPE, CUBE_KIND
+
+    def add(self, k: int, data: np.ndarray):
+        self.writer.add(self.simulation_ids[k], bits=pack_scar(data))
+
+
+def build_scar_cube(store: SimulationStore, filename: Path) -> SimulationStore:
+    """Scar cube of the simulations of a scar store (same signature), without reading any scar file"""
+    H, W = store_shape(store)
+    writer = SimulationStoreWriter(filename, CUBE_COLUMNS, CUBE_DTYPE, kind=CUBE_KIND)
+    burned = np.zeros(H * W, dtype=bool)
+    for k, sim_id in enumerate(store.simulation_ids):
+        (cells,) = store.columns_of(k)
+        burned[cells] = True
+        writer.add(int(sim_id), bits=np.packbits(burned))
+        burned[cells] = False
+    writer.meta = store.header["meta"]
+    writer.close()
+    return SimulationStore(filename)
+
+
+def cube_rows(cube: SimulationStore, indices: np.ndarray, block_bytes: int = 2**24):
+    """Blocks (rows, row bytes) of the packed rows at the given positions, about block_bytes each"""
+    H, W = store_shape(cube)
+    row_bytes = (H * W + 7) // 8
+    bits = cube.column("bits")
+    rows = max(1, block_bytes // row_bytes)
+    contiguous = len(indices) == 0 or np.all(np.diff(indices) == 1)
+    for start in range(0, len(indices), rows):
+        block = indices[start : start + rows]
+        if contiguous:
+            yield np.asarray(bits[block[0] * row_bytes : (block[-1] + 1) * row_bytes]).reshape(-1, row_bytes)
+        else:
+            yield np.concatenate([np.asarray(bits[k * row_bytes : (k + 1) * row_bytes]) for k in block]).reshape(
+                -1, row_bytes
+            )
+
+
+def cube_aggregate(cube: SimulationStore, simulation_ids=None, aggregate: str = "probability") -> np.ndarray:
+    """(H, W) aggregate of the burned flags of the (given, default all) simulations of a scar cube
+
+    probability: float32 fraction burning each cell; count: int32 simulations burning each cell; any / all: uint8 1
+    where at least one / every simulation burned the cell
+    """
+    H, W = store_shape(cube)
+    indices = simulation_indices(cube, simulation_ids)
+    row_bytes = (H * W + 7) // 8
+    if aggregate in ["any", "all"]:
+        reduce = np.bitwise_or if aggregate == "any" else np.bitwise_and
+        packed = np.full(row_bytes, 0 if aggregate == "any" or len(indices) == 0 else 255, dtype=np.uint8)
+        for rows in cube_rows(cube, indices):
+            packed = reduce(packed, reduce.reduce(rows, axis=0))
+        return np.unpackbits(packed, count=H * W).reshape(H, W)
+    if aggregate not in CUBE_AGGREGATES:
+        raise ValueError(f"unknown aggregate {aggregate}, not in {CUBE_AGGREGATES}")
+    # popcount of each bit plane down the rows: bit b (most significant first) of byte c is cell 8 c + b
+    counts = np.zeros((row_bytes, 8), dtype=np.int32)
+    for rows in cube_rows(cube, indices):
+        for b in range(8):
+            counts[:, b] += ((rows >> (7 - b)) & 1).sum(axis=0, dtype=np.int32)
+    counts = counts.ravel()[: H * W].reshape(H, W)
+    if aggregate == "count":
+        return counts
+    return (counts / max(len(indices), 1)).astype(np.float32)
+
+
+def cube_burned_cells(cube: SimulationStore, simulation_ids=None) -> np.ndarray:
+    """Number of burned cells of the (given) simulations, popcount of their packed rows"""
+    indices = simulation_indices(cube, simulation_ids)
+    counts = [POPCOUNT[rows].sum(axis=1, dtype=np.int64) for rows in cube_rows(cube, indices)]
+    return np.concatenate(counts + [np.empty(0, dtype=np.int64)])
+
+
+def wilson_width(count: np.ndarray, n: int, z: float = 1.96) -> np.ndarray:
+    """Full width of the Wilson score binomial confidence interval of count successes in n trials
+
+    Unlike the normal approximation, it is not 0 for cells that never (or always) burned
+    """
+    p = count / n
+    return 2 * z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+
+
+def simulations_needed(count: np.ndarray, n: int, width: float, z: float = 1.96, coverage: float = 0.95) -> int:
+    """Number of simulations for the confidence interval of the burn probability of a coverage fraction of the burned
+    cells to be narrower than width, from the current estimates p: 4 z^2 p (1 - p) / width^2 (normal approximation)"""
+    p = count[count > 0] / n
+    if p.size == 0:
+        return n
+    needed = 4 * z**2 * p * (1 - p) / width**2
+    return int(np.ceil(np.quantile(needed, coverage)))
+
+
+def bp_convergence(store: SimulationStore, z: float = 1.96, checkpoints: int = 20, simulation_ids=None):
+    """Burn probability diagnostics as the (given, default all) simulations are added in store order
+
+    At about evenly spaced numbers of simulations (the last checkpoint has them all): burned cells, mean and maximum
+    confidence interval width over the burned cells and root mean square change of their burn probability since the
+    previous checkpoint.
+    Returns the final (H, W) burn counts and the {name: values} columns of the checkpoints
+    """
+    H, W = store_shape(store)
+    indices = simulation_indices(store, simulation_ids)
+    checkpoints = max(1, min(checkpoints, len(indices)))
+    marks = np.unique(np.linspace(len(indices) / checkpoints, len(indices), checkpoints).round().astype(int))
+    count = np.zeros(H * W, dtype=np.int64)
+    columns = {name: [] for name in ["simulations", "burned_cells", "mean_ci_width", "max_ci_width", "rms_change"]}
+    done, previous = 0, None
+    for mark in marks:
+        cells = [store.columns_of(k)[0] for k in indices[done:mark]]
+        count += np.bincount(np.concatenate(cells + [np.empty(0, dtype=SCARS_DTYPE)]), minlength=H * W)
+        done = mark
+        burned = count > 0
+        width = wilson_width(count[burned], mark, z)
+        bp = count / mark
+        columns["simulations"] += [mark]
+        columns["burned_cells"] += [int(burned.sum())]
+        columns["mean_ci_width"] += [width.mean() if width.size else 0.0]
+        columns["max_ci_width"] += [width.max() if width.size else 0.0]
+        columns["rms_change"] += [np.sqrt(np.mean((bp - previous)[burned] ** 2)) if previous is not None else np.nan]
+        previous = bp
+    return count.reshape(H, W), {name: np.array(values) for name, values in columns.items()}
+
+
+def parse_simulation_ids(text: str) -> list[int]:
+    """Simulation ids from a comma separated list of ids and inclusive ranges, e.g. "1-3,7" -> [1, 2, 3, 7]"""
+    ids = []
+    for item in text.replace(" ", "").split(","):
+        if item == "":
+            continue
+        if "-" in item[1:]:
+            start, stop = item.split("-", 1)
+            ids += list(range(int(start), int(stop) + 1))
+        else:
+            ids += [int(item)]
+    return sorted(set(ids))
+
+
+def simulation_indices(store: SimulationStore, simulation_ids=None) -> np.ndarray:
+    """Positions in the store of the given simulation ids (all if None); raises ValueError for unknown ids"""
+    if simulation_ids is None:
+        return np.arange(len(store))
+    stored = np.asarray(store.simulation_ids)
+    order = np.argsort(stored, kind="stable")
+    simulation_ids = np.asarray(simulation_ids, dtype=np.int64)
+    found = np.searchsorted(stored, simulation_ids, sorter=order)
+    found = np.minimum(found, len(stored) - 1)
+    known = (len(stored) > 0) & (stored[order[found]] == simulation_ids)
+    if not np.all(known):
+        raise ValueError(f"simulation ids not found: {simulation_ids[~known].tolist()[:10]}")
+    return order[found]
+
+
+def burn_probability(store: SimulationStore, simulation_ids=None) -> np.ndarray:
+    """Float32 (H, W) fraction of the (given, default all) simulations burning each cell, one bincount"""
+    H, W = store_shape(store)
+    indices = simulation_indices(store, simulation_ids)
+    if len(indices) == len(store):
+        cells = store.column("cell")[:]
+    else:
+        cells = np.concatenate([store.columns_of(k)[0] for k in indices] + [np.empty(0, dtype=SCARS_DTYPE)])
+    count = np.bincount(cells, minlength=H * W)
+    return (count / max(len(indices), 1)).astype(np.float32).reshape(H, W)
+
+
+def burned_areas(store: SimulationStore, cell_area: float = 1.0, simulation_ids=None):
+    """Simulation ids, number of burned cells and burned area (cells x cell_area) of the (given) simulations"""
+    indices = simulation_indices(store, simulation_ids)
+    cells = store.sizes()[indices]
+    return np.asarray(store.simulation_ids)[indices], cells, cells * cell_area
@@ -0,0 +1,266 @@
+#!python3
+"""
+simulation store helpers
+
+Columnar, memory-mappable on-disk layout for ragged per-simulation records, e.g. the propagation messages (i, j, t) of
+each simulation. For a store named `results/Messages/messages.msgs`:
+    messages.msgs           json header: kind, columns, dtype, number of simulations and records
+    messages.<column>.bin   raw concatenated values of each column (native endianness)
+    messages.offsets.npy    int64[nsim + 1], records of the k-th simulation are [offsets[k], offsets[k+1])
+    messages.simid.npy      int32[nsim], simulation id of the k-th simulation
+
+Opening a store only parses the header and memory-maps the rest, so a single simulation can be sliced out without
+deserializing the others. With memory_map=False each access reads just its slice from disk instead (out-of-core
+streaming: no mapped pages pile up in the process).
+
+Sample usage:
+    with SimulationStoreWriter("messages.msgs", MESSAGES_COLUMNS) as writer:
+        writer.add(1, data)  # structured array with fields i, j, t
+    store = SimulationStore("messages.msgs")
+    i, j, t = store.columns_of(0)
+"""
+from json import dump as json_dump
+from json import load as json_load
+from pathlib import Path
+from pickle import load as pickle_load
+
+import numpy as np
+
+FORMAT = "fire2a-simulation-store"
+FORMAT_VERSION = 1
+
+MESSAGES_KIND = "messages"
+MESSAGES_EXT = "msgs"
+MESSAGES_COLUMNS = ("i", "j", "t")
+MESSAGES_DTYPE = np.int32
+
+
+def store_file(store: Path, part: str) -> Path:
+    """Path of a part (column name, "offsets", "simid" or "manifest") of the store"""
+    store = Path(store)
+    if part in ["offsets", "simid"]:
+        return store.with_name(f"{store.stem}.{part}.npy")
+    if part == "manifest":
+        return store.with_name(f"{store.stem}.{part}.json")
+    return store.with_name(f"{store.stem}.{part}.bin")
+
+
+def store_parts(store: Path, columns) -> list[Path]:
+    """All files of a store (header last), not including its manifest"""
+    return [store_file(store, part) for part in list(columns) + ["offsets", "simid"]] + [Path(store)]
+
+
+def move_store(src: Path, dst: Path, columns):
+    """Rename all files of a store, replacing the destination ones"""
+    for src_part, dst_part in zip(store_parts(src, columns), store_parts(dst, columns)):
+        src_part.replace(dst_part)
+
+
+def remove_store(store: Path, columns):
+    for part in store_parts(store, columns):
+        part.unlink(missing_ok=True)
+
+
+class ColumnFile:
+    """Column of a store read on demand: slicing reads only the requested records from disk"""
+
+    def __init__(self, filename: Path, dtype: np.dtype, size: int):
+        self.filename = filename
+        self.dtype = dtype
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key: slice) -> np.ndarray:
+        start, stop, step = key.indices(self.size)
+        return np.fromfile(
+            self.filename, dtype=self.dtype, count=max(0, stop - start), offset=start * self.dtype.itemsize
+        )[::step]
+
+
+class SimulationStore:
+    """Read-only view of a simulation store, opened in O(1) by memory mapping its columns (or reading on demand)
+
+    Behaves like the legacy list of structured arrays: len(), iteration and indexing return each simulation as a
+    structured array with one field per column
+    """
+
+    def __init__(self, filename, memory_map=True):
+        self.filename = Path(filename)
+        self.memory_map = memory_map
+        with open(self.filename, "r") as f:
+            self.header = json_load(f)
+        if self.header.get("format") != FORMAT:
+            raise ValueError(f"{self.filename} is not a simulation store")
+        if self.header.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"{self.filename} store version {self.header['version']} not supported")
+        self.kind = self.header["kind"]
+        self.columns = tuple(self.header["columns"])
+        self.dtype = np.dtype(self.header["dtype"])
+        self.record_dtype = np.dtype([(col, self.dtype) for col in self.columns])
+        nsim = self.header["simulations"]
+        self.offsets = np.load(store_file(self.filename, "offsets"), mmap_mode="r" if nsim > 0 else None)
+        self.simulation_ids = np.load(store_file(self.filename, "simid"), mmap_mode="r" if nsim > 0 else None)
+        nrec = int(self.offsets[-1])
+        self._data = {}
+        for col in self.columns:
+            if nrec > 0 and memory_map:
+                self._data[col] = np.memmap(store_file(self.filename, col), dtype=self.dtype, mode="r", shape=(nrec,))
+            elif nrec > 0:
+                self._data[col] = ColumnFile(store_file(self.filename, col), self.dtype, nrec)
+            else:
+                self._data[col] = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.simulation_ids)
+
+    def __getitem__(self, k):
+        """k-th simulation as a structured array (copied out of the mapped columns)"""
+        start, stop = self._span(k)
+        data = np.empty(stop - start, dtype=self.record_dtype)
+        for col in self.columns:
+            data[col] = self._data[col][start:stop]
+        return data
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def _span(self, k):
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError(f"simulation index {k} out of range")
+        return int(self.offsets[k]), int(self.offsets[k + 1])
+
+    def column(self, name):
+        """Whole column, all simulations concatenated (memory-mapped, or a ColumnFile)"""
+        return self._data[name]
+
+    def columns_of(self, k):
+        """Tuple of column slices of the k-th simulation, in self.columns order"""
+        start, stop = self._span(k)
+        return tuple(self._data[col][start:stop] for col in self.columns)
+
+    def sizes(self):
+        """Number of records of each simulation"""
+        return np.diff(self.offsets)
+
+    @property
+    def number_of_records(self):
+        return int(self.offsets[-1])
+
+    def close(self):
+        """Release the memory maps (needed before replacing the files on MsWindows)"""
+        self._data = {col: np.empty(0, dtype=self.dtype) for col in self.columns}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.simulation_ids = np.empty(0, dtype=np.int32)
+
+
+class SimulationStoreWriter:
+    """Writes a simulation store, one simulation at a time; usable as a context manager
+
+    The header and index are written on close, so readers never see a partially written simulation.
+    With append=True an existing store is extended instead of overwritten; meta is a json-able dict saved in the header
+    """
+
+    def __init__(
+        self, filename, columns=MESSAGES_COLUMNS, dtype=MESSAGES_DTYPE, kind=MESSAGES_KIND, append=False, meta=None
+    ):
+        self.filename = Path(filename)
+        self.columns = tuple(columns)
+        self.dtype = np.dtype(dtype)
+        self.kind = kind
+        self.meta = meta
+        self.offsets = [0]
+        self.simulation_ids = []
+        if append and self.filename.is_file():
+            existing = SimulationStore(self.filename)
+            if existing.columns != self.columns or existing.dtype != self.dtype or existing.kind != self.kind:
+                raise ValueError(f"cannot append to {self.filename}, it stores {existing.kind} {existing.columns}")
+            self.offsets = existing.offsets.tolist()
+            self.simulation_ids = existing.simulation_ids.tolist()
+            existing.close()
+            self._files = {}
+            for col in self.columns:
+                # drop anything written after the last indexed simulation (e.g. an interrupted run)
+                afile = open(store_file(self.filename, col), "r+b")
+                afile.truncate(self.offsets[-1] * self.dtype.itemsize)
+                afile.seek(0, 2)
+                self._files[col] = afile
+        else:
+            self._files = {col: open(store_file(self.filename, col), "wb") for col in self.columns}
+
+    def add(self, sim_id, data=None, **columns):
+        """Append one simulation, given as a structured array with the store columns or as keyword arrays"""
+        if data is not None:
+            columns = {col: data[col] for col in self.columns}
+        size = None
+        for col in self.columns:
+            values = np.ascontiguousarray(columns[col], dtype=self.dtype)
+            if size is None:
+                size = len(values)
+            elif size != len(values):
+                raise ValueError(f"column {col} length {len(values)} differs from {size}")
+            self._files[col].write(values.tobytes())
+        self.offsets += [self.offsets[-1] + size]
+        self.simulation_ids += [int(sim_id)]
+
+    def __len__(self):
+        return len(self.simulation_ids)
+
+    def close(self):
+        if self._files is None:
+            return
+        for afile in self._files.values():
+            afile.close()
+        self._files = None
+        np.save(store_file(self.filename, "offsets"), np.array(self.offsets, dtype=np.int64))
+        np.save(store_file(self.filename, "simid"), np.array(self.simulation_ids, dtype=np.int32))
+        header = {
+            "format": FORMAT,
+            "version": FORMAT_VERSION,
+            "kind": self.kind,
+            "columns": list(self.columns),
+            "dtype": self.dtype.str,
+            "simulations": len(self.simulation_ids),
+            "records": self.offsets[-1],
+        }
+        if self.meta is not None:
+            header["meta"] = self.meta
+        with open(self.filename, "w") as f:
+            json_dump(header, f, indent=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_messages(filename, memory_map=True):
+    """Open propagation messages: a simulation store (.msgs) or a legacy pickled list of structured arrays (.pickle)
+
+    Either way the returned object supports len(), iteration and indexing, yielding structured arrays with fields i, j, t
+    """
+    filename = Path(filename)
+    if filename.suffix == ".pickle":
+        with open(filename, "rb") as f:
+            return pickle_load(f)
+    return SimulationStore(filename, memory_map=memory_map)
+
+
+def open_store_args(data_list):
+    """Picklable way for a pool worker to reopen data_list (see reopen_store): the store filename and access mode, or
+    the legacy list itself (inherited when forking)"""
+    if isinstance(data_list, SimulationStore):
+        return str(data_list.filename), data_list.memory_map
+    return data_list, None
+
+
+def reopen_store(args):
+    data_list, memory_map = args
+    if isinstance(data_list, str):
+        return SimulationStore(data_list, memory_map=memory_map)
+    return data_list
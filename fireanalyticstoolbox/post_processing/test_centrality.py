@@ -0,0 +1,70 @@
+#!python3
+"""Sparse matrix betweenness centrality engine against networkx on the MultiDiGraph it replaced"""
+import numpy as np
+import pytest
+from networkx import MultiDiGraph
+from networkx import betweenness_centrality as nx_betweenness_centrality
+from post_processing.centrality import PropagationGraph, adaptive_betweenness_centrality, betweenness_centrality
+from post_processing.test_dpv import as_messages, random_messages
+
+
+def multidigraph(data_list):
+    """Baseline BetweennessCentralityMetric graph: edges keyed by simulation, weighted by hit time"""
+    mdg = MultiDiGraph()
+    for k, data in enumerate(data_list):
+        mdg.add_edges_from((int(i), int(j), k, {"weight": int(t)}) for i, j, t in data)
+    return mdg
+
+
+def as_dict(graph, centrality):
+    return dict(zip(graph.nodes.tolist(), centrality))
+
+
+def assert_same(graph, centrality, expected):
+    assert set(graph.nodes.tolist()) == set(expected)
+    got = as_dict(graph, centrality)
+    np.testing.assert_allclose([got[node] for node in expected], list(expected.values()), atol=1e-12)
+
+
+@pytest.fixture(scope="module")
+def ensemble():
+    rng = np.random.default_rng(11)
+    return [random_messages(rng, cells=40, size=60) for _ in range(6)]
+
+
+def test_repeated_message_keeps_last_time():
+    """0 -> 1 is sent at 1 then at 9 in the same simulation: the edge weighs 9, so 0 -> 2 -> 1 (5) is shorter"""
+    data_list = [as_messages([(0, 1, 1), (0, 1, 9), (0, 2, 2), (2, 1, 3)])]
+    graph = PropagationGraph.from_messages(data_list)
+    assert graph.matrix[0, 1] == 9
+    expected = nx_betweenness_centrality(multidigraph(data_list), weight="weight")
+    assert_same(graph, betweenness_centrality(graph), expected)
+
+
+def test_parallel_simulations_keep_minimum():
+    data_list = [as_messages([(0, 1, 9), (0, 2, 2), (2, 1, 3)]), as_messages([(0, 1, 1)])]
+    graph = PropagationGraph.from_messages(data_list)
+    assert graph.matrix[0, 1] == 1
+    expected = nx_betweenness_centrality(multidigraph(data_list), weight="weight")
+    assert_same(graph, betweenness_centrality(graph), expected)
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_all_sources(ensemble, threads):
+    graph = PropagationGraph.from_messages(ensemble)
+    expected = nx_betweenness_centrality(multidigraph(ensemble), weight="weight")
+    assert_same(graph, betweenness_centrality(graph, threads=threads), expected)
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_sampled_sources(ensemble, threads):
+    graph = PropagationGraph.from_messages(ensemble)
+    expected = nx_betweenness_centrality(multidigraph(ensemble), k=10, weight="weight", seed=5)
+    assert_same(graph, betweenness_centrality(graph, k=10, seed=5, threads=threads), expected)
+
+
+def test_adaptive_uses_every_source(ensemble):
+    graph = PropagationGraph.from_messages(ensemble)
+    centrality, used, change = adaptive_betweenness_centrality(graph, seed=1, tolerance=0, batch_size=7, threads=2)
+    assert used == len(graph) and change == 0
+    np.testing.assert_allclose(centrality, betweenness_centrality(graph))
@@ -0,0 +1,105 @@
+#!python3
+"""Downstream protection value kernel against the networkx worker it replaced"""
+import numpy as np
+import pytest
+from networkx import DiGraph, single_source_dijkstra_path
+from post_processing.dpv import downstream_protection_value, simulation_dpv
+from post_processing.messages import MESSAGES_RECORD
+from post_processing.trees import PropagationTree
+
+
+def recursion(G, i, mdpv, i2n):
+    for j in G.successors(i):
+        mdpv[i2n.index(i)] += recursion(G, j, mdpv, i2n)
+    return mdpv[i2n.index(i)]
+
+
+def worker(data, pv):
+    """Baseline DownStreamProtectionValueMetric worker"""
+    msgG = DiGraph()
+    msgG.add_weighted_edges_from(data)
+    root = data[0][0]
+    shortest_paths = single_source_dijkstra_path(msgG, root, weight="time")
+    del shortest_paths[root]
+    treeG = DiGraph()
+    for node, shopat in shortest_paths.items():
+        for i, node in enumerate(shopat[:-1]):
+            treeG.add_edge(node, shopat[i + 1])
+    i2n = [n for n in treeG]
+    mdpv = pv[i2n]
+    recursion(treeG, root, mdpv, i2n)
+    return mdpv, i2n
+
+
+def as_messages(rows):
+    data = np.empty(len(rows), dtype=MESSAGES_RECORD)
+    for k, row in enumerate(rows):
+        data[k] = row
+    return data
+
+
+def random_messages(rng, cells=60, size=150):
+    """Spread messages from an ignition at positive hit times: each message leaves an already reached cell, repeated
+    edges included"""
+    reached = [int(rng.integers(cells))]
+    rows = []
+    for t in range(1, size + 1):
+        i = reached[rng.integers(len(reached))]
+        j = int(rng.integers(cells))
+        if j == i:
+            continue
+        rows += [(i, j, t)]
+        if j not in reached:
+            reached += [j]
+    return as_messages(rows)
+
+
+def dense_dpv(data, pv):
+    mdpv, cells = simulation_dpv(data, pv)
+    dpv = np.zeros(pv.shape)
+    dpv[cells] = mdpv
+    return dpv
+
+
+def dense_worker(data, pv):
+    mdpv, i2n = worker(data, pv)
+    dpv = np.zeros(pv.shape)
+    dpv[i2n] = mdpv
+    return dpv
+
+
+def test_ties_broken_by_message_order():
+    """Cell 3 is reached at the same depth from 1 and 2, and 5 from 4 and 3: the first message edges win"""
+    data = as_messages([(0, 1, 1), (0, 2, 1), (2, 3, 2), (1, 4, 3), (1, 3, 3), (4, 5, 4), (3, 5, 4)])
+    pv = 10 * np.arange(6, dtype=np.float64) + 1
+    dpv = dense_dpv(data, pv)
+    assert dpv[3] == 31
+    assert dpv[4] == 92
+    np.testing.assert_array_equal(dpv, dense_worker(data, pv))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_simulations_match_worker(seed):
+    rng = np.random.default_rng(seed)
+    data = random_messages(rng)
+    pv = rng.random(60)
+    np.testing.assert_allclose(dense_dpv(data, pv), dense_worker(data, pv))
+
+
+def test_tree_round_trip():
+    data = random_messages(np.random.default_rng(7))
+    tree = PropagationTree.from_messages(data)
+    rebuilt = PropagationTree.from_arrays(*tree.to_arrays())
+    pv = np.arange(60, dtype=np.float64)
+    np.testing.assert_allclose(
+        rebuilt.subtree_sums(pv[rebuilt.cells]), tree.subtree_sums(pv[tree.cells])[tree.order]
+    )
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_downstream_protection_value_bands(threads):
+    rng = np.random.default_rng(3)
+    data_list = [random_messages(rng) for _ in range(8)]
+    pv = rng.random((60, 2))
+    expected = sum(np.column_stack([dense_worker(data, pv[:, b]) for b in range(2)]) for data in data_list)
+    np.testing.assert_allclose(downstream_protection_value(data_list, pv, threads=threads), expected)
@@ -0,0 +1,142 @@
+#!python3
+"""Incremental messages ingestion and edge frequency aggregation"""
+import os
+from collections import Counter
+
+import numpy as np
+import pytest
+from post_processing.messages import EdgeFrequencyAccumulator, MessagesIngestion, read_messages_file
+from post_processing.store import SimulationStore
+from post_processing.test_dpv import random_messages
+
+
+def write_messages(directory, sim_id, data):
+    """Cell2Fire style csv: 1-based cell ids, no header"""
+    afile = directory / f"MessagesFile{sim_id}.csv"
+    np.savetxt(afile, np.column_stack((data["i"] + 1, data["j"] + 1, data["t"])), fmt="%d", delimiter=",")
+    return afile
+
+
+@pytest.fixture
+def results(tmp_path):
+    rng = np.random.default_rng(9)
+    directory = tmp_path / "Messages"
+    directory.mkdir()
+    simulations = {sim_id: random_messages(rng, size=30) for sim_id in range(1, 11)}
+    for sim_id, data in simulations.items():
+        write_messages(directory, sim_id, data)
+    return directory, simulations
+
+
+def ingest(directory, threads=1):
+    ingestion = MessagesIngestion(list(directory.glob("MessagesFile*.csv")), directory / "messages.msgs")
+    yielded = dict(ingestion.ingest(threads=threads))
+    return ingestion.mode, ingestion.to_parse, yielded
+
+
+def assert_store(directory, simulations):
+    store = SimulationStore(directory / "messages.msgs")
+    assert store.simulation_ids.tolist() == sorted(simulations)
+    for k, sim_id in enumerate(sorted(simulations)):
+        np.testing.assert_array_equal(store[k], simulations[sim_id])
+    store.close()
+
+
+def test_read_messages_file(tmp_path):
+    data = random_messages(np.random.default_rng(1))
+    np.testing.assert_array_equal(read_messages_file(write_messages(tmp_path, 1, data)), data)
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_new_then_reuse(results, threads):
+    directory, simulations = results
+    mode, to_parse, yielded = ingest(directory, threads)
+    assert mode == "new" and len(to_parse) == 10
+    assert list(yielded) == sorted(simulations)
+    assert_store(directory, simulations)
+    mode, to_parse, yielded = ingest(directory, threads)
+    assert mode == "reuse" and to_parse == []
+    for sim_id, data in simulations.items():
+        np.testing.assert_array_equal(yielded[sim_id], data)
+
+
+def test_touched_files_are_hashed_not_parsed(results):
+    directory, simulations = results
+    ingest(directory)
+    afile = directory / "MessagesFile3.csv"
+    stat = afile.stat()
+    os.utime(afile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    mode, to_parse, _ = ingest(directory)
+    assert mode == "reuse" and to_parse == []
+
+
+def test_append_new_simulations(results):
+    directory, simulations = results
+    ingest(directory)
+    rng = np.random.default_rng(2)
+    for sim_id in [11, 12]:
+        simulations[sim_id] = random_messages(rng, size=30)
+        write_messages(directory, sim_id, simulations[sim_id])
+    mode, to_parse, yielded = ingest(directory)
+    assert mode == "append" and [afile.name for afile in to_parse] == ["MessagesFile11.csv", "MessagesFile12.csv"]
+    assert list(yielded) == sorted(simulations)
+    assert_store(directory, simulations)
+    assert ingest(directory)[0] == "reuse"
+
+
+@pytest.mark.parametrize("change", ["modified", "removed", "interleaved"])
+def test_rebuild(results, change):
+    directory, simulations = results
+    ingest(directory)
+    if change == "modified":
+        simulations[4] = random_messages(np.random.default_rng(3), size=12)
+        write_messages(directory, 4, simulations[4])
+    elif change == "removed":
+        (directory / "MessagesFile4.csv").unlink()
+        del simulations[4]
+    else:
+        (directory / "MessagesFile4.csv").rename(directory / "MessagesFile40.csv")
+        simulations[40] = simulations.pop(4)
+        (directory / "MessagesFile2.csv").unlink()
+        del simulations[2]
+    mode, to_parse, _ = ingest(directory)
+    assert mode == "rebuild"
+    assert_store(directory, simulations)
+    assert ingest(directory)[0] == "reuse"
+
+
+def test_canceled_rebuild_keeps_old_store(results):
+    directory, simulations = results
+    ingest(directory)
+    write_messages(directory, 4, random_messages(np.random.default_rng(3), size=12))
+    ingestion = MessagesIngestion(list(directory.glob("MessagesFile*.csv")), directory / "messages.msgs")
+    assert ingestion.mode == "rebuild"
+    generator = ingestion.ingest()
+    next(generator)
+    generator.close()
+    assert_store(directory, simulations)
+
+
+@pytest.mark.parametrize("buffer_size", [7, 10_000_000])
+def test_edge_frequency(buffer_size):
+    rng = np.random.default_rng(4)
+    data_list = [random_messages(rng, cells=15, size=40) for _ in range(12)] + [random_messages(rng, size=0)]
+    efa = EdgeFrequencyAccumulator(buffer_size=buffer_size)
+    counts, times = Counter(), {}
+    for data in data_list:
+        efa.add(data["i"], data["j"], data["t"])
+        for i, j, t in data:
+            counts[(i, j)] += 1
+            times.setdefault((i, j), []).append(t)
+    i, j, count, tmin, tmean, tmax = efa.result()
+    assert efa.simulations == len(data_list)
+    assert list(zip(i.tolist(), j.tolist())) == sorted(counts)
+    assert count.tolist() == [counts[key] for key in sorted(counts)]
+    assert tmin.tolist() == [min(times[key]) for key in sorted(counts)]
+    assert tmax.tolist() == [max(times[key]) for key in sorted(counts)]
+    np.testing.assert_allclose(tmean, [np.mean(times[key]) for key in sorted(counts)])
+
+
+def test_edge_frequency_empty():
+    i, j, count, tmin, tmean, tmax = EdgeFrequencyAccumulator().result()
+    assert len(i) == len(j) == len(count) == len(tmin) == len(tmean) == len(tmax) == 0
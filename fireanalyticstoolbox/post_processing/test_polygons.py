@@ -0,0 +1,57 @@
+#!python3
+"""scar_polygon geometries must be valid MultiPolygons covering exactly the burned cells, no fix geometries needed"""
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+
+from osgeo import ogr
+from post_processing.polygons import scar_polygon
+
+# 10m cells, north up
+GT = (1000.0, 10.0, 0.0, 2000.0, 0.0, -10.0)
+
+PATTERNS = {
+    "single": [[1]],
+    "diagonal": [[1, 0], [0, 1]],
+    "anti diagonal": [[0, 1], [1, 0]],
+    "checkerboard": np.indices((5, 6)).sum(axis=0) % 2,
+    "hole": [[1, 1, 1], [1, 0, 1], [1, 1, 1]],
+    "hole touching the border": [[1, 1, 1], [1, 0, 1], [1, 1, 0]],
+    "holes meeting at a vertex": [[1, 1, 1, 1], [1, 0, 1, 1], [1, 1, 0, 1], [1, 1, 1, 1]],
+    "island in a hole": [
+        [1, 1, 1, 1, 1],
+        [1, 0, 0, 0, 1],
+        [1, 0, 1, 0, 1],
+        [1, 0, 0, 0, 1],
+        [1, 1, 1, 1, 1],
+    ],
+    "diagonal island in a hole": [
+        [1, 1, 1, 1],
+        [1, 0, 0, 1],
+        [1, 0, 1, 1],
+        [1, 1, 1, 1],
+    ],
+}
+
+
+@pytest.mark.parametrize("pattern", PATTERNS.values(), ids=PATTERNS.keys())
+def test_valid_multipolygon(pattern):
+    data = np.asarray(pattern)
+    geometry = scar_polygon(data, GT)
+    assert geometry.IsValid()
+    assert ogr.GT_Flatten(geometry.GetGeometryType()) == ogr.wkbMultiPolygon
+    assert geometry.GetArea() == pytest.approx(np.count_nonzero(data) * 100)
+
+
+def test_diagonal_cells_are_parts():
+    geometry = scar_polygon(np.asarray(PATTERNS["checkerboard"]), GT)
+    assert geometry.GetGeometryCount() == 15
+
+
+def test_values_above_one_burned():
+    assert scar_polygon(np.array([[0, 3], [2, 0]]), GT).GetArea() == pytest.approx(200)
+
+
+def test_nothing_burned():
+    assert scar_polygon(np.zeros((3, 4), dtype=np.int8), GT) is None
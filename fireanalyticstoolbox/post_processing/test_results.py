@@ -0,0 +1,161 @@
+#!python3
+"""Fused single pass over simulation result files against numpy on the stacked grids"""
+
+import numpy as np
+import pytest
+from post_processing.results import (
+    SCAR_SOURCE,
+    STAT_NODATA,
+    Exceedance,
+    FusedResultsPass,
+    MeanStd,
+    QuantileSketch,
+    SimulationSummary,
+    final_scar_files,
+    numbered_files,
+    read_asc_file,
+    read_scar_file,
+    scar_files,
+)
+
+H, W = 9, 7
+NSIM = 13
+
+
+def write_asc(afile, data):
+    header = f"ncols {W}\nnrows {H}\nxllcorner 0\nyllcorner 0\ncellsize 100\nNODATA_value {STAT_NODATA}\n"
+    with open(afile, "w") as f:
+        f.write(header)
+        np.savetxt(f, data, fmt="%.6g")
+
+
+@pytest.fixture(scope="module")
+def results(tmp_path_factory):
+    """ROS ascii grids (log-normal values, some zeros and nodata) and 1 to 3 period scar grids per simulation"""
+    root = tmp_path_factory.mktemp("results")
+    rng = np.random.default_rng(0)
+    (root / "RateOfSpread").mkdir()
+    stack = rng.lognormal(1, 1.5, size=(NSIM, H, W)).astype(np.float32)
+    stack[rng.random(stack.shape) < 0.3] = 0
+    stack[:, 0, 0] = STAT_NODATA
+    stack[: NSIM // 2, 1, 1] = STAT_NODATA
+    scars = np.zeros((NSIM, H, W), dtype=np.int8)
+    for k in range(NSIM):
+        write_asc(root / "RateOfSpread" / f"ROSFile{k + 1}.asc", stack[k])
+        (root / "Grids" / f"Grids{k + 1}").mkdir(parents=True)
+        for period in range(1, k % 3 + 2):
+            scars[k] = rng.random((H, W)) < 0.1 * period
+            np.savetxt(
+                root / "Grids" / f"Grids{k + 1}" / f"ForestGrid{period:02d}.csv", scars[k], fmt="%d", delimiter=","
+            )
+    # reread as float32 text, the reference is what the files hold
+    stack = np.array([read_asc_file(root / "RateOfSpread" / f"ROSFile{k + 1}.asc") for k in range(NSIM)])
+    return root, stack, scars
+
+
+def masked(stack):
+    return np.ma.masked_equal(stack.astype(np.float64), STAT_NODATA)
+
+
+def test_file_discovery(results):
+    root, _, _ = results
+    ros = numbered_files(root / "RateOfSpread" / "ROSFile1.asc")
+    assert list(ros) == list(range(1, NSIM + 1))
+    scars = scar_files(root / "Grids" / "Grids1" / "ForestGrid01.csv")
+    assert [len(periods) for periods in scars.values()] == [k % 3 + 1 for k in range(NSIM)]
+    assert all(
+        afile.stem == f"ForestGrid{len(scars[sim_id]):02d}"
+        for sim_id, afile in final_scar_files(root / "Grids" / "Grids1" / "ForestGrid01.csv").items()
+    )
+
+
+@pytest.fixture(scope="module", params=[1, 3])
+def fused(request, results):
+    root, _, _ = results
+    fused = FusedResultsPass(H, W)
+    fused.add_source("ros", numbered_files(root / "RateOfSpread" / "ROSFile1.asc"), read_asc_file)
+    fused.add_source(SCAR_SOURCE, final_scar_files(root / "Grids" / "Grids1" / "ForestGrid01.csv"), read_scar_file)
+    accumulators = {
+        "mean_std": fused.attach("ros", MeanStd(H, W, min_max=True)),
+        "quantiles": fused.attach("ros", QuantileSketch(H, W, accuracy=0.01, bins=1024)),
+        "exceedance": fused.attach("ros", Exceedance(H, W, [1, 5])),
+        "ros_summary": fused.attach("ros", SimulationSummary(NSIM)),
+        "scar_summary": fused.attach(SCAR_SOURCE, SimulationSummary(NSIM)),
+    }
+    assert fused.mergeable()
+    assert fused.run(threads=request.param) == 2 * NSIM
+    return accumulators
+
+
+def test_mean_std(fused, results):
+    _, stack, _ = results
+    ros = masked(stack)
+    mean, std, minimum, maximum = fused["mean_std"].result()
+    np.testing.assert_allclose(mean, ros.mean(axis=0).filled(0), rtol=1e-5)
+    np.testing.assert_allclose(std, ros.std(axis=0).filled(0), rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(minimum, ros.min(axis=0).filled(0), rtol=1e-6)
+    np.testing.assert_allclose(maximum, ros.max(axis=0).filled(0), rtol=1e-6)
+    assert mean[0, 0] == 0 and std[0, 0] == 0
+
+
+@pytest.mark.parametrize("q", [0, 0.5, 0.9, 1])
+def test_quantiles(fused, results, q):
+    _, stack, _ = results
+    (estimate,) = fused["quantiles"].result([q])
+    expected = np.zeros((H, W))
+    for r in range(H):
+        for c in range(W):
+            values = stack[:, r, c][stack[:, r, c] != STAT_NODATA]
+            if values.size:
+                expected[r, c] = np.quantile(values.astype(np.float64), q, method="lower")
+    np.testing.assert_allclose(estimate, expected, rtol=0.0101)
+    np.testing.assert_array_equal(estimate == 0, expected == 0)
+
+
+def test_exceedance(fused, results):
+    _, stack, _ = results
+    valid = stack != STAT_NODATA
+    burned = (valid & (stack > 0)).sum(axis=0)
+    bands = fused["exceedance"].result()
+    for b, threshold in enumerate([1, 5]):
+        exceed = (valid & (stack > threshold)).sum(axis=0)
+        np.testing.assert_allclose(bands[b], exceed / NSIM, rtol=1e-6)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.testing.assert_allclose(bands[2 + b], np.where(burned > 0, exceed / burned, 0), rtol=1e-6)
+
+
+def test_simulation_summary(fused, results):
+    _, stack, scars = results
+    ros = fused["ros_summary"]
+    for k in range(NSIM):
+        values = stack[k][(stack[k] != STAT_NODATA) & (stack[k] > 0)]
+        assert ros.cells[k] == values.size
+        assert ros.maximum[k] == pytest.approx(values.max())
+        assert ros.mean[k] == pytest.approx(values.mean(dtype=np.float64))
+    np.testing.assert_array_equal(fused["scar_summary"].cells, scars.sum(axis=(1, 2)))
+
+
+class Feedback:
+    def __init__(self, cancel_after=None):
+        self.cancel_after = cancel_after
+        self.progress = []
+
+    def isCanceled(self):
+        return self.cancel_after is not None and len(self.progress) >= self.cancel_after
+
+    def setProgress(self, progress):
+        self.progress += [progress]
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_progress_and_cancel(results, threads):
+    root, _, _ = results
+    fused = FusedResultsPass(H, W)
+    fused.add_source("ros", numbered_files(root / "RateOfSpread" / "ROSFile1.asc"), read_asc_file)
+    fused.attach("ros", MeanStd(H, W))
+    feedback = Feedback()
+    assert fused.run(threads, feedback) == NSIM
+    assert feedback.progress[-1] == 100 and len(feedback.progress) > 1
+    assert feedback.progress == sorted(feedback.progress)
+    fused.attach("ros", MeanStd(H, W))
+    assert fused.run(threads, Feedback(cancel_after=1)) < NSIM
@@ -0,0 +1,165 @@
+#!python3
+"""Sparse scar store and bit-packed scar cube against dense numpy aggregates"""
+
+import numpy as np
+import pytest
+from post_processing.scars import (
+    CUBE_KIND,
+    ScarStoreAccumulator,
+    bp_convergence,
+    build_scar_cube,
+    burn_probability,
+    burned_areas,
+    cube_aggregate,
+    cube_burned_cells,
+    open_scar_store,
+    parse_simulation_ids,
+    scars_signature,
+    simulations_needed,
+    wilson_width,
+)
+
+# W x H not a multiple of 8, so the last packed byte is partial
+H, W = 11, 13
+SIM_IDS = [2, 3, 5, 7, 11, 13, 17, 19, 23]
+
+
+@pytest.fixture(scope="module")
+def scars():
+    rng = np.random.default_rng(8)
+    dense = rng.random((len(SIM_IDS), H, W)) < rng.uniform(0, 0.6, size=(len(SIM_IDS), 1, 1))
+    dense[3] = False
+    dense[4] = True
+    return dense.astype(np.int8)
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory, scars):
+    filename = tmp_path_factory.mktemp("Grids") / "final_scars.scars"
+    accumulator = ScarStoreAccumulator(filename, SIM_IDS, {"H": H, "W": W})
+    for k, data in enumerate(scars):
+        accumulator.add(k, data)
+    assert accumulator.close()
+    store = open_scar_store(filename, {"H": H, "W": W})
+    yield store
+    store.close()
+
+
+@pytest.fixture(scope="module")
+def cube(store, tmp_path_factory):
+    cube = build_scar_cube(store, tmp_path_factory.mktemp("Grids") / "final_scars_cube.cube")
+    yield cube
+    cube.close()
+
+
+SUBSETS = [None, [7], [2, 3], [23, 2, 11], [5, 7, 11, 13], []]
+
+
+def dense_subset(scars, simulation_ids):
+    if simulation_ids is None:
+        return scars
+    return scars[[SIM_IDS.index(sim_id) for sim_id in simulation_ids]]
+
+
+@pytest.mark.parametrize("simulation_ids", SUBSETS)
+def test_burn_probability(store, scars, simulation_ids):
+    subset = dense_subset(scars, simulation_ids)
+    expected = subset.mean(axis=0) if len(subset) else np.zeros((H, W))
+    np.testing.assert_allclose(burn_probability(store, simulation_ids), expected, rtol=1e-6)
+    ids, cells, areas = burned_areas(store, 100.0, simulation_ids)
+    assert ids.tolist() == (SIM_IDS if simulation_ids is None else simulation_ids)
+    np.testing.assert_array_equal(cells, subset.sum(axis=(1, 2)))
+    np.testing.assert_array_equal(areas, 100.0 * subset.sum(axis=(1, 2)))
+
+
+@pytest.mark.parametrize("simulation_ids", SUBSETS)
+def test_cube_aggregates(cube, scars, simulation_ids):
+    subset = dense_subset(scars, simulation_ids).astype(bool)
+    np.testing.assert_array_equal(cube_aggregate(cube, simulation_ids, "count"), subset.sum(axis=0))
+    expected = subset.mean(axis=0) if len(subset) else np.zeros((H, W))
+    np.testing.assert_allclose(cube_aggregate(cube, simulation_ids, "probability"), expected, rtol=1e-6)
+    np.testing.assert_array_equal(cube_aggregate(cube, simulation_ids, "any"), subset.any(axis=0))
+    # an empty subset burns nothing, also for "all"
+    np.testing.assert_array_equal(cube_aggregate(cube, simulation_ids, "all"), subset.all(axis=0) & (len(subset) > 0))
+    np.testing.assert_array_equal(cube_burned_cells(cube, simulation_ids), subset.sum(axis=(1, 2)))
+
+
+def test_cube_small_blocks(cube, scars, monkeypatch):
+    from post_processing import scars as module
+
+    rows = module.cube_rows
+    monkeypatch.setattr(module, "cube_rows", lambda cube, indices: rows(cube, indices, block_bytes=1))
+    np.testing.assert_array_equal(cube_aggregate(cube, None, "count"), scars.sum(axis=0))
+    np.testing.assert_array_equal(cube_aggregate(cube, [23, 2, 11], "all"), dense_subset(scars, [23, 2, 11]).all(0))
+
+
+def test_unknown_ids_and_aggregates(store, cube):
+    with pytest.raises(ValueError):
+        burn_probability(store, [4])
+    with pytest.raises(ValueError):
+        cube_aggregate(cube, None, "median")
+
+
+def test_open_scar_store_checks(store, cube, tmp_path):
+    assert open_scar_store(store.filename, {"H": H, "W": W + 1}) is None
+    assert open_scar_store(cube.filename) is None
+    reopened = open_scar_store(cube.filename, kind=CUBE_KIND)
+    assert reopened is not None and len(reopened) == len(SIM_IDS)
+    reopened.close()
+    assert open_scar_store(tmp_path / "missing.scars") is None
+    # an incomplete store (canceled pass) has no signature
+    accumulator = ScarStoreAccumulator(tmp_path / "partial.scars", SIM_IDS, {"H": H, "W": W})
+    accumulator.add(0, np.ones((H, W)))
+    assert not accumulator.close()
+    assert open_scar_store(tmp_path / "partial.scars") is None
+
+
+def test_rejected_store_is_closed(store, cube, monkeypatch):
+    from post_processing import scars as module
+
+    closed = []
+    monkeypatch.setattr(module.SimulationStore, "close", lambda self: closed.append(self.kind))
+    assert open_scar_store(cube.filename) is None
+    assert open_scar_store(store.filename, {"H": H, "W": W + 1}) is None
+    assert closed == [CUBE_KIND, "scars"]
+
+
+def test_signature_changes_with_files(tmp_path):
+    afile = tmp_path / "ForestGrid01.csv"
+    afile.write_text("0,1\n")
+    signature = scars_signature({1: afile}, 1, 2)
+    afile.write_text("0,1,1\n")
+    assert scars_signature({1: afile}, 1, 2) != signature
+
+
+def test_parse_simulation_ids():
+    assert parse_simulation_ids("1-3, 7,,10-11") == [1, 2, 3, 7, 10, 11]
+
+
+@pytest.mark.parametrize("checkpoints", [1, 2, 4, 9, 50])
+def test_bp_convergence(store, scars, checkpoints):
+    count, diagnostics = bp_convergence(store, checkpoints=checkpoints)
+    # the last checkpoint always has every simulation, whatever the number of checkpoints
+    assert diagnostics["simulations"][-1] == len(SIM_IDS)
+    assert len(diagnostics["simulations"]) == min(checkpoints, len(SIM_IDS))
+    np.testing.assert_array_equal(count, scars.sum(axis=0))
+    burned = count > 0
+    assert diagnostics["burned_cells"][-1] == burned.sum()
+    width = wilson_width(count[burned], len(SIM_IDS))
+    assert diagnostics["max_ci_width"][-1] == pytest.approx(width.max())
+    assert diagnostics["mean_ci_width"][-1] == pytest.approx(width.mean())
+
+
+def test_bp_convergence_subset(store, scars):
+    count, diagnostics = bp_convergence(store, checkpoints=1, simulation_ids=[3, 19])
+    assert diagnostics["simulations"].tolist() == [2]
+    np.testing.assert_array_equal(count, dense_subset(scars, [3, 19]).sum(axis=0))
+
+
+def test_wilson_width_and_advisor():
+    # Wilson interval of 3 successes out of 10 at 95%: (0.1078, 0.6032)
+    assert wilson_width(np.array([3]), 10)[0] == pytest.approx(0.6032 - 0.1078, abs=1e-4)
+    assert wilson_width(np.array([0]), 10)[0] > 0
+    # p = 0.5, width 0.1: 4 z^2 p (1 - p) / width^2 = 384.16
+    assert simulations_needed(np.array([5]), 10, 0.1) == 385
+    assert simulations_needed(np.zeros(3), 10, 0.1) == 10
@@ -0,0 +1,90 @@
+#!python3
+"""Columnar simulation store round trips"""
+from pickle import dump as pickle_dump
+
+import numpy as np
+import pytest
+from post_processing.store import (MESSAGES_COLUMNS, SimulationStore, SimulationStoreWriter, load_messages,
+                                   open_store_args, reopen_store, store_parts)
+from post_processing.test_dpv import random_messages
+
+
+@pytest.fixture
+def data_list():
+    rng = np.random.default_rng(5)
+    return [random_messages(rng, size=int(rng.integers(0, 40))) for _ in range(7)]
+
+
+def write(filename, data_list, sim_ids=None, **kwargs):
+    with SimulationStoreWriter(filename, MESSAGES_COLUMNS, **kwargs) as writer:
+        for sim_id, data in zip(sim_ids or range(1, len(data_list) + 1), data_list):
+            writer.add(sim_id, data)
+    return filename
+
+
+@pytest.mark.parametrize("memory_map", [True, False])
+def test_round_trip(tmp_path, data_list, memory_map):
+    store = SimulationStore(write(tmp_path / "messages.msgs", data_list, meta={"a": 1}), memory_map=memory_map)
+    assert len(store) == len(data_list)
+    assert store.simulation_ids.tolist() == list(range(1, len(data_list) + 1))
+    assert store.header["meta"] == {"a": 1}
+    assert store.number_of_records == sum(len(data) for data in data_list)
+    for k, data in enumerate(data_list):
+        np.testing.assert_array_equal(store[k], data)
+        for col, values in zip(store.columns, store.columns_of(k)):
+            np.testing.assert_array_equal(values, data[col])
+    np.testing.assert_array_equal(store[-1], data_list[-1])
+    with pytest.raises(IndexError):
+        store[len(data_list)]
+    store.close()
+
+
+def test_append(tmp_path, data_list):
+    filename = write(tmp_path / "messages.msgs", data_list[:3])
+    write(filename, data_list[3:], sim_ids=[4, 5, 6, 7], append=True)
+    store = load_messages(filename)
+    assert store.simulation_ids.tolist() == [1, 2, 3, 4, 5, 6, 7]
+    for k, data in enumerate(data_list):
+        np.testing.assert_array_equal(store[k], data)
+    store.close()
+
+
+def test_append_drops_unindexed_tail(tmp_path, data_list):
+    """Bytes written after the last indexed simulation (an interrupted run) are discarded"""
+    filename = write(tmp_path / "messages.msgs", data_list[:2])
+    for part in store_parts(filename, MESSAGES_COLUMNS)[:3]:
+        with open(part, "ab") as f:
+            f.write(b"\x01" * 12)
+    write(filename, data_list[2:3], sim_ids=[3], append=True)
+    store = SimulationStore(filename)
+    for k, data in enumerate(data_list[:3]):
+        np.testing.assert_array_equal(store[k], data)
+    store.close()
+
+
+def test_append_other_kind(tmp_path, data_list):
+    filename = write(tmp_path / "messages.msgs", data_list[:1])
+    with pytest.raises(ValueError):
+        SimulationStoreWriter(filename, ("cell", "parent"), kind="trees", append=True)
+
+
+def test_empty_store(tmp_path):
+    store = SimulationStore(write(tmp_path / "messages.msgs", []))
+    assert len(store) == 0 and store.number_of_records == 0
+    assert list(store) == []
+
+
+def test_reopen(tmp_path, data_list):
+    store = SimulationStore(write(tmp_path / "messages.msgs", data_list), memory_map=False)
+    reopened = reopen_store(open_store_args(store))
+    assert reopened.memory_map is False
+    np.testing.assert_array_equal(reopened[2], data_list[2])
+    assert reopen_store(open_store_args(data_list)) is data_list
+
+
+def test_load_legacy_pickle(tmp_path, data_list):
+    filename = tmp_path / "messages.pickle"
+    with open(filename, "wb") as f:
+        pickle_dump(data_list, f)
+    for data, expected in zip(load_messages(filename), data_list):
+        np.testing.assert_array_equal(data, expected)
@@ -0,0 +1,51 @@
+#!python3
+"""Per simulation propagation tree centrality against networkx betweenness of the same tree"""
+import numpy as np
+import pytest
+from networkx import DiGraph, betweenness_centrality, single_source_dijkstra_path
+from post_processing.test_dpv import as_messages, random_messages
+from post_processing.trees import PropagationTree, tree_centrality
+
+
+def networkx_tree(data):
+    """Shortest propagation tree as the baseline DPV worker built it"""
+    msgG = DiGraph()
+    msgG.add_weighted_edges_from(data)
+    treeG = DiGraph()
+    for path in single_source_dijkstra_path(msgG, data[0][0], weight="time").values():
+        for u, v in zip(path[:-1], path[1:]):
+            treeG.add_edge(u, v)
+    return treeG
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_tree_centrality_is_normalized_networkx_betweenness(seed):
+    data = random_messages(np.random.default_rng(seed))
+    treeG = networkx_tree(data)
+    expected = betweenness_centrality(treeG, normalized=False)
+    # normalized by the number of ancestor-descendant pairs, the sum of depths
+    depths = PropagationTree.from_messages(data).depth()
+    pairs = depths[depths > 0].sum()
+    cells, centrality = tree_centrality(data)
+    assert set(cells.tolist()) == set(treeG.nodes)
+    np.testing.assert_allclose(centrality * pairs, [expected[cell] for cell in cells])
+
+
+def test_tree_centrality_ties():
+    """Cell 5 hangs from 4 (first message), so 4 is between the ancestors 0, 1 and 5"""
+    data = as_messages([(0, 1, 1), (0, 2, 1), (2, 3, 2), (1, 4, 3), (1, 3, 3), (4, 5, 4), (3, 5, 4)])
+    cells, centrality = tree_centrality(data)
+    pairs = 1 + 1 + 2 + 2 + 3
+    assert dict(zip(cells.tolist(), (centrality * pairs).round(9).tolist())) == {
+        0: 0,
+        1: 3,
+        2: 0,
+        4: 2,
+        3: 0,
+        5: 0,
+    }
+
+
+def test_empty_simulation():
+    cells, centrality = tree_centrality(as_messages([]))
+    assert len(cells) == 0 and len(centrality) == 0
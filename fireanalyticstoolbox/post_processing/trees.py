@@ -0,0 +1,247 @@
+#!python3
+"""
+propagation tree helpers
+
+Each messages file describes one fire spread from one ignition, its shortest propagation tree (as the Downstream
+Protection Value worker defines it: fewest propagation steps from the ignition, ties broken by message order) is
+computed with a first in first out breadth first search over a CSR adjacency, one frontier at a time with numpy; the
+out edges of each node are visited in message order, as networkx single_source_dijkstra_path over the messages DiGraph
+does, so parents are the same. It is returned as arrays:
+    cells   cell id of each dense node index, in order of first appearance in the messages
+    order   dense node indices in breadth first order (root first, every parent before its children)
+    parent  parent dense index of each node, -9999 for the root and for unreached nodes
+
+Per node quantities are then accumulated level by level with numpy (no recursion, no per node Python calls).
+
+Trees only depend on the messages, so they can be cached in a simulation store (kind "trees", next to the messages
+store), one record per reached cell in BFS order: the cell id and the BFS position of its parent. The
+cache header remembers the size and modification time of the messages it was built from, a stale cache is ignored.
+For `results/Messages/messages.msgs` the cache is `results/Messages/messages_trees.trees` (+ its column files).
+
+Sample usage:
+    tree = PropagationTree.from_messages(data)
+    sizes = tree.subtree_sums(np.ones(len(tree.cells)))
+    tree = PropagationTree.from_arrays(*tree_cache.columns_of(k))
+"""
+from multiprocessing import Pool
+from pathlib import Path
+from platform import system as platform_system
+
+import numpy as np
+
+from .centrality import _ranges
+from .store import SimulationStore, SimulationStoreWriter, open_store_args, reopen_store
+
+NO_PARENT = -9999
+TREES_KIND = "trees"
+TREES_EXT = "trees"
+TREES_COLUMNS = ("cell", "parent")
+TREES_DTYPE = np.int32
+# bumped when the tree construction changes, so caches built by older versions are rebuilt
+TREES_VERSION = 2
+
+
+class PropagationTree:
+    """Shortest propagation tree of one simulation"""
+
+    def __init__(self, cells: np.ndarray, order: np.ndarray, parent: np.ndarray):
+        self.cells = cells
+        self.order = order
+        self.parent = parent
+        # BFS order is sorted by depth, level L + 1 is the contiguous block of children of level L
+        position = np.empty(len(cells), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        parent_position = position[parent[order[1:]]]
+        self.level_bounds = [0, 1]
+        while self.level_bounds[-1] < len(order):
+            self.level_bounds += [np.searchsorted(parent_position, self.level_bounds[-1], side="left") + 1]
+
+    @classmethod
+    def from_messages(cls, data, root=None):
+        """Build from a structured array with fields i, j (t is not used); root defaults to the first message i"""
+        if root is None:
+            root = data["i"][0]
+        stream = np.column_stack((data["i"], data["j"])).ravel()
+        cells, first, inverse = np.unique(stream, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind="stable")
+        rank = np.empty(len(cells), dtype=np.int64)
+        rank[order] = np.arange(len(cells))
+        inverse = rank[inverse.ravel()].reshape(-1, 2)
+        cells = cells[order]
+        n = len(cells)
+        # unique edges, first occurrence, grouped by tail keeping message order (neighbors visiting order)
+        _, first_edge = np.unique(inverse[:, 0] * n + inverse[:, 1], return_index=True)
+        first_edge.sort()
+        u, v = inverse[first_edge, 0], inverse[first_edge, 1]
+        by_tail = np.argsort(u, kind="stable")
+        tails, heads = u[by_tail], v[by_tail]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(u, minlength=n))
+        # first in first out breadth first search, one frontier at a time: the out edges of the frontier (in frontier,
+        # then message order) are scanned and each unvisited head is claimed by its first edge
+        start = int(np.flatnonzero(cells == root)[0])
+        parent = np.full(n, NO_PARENT, dtype=np.int64)
+        visited = np.zeros(n, dtype=bool)
+        visited[start] = True
+        levels = [np.array([start])]
+        while True:
+            frontier = levels[-1]
+            edges = _ranges(indptr[frontier], indptr[frontier + 1])
+            new = ~visited[heads[edges]]
+            edges = edges[new]
+            if edges.size == 0:
+                break
+            _, first = np.unique(heads[edges], return_index=True)
+            first.sort()
+            children = heads[edges[first]]
+            parent[children] = tails[edges[first]]
+            levels += [children]
+            visited[children] = True
+        return cls(cells, np.concatenate(levels), parent)
+
+    @classmethod
+    def from_arrays(cls, cells, parent):
+        """Rebuild from to_arrays output: cells in BFS order and the BFS position of their parents"""
+        return cls(np.asarray(cells), np.arange(len(cells)), np.asarray(parent))
+
+    def to_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """Compact form of the reached cells: cell ids in BFS order and BFS position of each parent (NO_PARENT root)"""
+        position = np.empty(len(self.cells), dtype=np.int64)
+        position[self.order] = np.arange(len(self.order))
+        parent = self.parent[self.order]
+        parent_position = np.full(len(self.order), NO_PARENT, dtype=np.int64)
+        has_parent = parent != NO_PARENT
+        parent_position[has_parent] = position[parent[has_parent]]
+        return self.cells[self.order], parent_position
+
+    def __len__(self):
+        return len(self.order)
+
+    def levels(self):
+        """Blocks of the BFS order with the same depth, from the root"""
+        for start, stop in zip(self.level_bounds[:-1], self.level_bounds[1:]):
+            yield self.order[start:stop]
+
+    def depth(self) -> np.ndarray:
+        """Number of propagation steps from the root of each node (-1 if unreached)"""
+        depth = np.full(len(self.cells), -1, dtype=np.int64)
+        for level, nodes in enumerate(self.levels()):
+            depth[nodes] = level
+        return depth
+
+    def subtree_sums(self, values: np.ndarray) -> np.ndarray:
+        """Sum of values over the subtree of each node, accumulated bottom-up level by level
+
+        Children of a node are added in BFS order, so floating point results are deterministic
+        """
+        sums = np.array(values, copy=True)
+        levels = list(self.levels())
+        for nodes in reversed(levels[1:]):
+            np.add.at(sums, self.parent[nodes], sums[nodes])
+        return sums
+
+
+def tree_centrality(data) -> tuple[np.ndarray, np.ndarray]:
+    """Betweenness of each cell of one simulation propagation tree, in O(nodes)
+
+    In a tree the propagation paths through a node are those from any of its ancestors to any of its descendants:
+    depth x (subtree size - 1). Normalized by the number of ancestor-descendant pairs (sum of depths), so each fire
+    weights the same whatever its size.
+    Returns (cells, centrality) of the reached cells
+    """
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    tree = PropagationTree.from_messages(data)
+    reached = tree.order
+    depth = tree.depth()
+    descendants = tree.subtree_sums(np.ones(len(tree.cells), dtype=np.int64)) - 1
+    paths = depth[reached].sum()
+    centrality = depth[reached] * descendants[reached] / paths if paths > 0 else np.zeros(len(reached))
+    return tree.cells[reached], centrality
+
+
+def tree_arrays(data) -> tuple[np.ndarray, np.ndarray]:
+    """Compact propagation tree of one simulation (see PropagationTree.to_arrays)"""
+    if len(data) == 0:
+        return np.empty(0, dtype=TREES_DTYPE), np.empty(0, dtype=TREES_DTYPE)
+    return PropagationTree.from_messages(data).to_arrays()
+
+
+def tree_cache_file(messages_file: Path) -> Path:
+    """Tree cache store next to the messages (distinct stem, so store parts do not collide)"""
+    messages_file = Path(messages_file)
+    return messages_file.with_name(f"{messages_file.stem}_trees.{TREES_EXT}")
+
+
+def messages_signature(messages_file: Path, number_of_simulations: int) -> dict:
+    """What a tree cache depends on: the messages file name, size, modification time, number of simulations and the
+    tree construction version"""
+    stat = Path(messages_file).stat()
+    return {
+        "version": TREES_VERSION,
+        "messages": Path(messages_file).name,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "simulations": number_of_simulations,
+    }
+
+
+def open_tree_cache(filename: Path, signature: dict, memory_map: bool = True):
+    """Tree cache store if it exists and was built from the same messages, else None"""
+    if not Path(filename).is_file():
+        return None
+    try:
+        cache = SimulationStore(filename, memory_map=memory_map)
+    except (OSError, ValueError, KeyError):
+        return None
+    if cache.kind != TREES_KIND or cache.header.get("meta") != signature:
+        cache.close()
+        return None
+    return cache
+
+
+# messages reopened by each pool worker
+_messages = None
+
+
+def _open_messages(store_args):
+    global _messages
+    _messages = reopen_store(store_args)
+
+
+def _tree_arrays_at(k):
+    return tree_arrays(_messages[k])
+
+
+def build_tree_cache(data_list, filename: Path, signature: dict, threads: int = 1, feedback=None):
+    """Compute every simulation propagation tree (in a pool of processes) into a tree cache store
+
+    Workers get simulation indices and read the messages themselves, so only trees travel back.
+    Returns the opened cache (same memory_map mode as data_list), or None if canceled (the partial cache is not valid
+    for open_tree_cache)
+    """
+    nsim = len(data_list)
+    simulation_ids = getattr(data_list, "simulation_ids", range(1, nsim + 1))
+    if threads > 1 and platform_system() != "Windows" and nsim > 1:
+        pool = Pool(threads, initializer=_open_messages, initargs=(open_store_args(data_list),))
+        results = pool.imap(_tree_arrays_at, range(nsim), chunksize=max(1, min(32, nsim // (4 * threads))))
+    else:
+        pool = None
+        results = map(tree_arrays, data_list)
+    completed = False
+    writer = SimulationStoreWriter(filename, TREES_COLUMNS, TREES_DTYPE, kind=TREES_KIND)
+    try:
+        for count, (cells, parent) in enumerate(results):
+            writer.add(simulation_ids[count], cell=cells, parent=parent)
+            if feedback:
+                if feedback.isCanceled():
+                    break
+                feedback.setProgress(int((count + 1) / nsim * 100))
+        completed = len(writer) == nsim
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        writer.meta = signature if completed else None
+        writer.close()
+    return SimulationStore(filename, memory_map=getattr(data_list, "memory_map", True)) if completed else None